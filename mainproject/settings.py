@@ -28,6 +28,13 @@ DEBUG = config('DEBUG', default=False, cast=bool)
 ALLOWED_HOSTS = config('ALLOWED_HOSTS', default='', cast=Csv())
 MATD3_NAME = mark_safe(config('MATD3_NAME', default='MatD&#xb3;'))
 MATD3_URL = config('MATD3_URL', default='')
+# Subsets with at least this many data points are stored as a single
+# packed array instead of one row per value (0 disables packing).
+MATD3_PACK_THRESHOLD = config('MATD3_PACK_THRESHOLD', default=10000,
+                              cast=int)
+# Number of processes for rendering figures (0 renders in the caller)
+MATD3_RENDER_PROCESSES = config('MATD3_RENDER_PROCESSES', default=2,
+                                cast=int)
 # DEFAULT_AUTO_FIELD='django.db.models.AutoField' #Uncomment this line if using Django version 3.2 or higher
 
 # Application definition
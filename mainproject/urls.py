@@ -10,6 +10,7 @@ from django.urls import path
 from django.views import generic
 
 from . import views
+from materials import views as materials_views
 
 
 urlpatterns = [
@@ -21,4 +22,7 @@ urlpatterns = [
     path('materials/', include('materials.urls')),
     path('accounts/', include('accounts.urls')),
     path('nested_admin/', include('nested_admin.urls')),
+    # Qresp figures are created on demand when first requested
+    path(f'{settings.MEDIA_URL.lstrip("/")}qresp/dataset_<int:pk>/figure.png',
+         materials_views.qresp_figure),
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
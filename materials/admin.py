@@ -3,6 +3,7 @@ import nested_admin
 
 from django import forms
 from django.contrib import admin
+from django.contrib.admin.widgets import FilteredSelectMultiple
 from django.urls import reverse
 from django.utils import timezone
 from django.utils.safestring import mark_safe
@@ -221,6 +222,7 @@ class SubsetInline(BaseMixin, nested_admin.NestedStackedInline):
     model = models.Subset
     extra = 0
     fields = [f.name for f in models.Subset._meta.local_fields]
+    readonly_fields = BaseMixin.readonly_fields + ('datapoint_count',)
     inlines = [NumericalValueFixedInline]
 
 
@@ -235,19 +237,62 @@ class NotesInline(BaseMixin, nested_admin.NestedStackedInline):
     extra = 0
 
 
+class DatasetAdminForm(forms.ModelForm):
+    """Edit the link group as a list of linked data sets."""
+    linked_datasets = forms.ModelMultipleChoiceField(
+        queryset=models.Dataset.objects.all(), required=False,
+        widget=FilteredSelectMultiple('linked data sets', False))
+
+    class Meta:
+        model = models.Dataset
+        exclude = ['link_group']
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.instance.pk:
+            self.initial['linked_datasets'] = [
+                dataset.pk for dataset in self.instance.linked_datasets()]
+            self.fields['linked_datasets'].queryset = (
+                models.Dataset.objects.exclude(pk=self.instance.pk))
+
+
 class DatasetAdmin(BaseAdmin):
     list_display = ('id', 'primary_property', 'caption', 'created_by',
                     'updated_by', 'updated')
     search_fields = ['id',]
     list_filter = ('updated',)
     ordering = ('-updated',)
-    fields = ([f.name for f in models.Dataset._meta.local_fields] +
-              ['linked_to'])
+    form = DatasetAdminForm
+    fields = ([f.name for f in models.Dataset._meta.local_fields
+               if f.name != 'link_group'] + ['linked_datasets'])
+    readonly_fields = BaseAdmin.readonly_fields + ('all_entries_count',)
     inlines = (SynthesisInline, ExperimentalInline, ComputationalInline,
                SubsetInline, FilesInline, NotesInline)
-    filter_horizontal = ['linked_to']
+
+    def save_related(self, request, form, formset, change):
+        super().save_related(request, form, formset, change)
+        if 'linked_datasets' in form.changed_data:
+            form.instance.set_linked(form.cleaned_data['linked_datasets'])
+
     def view_on_site(self, obj):
         return reverse('materials:dataset', kwargs={'pk': obj.pk})
 
 
 admin.site.register(models.Dataset, DatasetAdmin)
+
+
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'task', 'dataset', 'status', 'attempts', 'created',
+                    'started', 'finished')
+    list_filter = ('status', 'task')
+    search_fields = ['id', 'task', 'dataset__id']
+    readonly_fields = ('created', 'started', 'finished', 'error')
+    actions = ['retry']
+
+    def retry(self, request, queryset):
+        queryset.update(status=models.Job.PENDING, attempts=0,
+                        run_after=timezone.now())
+    retry.short_description = 'Retry selected jobs'
+
+
+admin.site.register(models.Job, JobAdmin)
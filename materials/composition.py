@@ -0,0 +1,282 @@
+# This file is covered by the BSD license. See LICENSE in the root directory.
+"""Element composition of the systems and search by composition.
+
+The formula and the organic and inorganic components of a system are
+parsed into the number of atoms of each element whenever the system is
+saved (see signals.py). The counts are stored as SystemElement rows
+and, for the formula, also as a bitmask of the elements in
+System.element_mask_1 and System.element_mask_2. The search functions
+below then only need to look up the index instead of scanning and
+parsing the formulas.
+
+"""
+import re
+
+from django.db.models import F
+
+from . import models
+
+# Element symbols in the order of the atomic number
+ELEMENTS = (
+    'H', 'He', 'Li', 'Be', 'B', 'C', 'N', 'O', 'F', 'Ne', 'Na', 'Mg', 'Al',
+    'Si', 'P', 'S', 'Cl', 'Ar', 'K', 'Ca', 'Sc', 'Ti', 'V', 'Cr', 'Mn', 'Fe',
+    'Co', 'Ni', 'Cu', 'Zn', 'Ga', 'Ge', 'As', 'Se', 'Br', 'Kr', 'Rb', 'Sr',
+    'Y', 'Zr', 'Nb', 'Mo', 'Tc', 'Ru', 'Rh', 'Pd', 'Ag', 'Cd', 'In', 'Sn',
+    'Sb', 'Te', 'I', 'Xe', 'Cs', 'Ba', 'La', 'Ce', 'Pr', 'Nd', 'Pm', 'Sm',
+    'Eu', 'Gd', 'Tb', 'Dy', 'Ho', 'Er', 'Tm', 'Yb', 'Lu', 'Hf', 'Ta', 'W',
+    'Re', 'Os', 'Ir', 'Pt', 'Au', 'Hg', 'Tl', 'Pb', 'Bi', 'Po', 'At', 'Rn',
+    'Fr', 'Ra', 'Ac', 'Th', 'Pa', 'U', 'Np', 'Pu', 'Am', 'Cm', 'Bk', 'Cf',
+    'Es', 'Fm', 'Md', 'No', 'Lr', 'Rf', 'Db', 'Sg', 'Bh', 'Hs', 'Mt', 'Ds',
+    'Rg', 'Cn', 'Nh', 'Fl', 'Mc', 'Lv', 'Ts', 'Og')
+ATOMIC_NUMBERS = {symbol: i + 1 for i, symbol in enumerate(ELEMENTS)}
+
+# Common abbreviations of the organic cations
+ABBREVIATIONS = {
+    'MA': 'CH3NH3',
+    'FA': 'CH(NH2)2',
+    'GA': 'C(NH2)3',
+    'EA': 'CH3CH2NH3',
+    'BA': 'C4H9NH3',
+    'PEA': 'C6H5C2H4NH3',
+}
+
+# Number of elements in each of the two bitmasks of a system. Bit i of
+# element_mask_1 is the element with the atomic number i + 1 and bit i
+# of element_mask_2 the one with i + 1 + MASK_BITS. 60 bits leave the
+# sign bit of a 64-bit integer alone.
+MASK_BITS = 60
+
+# Model field of each component
+COMPONENT_FIELDS = {
+    models.SystemElement.FORMULA: 'formula',
+    models.SystemElement.ORGANIC: 'organic',
+    models.SystemElement.INORGANIC: 'inorganic',
+}
+
+# Tolerance of the comparisons of the counts
+TOLERANCE = 1e-6
+
+_TOKEN = re.compile(r'\s*(?:'
+                    rf'({"|".join(sorted(ABBREVIATIONS, key=len)[::-1])})'
+                    r'(?![a-z])|([A-Z][a-z]?)|([(\[{])|([)\]}])|'
+                    r'(\d+(?:\.\d+)?|\.\d+))')
+_ADDUCT = re.compile(r'\s*(\d+(?:\.\d+)?)?(.*)', re.DOTALL)
+
+
+def _add(counts, other, factor):
+    for element, count in other.items():
+        counts[element] = counts.get(element, 0) + factor*count
+
+
+def _parse(text, formula):
+    stack = [{}]
+    last = None  # Counts that a following number multiplies
+    pos = 0
+    text = text.rstrip()
+    while pos < len(text):
+        match = _TOKEN.match(text, pos)
+        if not match:
+            raise ValueError(f'Cannot parse "{text[pos:].strip()}" of '
+                             f'{formula}')
+        abbreviation, element, opening, closing, number = match.groups()
+        pos = match.end()
+        if abbreviation:
+            last = _parse(ABBREVIATIONS[abbreviation], formula)
+            _add(stack[-1], last, 1)
+        elif element:
+            if element not in ATOMIC_NUMBERS:
+                raise ValueError(f'Unknown element {element} in {formula}')
+            last = {element: 1}
+            _add(stack[-1], last, 1)
+        elif opening:
+            stack.append({})
+            last = None
+        elif closing:
+            if len(stack) == 1:
+                raise ValueError(f'Unbalanced parentheses in {formula}')
+            last = stack.pop()
+            _add(stack[-1], last, 1)
+        else:
+            if last is None:
+                raise ValueError(f'Misplaced number {number} in {formula}')
+            _add(stack[-1], last, float(number) - 1)
+            last = None
+    if len(stack) > 1:
+        raise ValueError(f'Unbalanced parentheses in {formula}')
+    return stack[0]
+
+
+def parse_formula(formula):
+    """Return the number of atoms of each element of a chemical formula.
+
+    The formula may contain nested parentheses or brackets, fractional
+    counts, adducts separated by · or * with optional coefficients
+    (e.g., CuSO4·5H2O), and the abbreviations of ABBREVIATIONS (e.g.,
+    MAPbI3). The result is a dictionary from the element symbols to
+    the counts per formula unit. Raise ValueError if the formula
+    cannot be parsed, e.g., because it is empty or contains an
+    unknown abbreviation.
+
+    """
+    counts = {}
+    for adduct in re.split('[·*]', formula):
+        coefficient, text = _ADDUCT.match(adduct).groups()
+        _add(counts, _parse(text, formula), float(coefficient or 1))
+    counts = {element: round(count, 6) for element, count in counts.items()
+              if round(count, 6) > 0}
+    if not counts:
+        raise ValueError(f'No elements in {formula}')
+    return counts
+
+
+def element_masks(elements):
+    """Return the two bitmasks of a set of element symbols."""
+    masks = [0, 0]
+    for element in elements:
+        index = ATOMIC_NUMBERS[element] - 1
+        masks[index // MASK_BITS] |= 1 << index % MASK_BITS
+    return tuple(masks)
+
+
+def _composition_rows(system):
+    rows = []
+    masks = (0, 0)
+    for component, name in COMPONENT_FIELDS.items():
+        try:
+            counts = parse_formula(getattr(system, name))
+        except ValueError:
+            continue
+        rows.extend(models.SystemElement(
+            system_id=system.pk, component=component,
+            element=ATOMIC_NUMBERS[element], count=count)
+                    for element, count in counts.items())
+        if component == models.SystemElement.FORMULA:
+            masks = element_masks(counts)
+    return rows, masks
+
+
+def update_composition(system):
+    """Replace the stored composition of a saved system.
+
+    The parts of the system that cannot be parsed are left out of the
+    index and thus not found by the composition search.
+
+    """
+    rows, masks = _composition_rows(system)
+    models.SystemElement.objects.filter(system=system).delete()
+    models.SystemElement.objects.bulk_create(rows)
+    system.element_mask_1, system.element_mask_2 = masks
+    models.System.objects.filter(pk=system.pk).update(
+        element_mask_1=masks[0], element_mask_2=masks[1])
+
+
+def rebuild_compositions(batch_size=2000):
+    """Parse all systems from scratch and return the number of rows."""
+    models.SystemElement.objects.all().delete()
+    n_rows = 0
+    rows = []
+    systems = []
+    for system in models.System.objects.only(
+            *COMPONENT_FIELDS.values()).iterator():
+        system_rows, masks = _composition_rows(system)
+        rows.extend(system_rows)
+        system.element_mask_1, system.element_mask_2 = masks
+        systems.append(system)
+        if len(rows) >= batch_size:
+            n_rows += len(models.SystemElement.objects.bulk_create(rows))
+            rows = []
+    n_rows += len(models.SystemElement.objects.bulk_create(rows))
+    models.System.objects.bulk_update(
+        systems, ['element_mask_1', 'element_mask_2'], batch_size=batch_size)
+    return n_rows
+
+
+def find(contains=(), excludes=(), ranges=None, only=None,
+         component=models.SystemElement.FORMULA):
+    """Return the systems of a given composition ordered by formula.
+
+    contains and excludes are the element symbols that the component
+    of the system must or must not contain. ranges is a dictionary
+    from element symbols to (minimum, maximum) pairs of the number of
+    atoms per formula unit, where either bound may be None. If only
+    is given, the component contains no other elements than these.
+    Only systems whose component could be parsed are returned. Raise
+    ValueError for an unknown element.
+
+    """
+    for element in (*contains, *excludes, *(ranges or {}), *(only or ())):
+        if element not in ATOMIC_NUMBERS:
+            raise ValueError(f'Unknown element {element}')
+    systems = models.System.objects.all()
+    rows = models.SystemElement.objects.filter(component=component)
+    ranges = {**{element: (None, None) for element in contains},
+              **(ranges or {})}
+    for element, (minimum, maximum) in ranges.items():
+        counts = rows.filter(element=ATOMIC_NUMBERS[element])
+        if minimum is not None:
+            counts = counts.filter(count__gte=minimum - TOLERANCE)
+        if maximum is not None:
+            counts = counts.filter(count__lte=maximum + TOLERANCE)
+        systems = systems.filter(pk__in=counts.values('system'))
+    if component == models.SystemElement.FORMULA:
+        # The bitmasks need no join
+        excluded = element_masks(excludes)
+        if only is not None:
+            allowed = element_masks(only)
+            excluded = tuple(mask | (((1 << MASK_BITS) - 1) & ~allowed_mask)
+                             for mask, allowed_mask in zip(excluded, allowed))
+        systems = systems.exclude(element_mask_1=0, element_mask_2=0)
+        if any(excluded):
+            systems = systems.annotate(
+                excluded_1=F('element_mask_1').bitand(excluded[0]),
+                excluded_2=F('element_mask_2').bitand(excluded[1])).filter(
+                    excluded_1=0, excluded_2=0)
+    else:
+        systems = systems.filter(pk__in=rows.values('system'))
+        if excludes:
+            systems = systems.exclude(pk__in=rows.filter(element__in=[
+                ATOMIC_NUMBERS[element] for element in excludes]).values(
+                    'system'))
+        if only is not None:
+            systems = systems.exclude(pk__in=rows.exclude(element__in=[
+                ATOMIC_NUMBERS[element] for element in only]).values(
+                    'system'))
+    return systems.order_by('formula')
+
+
+def parse_query(text):
+    """Return the arguments of find for a query such as "Sn Br -Pb I=3".
+
+    The query consists of element symbols separated by spaces. A
+    symbol alone must be contained, one preceded by - must not be, and
+    one followed by =count, =minimum:maximum, =minimum:, or =:maximum
+    must be contained with that many atoms per formula unit. Raise
+    ValueError if the query is invalid.
+
+    """
+    contains, excludes, ranges = [], [], {}
+    for term in text.split():
+        match = re.fullmatch(
+            r'(-)?([A-Z][a-z]?)(?:=(\d*\.?\d*)(?:(:)(\d*\.?\d*))?)?', term)
+        if not match:
+            raise ValueError(f'Invalid search term {term}')
+        exclude, element, minimum, colon, maximum = match.groups()
+        if element not in ATOMIC_NUMBERS:
+            raise ValueError(f'Unknown element {element}')
+        try:
+            minimum = float(minimum) if minimum else None
+            maximum = (float(maximum) if maximum else None) if colon else (
+                minimum)
+        except ValueError:
+            raise ValueError(f'Invalid count in {term}')
+        if exclude and match.group(3) is not None:
+            raise ValueError(f'Excluded element with a count in {term}')
+        elif exclude:
+            excludes.append(element)
+        elif minimum is None and maximum is None:
+            contains.append(element)
+        else:
+            ranges[element] = (minimum, maximum)
+    if not (contains or excludes or ranges):
+        raise ValueError('No elements in the query')
+    return {'contains': contains, 'excludes': excludes, 'ranges': ranges}
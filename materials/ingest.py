@@ -0,0 +1,893 @@
+# This file is covered by the BSD license. See LICENSE in the root directory.
+"""Parsing and bulk insertion of the main (numerical) data of a data set."""
+import collections
+import itertools
+import json
+import os
+import re
+
+import numpy
+from django.core.files.base import ContentFile, File
+from django.db import transaction
+from django.db.models import F
+
+from . import models
+from mainproject import settings
+
+# A single value as entered on the data form, e.g., "1.2", "<1.2",
+# "1.2(3)", "1.2±0.3", or "1.2...1.5".
+_NUMBER = r'-?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?'
+_VALUE = (rf'(?P<marker>[<>≈~]?)(?P<value>{_NUMBER})'
+          rf'(?:\((?P<paren>[\d.]*)\)|±(?P<pm>{_NUMBER})'
+          rf'|\.\.\.(?P<upper>{_NUMBER}))?')
+_VALUE_RE = re.compile(_VALUE)
+# Anything that makes a value more than a plain number
+_SPECIAL_RE = re.compile(r'[<>≈~(±]|\.\.\.')
+_COMMENT_RE = re.compile(r'^\s*#.*$', re.MULTILINE)
+_VALUE_TYPES = {
+    '<': models.NumericalValue.UPPER_BOUND,
+    '>': models.NumericalValue.LOWER_BOUND,
+    '≈': models.NumericalValue.APPROXIMATE,
+    '~': models.NumericalValue.APPROXIMATE,
+}
+
+ParsedValues = collections.namedtuple(
+    'ParsedValues', ['values', 'value_types', 'errors', 'upper_bounds'])
+ParsedValues.__doc__ = """Numerical values parsed from text.
+
+All fields are NumPy arrays of the same shape. Missing errors and
+upper bounds are NaN.
+
+"""
+
+
+def skip_this_line(line):
+    """Test whether the line is empty or a comment."""
+    return not line.strip() or re.match(r'\s*#', line)
+
+
+def _paren_error(value, error):
+    """Return the error given in parentheses as float.
+
+    If the error has no decimal point, its last digit refers to the
+    last digit of the value, e.g., 1.234(12) means 1.234±0.012.
+
+    """
+    error = error.lstrip('0')
+    if '.' not in error and len(value) > len(error):
+        error = re.sub('[1-9]', '0', value[:len(value)-len(error)]) + error
+    return float(error) if error else numpy.nan
+
+
+def _parse_tokens(tokens):
+    """Parse a list of single values into a ParsedValues object.
+
+    Plain numbers, which are the vast majority, are converted by NumPy
+    in one go. Only the tokens containing a marker, an error, or an
+    upper bound are found with a single regex search over the whole
+    block and processed individually.
+
+    """
+    n = len(tokens)
+    value_types = numpy.zeros(n, dtype=numpy.uint8)
+    errors = numpy.full(n, numpy.nan)
+    upper_bounds = numpy.full(n, numpy.nan)
+    block = '\n'.join(tokens)
+    special = [match.start() for match in _SPECIAL_RE.finditer(block)]
+    if special:
+        tokens = list(tokens)
+        offsets = numpy.zeros(n + 1, dtype=int)
+        numpy.cumsum(numpy.fromiter(map(len, tokens), int, n) + 1,
+                     out=offsets[1:])
+        for i in numpy.unique(
+                numpy.searchsorted(offsets, special, side='right') - 1):
+            match = _VALUE_RE.fullmatch(tokens[i])
+            if not match:
+                raise ValueError(f'Could not process value: {tokens[i]}')
+            marker, tokens[i], paren, pm, upper = match.groups()
+            value_types[i] = _VALUE_TYPES.get(
+                marker, models.NumericalValue.ACCURATE)
+            if paren:
+                errors[i] = _paren_error(tokens[i], paren)
+            elif pm:
+                errors[i] = float(pm)
+            elif upper:
+                upper_bounds[i] = float(upper)
+    try:
+        values = numpy.array(tokens, dtype=float)
+        if not numpy.isfinite(values).all():
+            raise ValueError
+    except ValueError:
+        # Either not a number or too large for a float, e.g., 1e999
+        for token in tokens:
+            if (not _VALUE_RE.fullmatch(token)
+                    or not numpy.isfinite(float(token))):
+                raise ValueError(f'Could not process value: {token}')
+        raise
+    return ParsedValues(values.reshape(n), value_types, errors, upper_bounds)
+
+
+def parse_values(text, columns=None):
+    """Parse a block of values as entered on the data form.
+
+    Empty lines and comments are skipped. If columns is None, each
+    value is treated separately and the fields of the result are 1-d
+    arrays. Otherwise, only the first "columns" values of each line
+    are read and the arrays have the shape (number of lines,
+    columns). A ValueError is raised if the text cannot be processed.
+
+    """
+    if '#' in text:
+        text = _COMMENT_RE.sub('', text)
+    if columns is None:
+        tokens = text.split()
+    else:
+        lines = [line for line in text.splitlines()
+                 if line and not line.isspace()]
+        counts = numpy.fromiter(map(len, map(str.split, lines)), int,
+                                len(lines))
+        if (counts < columns).any():
+            line = lines[numpy.flatnonzero(counts < columns)[0]]
+            raise ValueError(f'Could not process line: {line}')
+        if (counts == columns).all():
+            tokens = text.split()
+        else:
+            tokens = list(itertools.chain.from_iterable(
+                line.split()[:columns] for line in lines))
+    try:
+        parsed = _parse_tokens(tokens)
+    except ValueError:
+        for line in text.splitlines():
+            if not all(map(_VALUE_RE.fullmatch, line.split()[:columns])):
+                raise ValueError(f'Could not process line: {line}')
+        raise
+    if columns is None:
+        return parsed
+    return ParsedValues(*(x.reshape(-1, columns) for x in parsed))
+
+
+Geometry = collections.namedtuple(
+    'Geometry', ['lattice_vectors', 'coordinate_types', 'elements',
+                 'coordinates'])
+Geometry.__doc__ = """Atomic structure parsed from a geometry file.
+
+lattice_vectors and coordinates are ParsedValues with three columns.
+coordinate_types ("atom" or "atom_frac") and elements contain one
+entry per row of coordinates.
+
+"""
+
+
+def parse_geometry(text):
+    """Parse the contents of an FHI-aims geometry.in file.
+
+    The lines are only split into tokens here. All numbers are then
+    converted together, so that large structures are parsed about as
+    fast as plain numerical data. Empty lines and comments (# or //)
+    are skipped. A ValueError is raised for any other line that is
+    not a lattice vector or an atom.
+
+    """
+    lattice_vectors, atoms, coordinate_types, elements = [], [], [], []
+    for line in text.splitlines():
+        tokens = line.split()
+        if not tokens or tokens[0].startswith(('#', '//')):
+            continue
+        if tokens[0] == 'lattice_vector' and len(tokens) >= 4:
+            lattice_vectors.append(tokens[1:4])
+        elif tokens[0] in ('atom', 'atom_frac') and len(tokens) >= 5:
+            atoms.append(tokens[1:4])
+            coordinate_types.append(tokens[0])
+            elements.append(tokens[4])
+        else:
+            raise ValueError(f'Could not process line: {line}')
+    parsed = []
+    for rows in lattice_vectors, atoms:
+        try:
+            values = _parse_tokens(list(itertools.chain.from_iterable(rows)))
+        except ValueError as error:
+            raise ValueError(f'{error} in the geometry')
+        parsed.append(ParsedValues(*(x.reshape(-1, 3) for x in values)))
+    return Geometry(parsed[0], coordinate_types, elements, parsed[1])
+
+
+def clean_value(value):
+    """Return value as float and determine its type.
+
+    The value is first stripped of markers such as '<', which are used
+    to determine its type. If the value contains an error (or
+    uncertainty) or an upper bound, those are also returned. Otherwise
+    they are None.
+
+    """
+    match = _VALUE_RE.fullmatch(''.join(value.split()))
+    if not match:
+        raise ValueError(f'Could not process value: {value}')
+    marker, value, paren, pm, upper = match.groups()
+    error = None
+    if paren:
+        error = _paren_error(value, paren)
+        if numpy.isnan(error):
+            error = None
+    elif pm:
+        error = float(pm)
+    return (float(value),
+            _VALUE_TYPES.get(marker, models.NumericalValue.ACCURATE),
+            error,
+            float(upper) if upper else None)
+
+
+def bulk_create_with_pks(model, objs, owned, batch_size=None):
+    """Insert objects with bulk_create and make sure each has its pk.
+
+    Some database backends return the primary keys of the inserted
+    rows and bulk_create then sets them directly. Others (MySQL,
+    SQLite) do not. In that case, the keys are read back from "owned",
+    which is a queryset of rows that only the current transaction can
+    have created, e.g., all data points of a freshly created data
+    set. Since auto-increment keys grow with the order of insertion,
+    the latest len(objs) rows of "owned" are exactly the ones that
+    were just inserted, no matter what other requests are writing to
+    the same table concurrently. batch_size is passed on to
+    bulk_create.
+
+    """
+    model.objects.bulk_create(objs, batch_size=batch_size)
+    if objs and objs[0].pk is None:
+        pks = list(owned.order_by('-pk')[:len(objs)].values_list(
+            'pk', flat=True))
+        if len(pks) != len(objs):
+            raise RuntimeError(f'Expected {len(objs)} new rows of '
+                               f'{model.__name__} but found {len(pks)}')
+        for obj, pk in zip(objs, reversed(pks)):
+            obj.pk = pk
+    return objs
+
+
+def _pack(parsed):
+    """Return ParsedValues as an array of PackedValues.DTYPE."""
+    array = numpy.empty(parsed.values.shape,
+                        dtype=models.PackedValues.DTYPE)
+    for name, field in zip(array.dtype.names, parsed):
+        array[name] = field
+    return array
+
+
+class DatapointWriter:
+    """Collect data points and their contents for a bulk insert.
+
+    Numerical values and symbols refer to their data point by its
+    index in the list of data points, so that nothing needs to be
+    written to the database before flush() is called. flush() then
+    inserts each model with bulk_create and links the rows using the
+    primary keys of this data set only. Instead of a single data set,
+    a list of freshly created data sets can be given, which are then
+    written together.
+
+    Once about batch_size rows are buffered, they are flushed before
+    the next data point is added, so that the memory use does not
+    grow with the size of the data set. Each INSERT statement also
+    contains at most batch_size rows. The caller must still call
+    flush() at the end and should run everything in a transaction.
+    Indices of data points are only valid until the next flush.
+
+    """
+    batch_size = 2000
+
+    def __init__(self, dataset, user, batch_size=None):
+        self.datasets = (
+            [dataset] if isinstance(dataset, models.Dataset) else dataset)
+        self.user = user
+        if batch_size:
+            self.batch_size = batch_size
+        self.clear()
+
+    def clear(self):
+        """Empty all buffers."""
+        self.datapoints = []
+        # Pairs of (index of data point, model instance)
+        self.values = []
+        self.symbols = []
+        # Same length as self.values. None if not present.
+        self.errors = []
+        self.upper_bounds = []
+        self.packed_values = []
+        self.atomic_structures = []
+        # Number of values in self.packed_values and
+        # self.atomic_structures
+        self.n_packed = 0
+
+    def buffered(self):
+        """Return the number of rows (or packed values) buffered."""
+        return (len(self.datapoints) + len(self.values) + len(self.symbols) +
+                self.n_packed)
+
+    def add_datapoint(self, subset):
+        """Add a data point to subset and return its index."""
+        if self.buffered() >= self.batch_size:
+            self.flush()
+        self.datapoints.append(
+            models.Datapoint(created_by=self.user, subset=subset))
+        return len(self.datapoints) - 1
+
+    def add_value(self, i_datapoint, value,
+                  value_type=models.NumericalValue.ACCURATE, error=None,
+                  upper_bound=None, is_secondary=False, counter=0):
+        """Attach a numerical value to the data point i_datapoint."""
+        numerical_value = models.NumericalValue(created_by=self.user,
+                                                value=value,
+                                                value_type=value_type,
+                                                counter=counter)
+        if is_secondary:
+            numerical_value.qualifier = models.NumericalValue.SECONDARY
+        self.values.append((i_datapoint, numerical_value))
+        self.errors.append(error)
+        self.upper_bounds.append(upper_bound)
+
+    def add_values(self, subset, parsed):
+        """Add data points to subset from a ParsedValues object.
+
+        If the values are given as a 1-d array, each one becomes a
+        separate data point. If there are two columns, the first one
+        is the secondary (x) and the second one the primary (y) value
+        of a data point. Subsets with at least
+        settings.MATD3_PACK_THRESHOLD data points are stored as
+        PackedValues instead.
+
+        """
+        if (settings.MATD3_PACK_THRESHOLD and
+                len(parsed.values) >= settings.MATD3_PACK_THRESHOLD):
+            self.pack_values(subset, parsed)
+            return
+        parsed = ParsedValues(
+            *(x if x.ndim == 2 else x[:, numpy.newaxis] for x in parsed))
+        n_columns = parsed.values.shape[1]
+        for row in self._rows(parsed):
+            i_datapoint = self.add_datapoint(subset)
+            for i_column, value in enumerate(zip(*row)):
+                self.add_value(i_datapoint, *value,
+                               is_secondary=i_column < n_columns - 1)
+
+    def _rows(self, parsed):
+        """Generate the rows of 2-d ParsedValues as Python objects.
+
+        Each row is a tuple of lists of the values, value types,
+        errors, and upper bounds, with None for missing errors and
+        upper bounds. The arrays are converted one batch at a time so
+        that only a batch is held in memory as objects.
+
+        """
+        for start in range(0, len(parsed.values), self.batch_size):
+            batch = [x[start:start+self.batch_size] for x in parsed]
+            yield from zip(
+                batch[0].tolist(), batch[1].tolist(),
+                *(numpy.where(numpy.isnan(x), None, x).tolist()
+                  for x in batch[2:]))
+
+    def pack_values(self, subset, parsed):
+        """Store all values of subset as a single PackedValues row."""
+        if self.buffered() >= self.batch_size:
+            self.flush()
+        shape = (len(parsed.values), -1)
+        # Columns are stored in the order of the qualifier, which is
+        # the reverse of the order on the form (x y).
+        array = _pack(ParsedValues(
+            *(x.reshape(shape)[:, ::-1] for x in parsed)))
+        packed_values = models.PackedValues(created_by=self.user,
+                                            subset=subset)
+        packed_values.set_array(array)
+        self.packed_values.append(packed_values)
+        self.n_packed += array.size
+
+    def add_geometry(self, subset, geometry):
+        """Store the lattice vectors and atoms of a Geometry in subset.
+
+        The whole geometry becomes a single AtomicStructure row.
+
+        """
+        if self.buffered() >= self.batch_size:
+            self.flush()
+        sites = numpy.empty(len(geometry.elements),
+                            dtype=models.AtomicStructure.SITE_DTYPE)
+        sites['element'] = geometry.elements
+        sites['fractional'] = [
+            x == 'atom_frac' for x in geometry.coordinate_types]
+        sites['position'] = _pack(geometry.coordinates)
+        atomic_structure = models.AtomicStructure(created_by=self.user,
+                                                  subset=subset)
+        atomic_structure.set_arrays(_pack(geometry.lattice_vectors), sites)
+        self.atomic_structures.append(atomic_structure)
+        self.n_packed += sites['position'].size
+
+    def update_counts(self):
+        """Add the buffered data points to Subset.datapoint_count.
+
+        Subsets that gain the same number of data points are updated
+        together.
+
+        """
+        counts = collections.Counter(
+            datapoint.subset for datapoint in self.datapoints)
+        for packed_values in self.packed_values:
+            counts[packed_values.subset] += packed_values.count
+        subsets = collections.defaultdict(list)
+        for subset, count in counts.items():
+            subset.datapoint_count += count
+            subsets[count].append(subset.pk)
+        for count, pks in subsets.items():
+            models.Subset.objects.filter(pk__in=pks).update(
+                datapoint_count=F('datapoint_count') + count)
+
+    def add_symbol(self, i_datapoint, value, counter=0):
+        """Attach a symbol to the data point i_datapoint."""
+        self.symbols.append((i_datapoint, models.Symbol(
+            created_by=self.user, value=value, counter=counter)))
+
+    def flush(self):
+        """Insert everything collected so far and empty the buffers."""
+        batch_size = self.batch_size
+        self.update_counts()
+        bulk_create_with_pks(
+            models.Datapoint, self.datapoints,
+            models.Datapoint.objects.filter(
+                subset__dataset__in=self.datasets), batch_size)
+        for i_datapoint, value in self.values:
+            value.datapoint_id = self.datapoints[i_datapoint].pk
+        values = [value for _, value in self.values]
+        bulk_create_with_pks(
+            models.NumericalValue, values,
+            models.NumericalValue.objects.filter(
+                datapoint__subset__dataset__in=self.datasets), batch_size)
+        for model, array in ((models.Error, self.errors),
+                             (models.UpperBound, self.upper_bounds)):
+            model.objects.bulk_create(
+                [model(created_by=self.user, numerical_value_id=value.pk,
+                       value=x) for value, x in zip(values, array)
+                 if x is not None], batch_size=batch_size)
+        for i_datapoint, symbol in self.symbols:
+            symbol.datapoint_id = self.datapoints[i_datapoint].pk
+        models.Symbol.objects.bulk_create(
+            [symbol for _, symbol in self.symbols], batch_size=batch_size)
+        # Each packed array is already large, so they are inserted
+        # one per statement.
+        models.PackedValues.objects.bulk_create(self.packed_values,
+                                                batch_size=1)
+        models.AtomicStructure.objects.bulk_create(self.atomic_structures,
+                                                   batch_size=1)
+        self.clear()
+
+
+# Choices that can be given by name in a data set description
+_SAMPLE_TYPES = {name: value for value, name in models.Dataset.SAMPLE_TYPES}
+_CRYSTAL_SYSTEMS = {
+    name: value for value, name in models.Subset.CRYSTAL_SYSTEMS}
+_BOOLEANS = {'true': True, 'yes': True, '1': True,
+             'false': False, 'no': False, '0': False}
+
+
+def _boolean(value):
+    """Return a boolean given as such or as one of _BOOLEANS."""
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.lower() in _BOOLEANS:
+        return _BOOLEANS[value.lower()]
+    raise ValueError
+
+
+_DATASET_FIELDS = {
+    'caption': str,
+    'primary_property_label': str,
+    'secondary_property_label': str,
+    'extraction_method': str,
+    'space_group': str,
+    'visible': _boolean,
+    'is_figure': _boolean,
+    'is_experimental': _boolean,
+    'dimensionality': int,
+}
+
+
+def _choice(value, choices, what):
+    """Return the value of a choice given by its name or value."""
+    if value in choices.values():
+        return value
+    try:
+        return choices[value]
+    except (KeyError, TypeError):
+        raise ValueError(f'Unknown {what}: {value!r}')
+
+
+def _list(description, key):
+    """Return the list under key of a description or an empty one."""
+    value = description.get(key, [])
+    if not isinstance(value, list):
+        raise ValueError(f'{key} must be a list')
+    return value
+
+
+def _fields(description, what):
+    """Return a copy of the fields of an object given as a mapping.
+
+    The fields may only be strings and numbers.
+
+    """
+    if not isinstance(description, dict):
+        raise ValueError(f'A {what} must be given by a mapping')
+    for name, value in description.items():
+        if not isinstance(value, (str, int, float)):
+            raise ValueError(f'Invalid {name} of a {what}: {value!r}')
+    return dict(description)
+
+
+def _read(base_dir, file_name):
+    """Return the contents of a file of a data set description."""
+    path = os.path.join(base_dir, file_name)
+    try:
+        with open(path) as f:
+            return f.read()
+    except OSError as error:
+        raise ValueError(f'Could not read {file_name}: {error.strerror}')
+
+
+def values_from_array(values, columns=None):
+    """Return numbers given as a (nested) list as ParsedValues.
+
+    With columns, each element of values must be a list of that many
+    numbers. The values are all accurate, i.e., without errors or
+    upper bounds.
+
+    """
+    try:
+        array = numpy.array(values, dtype=float)
+    except (TypeError, ValueError):
+        raise ValueError('Values must be numbers')
+    if array.ndim != (1 if columns is None else 2) or (
+            columns is not None and array.shape[1] != columns):
+        raise ValueError(f'Expected {columns or 1} value(s) per data point')
+    if not numpy.isfinite(array).all():
+        raise ValueError('Values must be finite')
+    return ParsedValues(array, numpy.zeros(array.shape, dtype=numpy.uint8),
+                        numpy.full(array.shape, numpy.nan),
+                        numpy.full(array.shape, numpy.nan))
+
+
+def parse_dataset(description, base_dir=None):
+    """Parse and validate the description of a data set.
+
+    The description is a dictionary as read from an import manifest
+    (see the import_datasets command). Nothing is read from the
+    database, so that many descriptions can be parsed in parallel.
+    The system, reference, properties, and units are resolved later
+    by DatasetImporter. Files are looked up relative to base_dir. If
+    base_dir is None, the description may not refer to any files.
+    Returns the description with the data of each subset parsed into
+    ParsedValues and raises a ValueError if anything is wrong.
+
+    """
+    if not isinstance(description, dict):
+        raise ValueError('A data set must be described by a mapping')
+    for key in 'system', 'reference', 'primary_property', 'subsets':
+        if not description.get(key):
+            raise ValueError(f'Missing {key}')
+    for key in ('primary_property', 'primary_unit', 'secondary_property',
+                'secondary_unit'):
+        if description.get(key) and not isinstance(description[key], str):
+            raise ValueError(f'{key} must be a string')
+    primary_property = description['primary_property']
+    if (primary_property in ('atomic structure', 'band structure') or
+            primary_property.startswith('phase transition ')):
+        raise ValueError(f'Data sets of {primary_property} cannot be '
+                         'imported. Use the data form instead.')
+    dataset = {key: description.get(key) for key in (
+        'system', 'reference', 'primary_property', 'primary_unit',
+        'secondary_property', 'secondary_unit')}
+    for key, cast in _DATASET_FIELDS.items():
+        if key in description:
+            try:
+                dataset[key] = cast(description[key])
+            except (TypeError, ValueError):
+                raise ValueError(f'Invalid {key}: {description[key]!r}')
+    dataset['sample_type'] = _choice(
+        description.get('sample_type', models.Dataset.UNKNOWN),
+        _SAMPLE_TYPES, 'sample type')
+    dataset['related_data_sets'] = []
+    for pk in _list(description, 'related_data_sets'):
+        if isinstance(pk, bool) or not isinstance(pk, (int, str)):
+            raise ValueError(f'Invalid related data set: {pk!r}')
+        try:
+            dataset['related_data_sets'].append(int(pk))
+        except ValueError:
+            raise ValueError(f'Invalid related data set: {pk!r}')
+    if base_dir is None and 'files' in description:
+        raise ValueError('Files are not supported here')
+    dataset['files'] = []
+    for file_name in _list(description, 'files'):
+        if not isinstance(file_name, str):
+            raise ValueError(f'Invalid file name: {file_name!r}')
+        path = os.path.join(base_dir, file_name)
+        if not os.path.isfile(path):
+            raise ValueError(f'File not found: {file_name}')
+        dataset['files'].append(path)
+    columns = 2 if dataset['secondary_property'] else None
+    dataset['subsets'] = []
+    if not isinstance(description['subsets'], list):
+        raise ValueError('subsets must be a list')
+    for i_subset, subset_description in enumerate(description['subsets'],
+                                                  start=1):
+        if not isinstance(subset_description, dict):
+            raise ValueError(f'Subset {i_subset}: must be a mapping')
+        if base_dir is None and 'file' in subset_description:
+            raise ValueError('Files are not supported here')
+        if not isinstance(subset_description.get('file', ''), str):
+            raise ValueError(f'Subset {i_subset}: invalid file name')
+        subset = {
+            'label': str(subset_description.get('label', '')),
+            'crystal_system': _choice(
+                subset_description.get('crystal_system',
+                                       models.Subset.UNKNOWN_SYSTEM),
+                _CRYSTAL_SYSTEMS, 'crystal system'),
+            'fixed_values': [],
+        }
+        try:
+            if 'file' in subset_description:
+                subset['file_name'] = os.path.basename(
+                    subset_description['file'])
+                subset['text'] = _read(base_dir, subset_description['file'])
+                subset['values'] = parse_values(subset['text'], columns)
+            elif isinstance(subset_description.get('values'), str):
+                subset['text'] = subset_description['values']
+                subset['values'] = parse_values(subset['text'], columns)
+            elif 'values' in subset_description:
+                subset['values'] = values_from_array(
+                    subset_description['values'], columns)
+                subset['text'] = '\n'.join(
+                    ' '.join(map(str, numpy.atleast_1d(row)))
+                    for row in subset['values'].values.tolist()) + '\n'
+            else:
+                raise ValueError('No values given')
+            for fixed_value in _list(subset_description, 'fixed_values'):
+                if not isinstance(fixed_value, dict):
+                    raise ValueError('A fixed value must be a mapping')
+                if not isinstance(fixed_value.get('property', ''), str) or (
+                        not isinstance(fixed_value.get('unit') or '', str)):
+                    raise ValueError('The property and unit of a fixed '
+                                     'value must be strings')
+                subset['fixed_values'].append((
+                    fixed_value['property'], fixed_value.get('unit'),
+                    *clean_value(str(fixed_value['value']))))
+        except KeyError as error:
+            raise ValueError(f'Subset {i_subset}: missing {error} of a '
+                             'fixed value')
+        except ValueError as error:
+            raise ValueError(f'Subset {i_subset}: {error}')
+        dataset['subsets'].append(subset)
+    return dataset
+
+
+class DatasetImporter:
+    """Create data sets from parsed descriptions in bulk.
+
+    Systems, references, properties, and units are looked up once per
+    import and created if they do not exist yet. create() then
+    inserts a list of data sets in a single transaction, with one
+    bulk_create per model for the subsets and their contents.
+
+    """
+    def __init__(self, user):
+        self.user = user
+        self.properties = {}
+        self.units = {}
+        self.systems = {}
+        self.references = {}
+
+    def get_property(self, name):
+        if name not in self.properties:
+            self.properties[name], _ = models.Property.objects.get_or_create(
+                name=name, defaults={'created_by': self.user,
+                                     'updated_by': self.user})
+        return self.properties[name]
+
+    def get_unit(self, label):
+        if not label:
+            return None
+        if label not in self.units:
+            self.units[label], _ = models.Unit.objects.get_or_create(
+                label=label, defaults={'created_by': self.user,
+                                       'updated_by': self.user})
+        return self.units[label]
+
+    def get_system(self, description):
+        """Return the system given by its pk or its fields.
+
+        A system given by its fields is looked up by its formula and,
+        if present, its compound name.
+
+        """
+        key = json.dumps(description, sort_keys=True)
+        if key not in self.systems:
+            if isinstance(description, int):
+                system = models.System.objects.filter(
+                    pk=description).first()
+            elif not isinstance(description, dict):
+                raise ValueError('A system must be given by its pk or its '
+                                 'fields')
+            else:
+                fields = _fields(description, 'system')
+                if not fields.get('formula'):
+                    raise ValueError('A system needs a formula')
+                fields.setdefault('compound_name', fields['formula'])
+                system = models.System.objects.filter(
+                    formula=fields['formula'],
+                    compound_name=fields['compound_name']).first()
+                if system is None:
+                    try:
+                        system = models.System.objects.create(**fields)
+                    except TypeError as error:
+                        raise ValueError(f'Invalid system: {error}')
+            if system is None:
+                raise ValueError(f'System {description} does not exist')
+            self.systems[key] = system
+        return self.systems[key]
+
+    def get_reference(self, description):
+        """Return the reference given by its pk or its fields.
+
+        A reference given by its fields is looked up by its DOI or, if
+        there is none, by its title and year. The authors are a list
+        of dictionaries with the fields of Author.
+
+        """
+        key = json.dumps(description, sort_keys=True)
+        if key not in self.references:
+            if isinstance(description, int):
+                reference = models.Reference.objects.filter(
+                    pk=description).first()
+            elif not isinstance(description, dict):
+                raise ValueError('A reference must be given by its pk or its '
+                                 'fields')
+            else:
+                authors = [_fields(author, 'author') for author in
+                           _list(description, 'authors')]
+                fields = _fields({key: value for key, value in
+                                  description.items() if key != 'authors'},
+                                 'reference')
+                if not fields.get('title'):
+                    raise ValueError('A reference needs a title')
+                if fields.get('doi_isbn'):
+                    lookup = {'doi_isbn': fields['doi_isbn']}
+                else:
+                    lookup = {'title': fields['title'],
+                              'year': fields.get('year', '')}
+                reference = models.Reference.objects.filter(**lookup).first()
+                if reference is None:
+                    try:
+                        reference = models.Reference.objects.create(**fields)
+                        for author in authors:
+                            author, _ = models.Author.objects.get_or_create(
+                                **author)
+                            author.references.add(reference)
+                    except TypeError as error:
+                        raise ValueError(f'Invalid reference: {error}')
+            if reference is None:
+                raise ValueError(f'Reference {description} does not exist')
+            self.references[key] = reference
+        return self.references[key]
+
+    def build(self, parsed):
+        """Return an unsaved data set from the output of parse_dataset.
+
+        Raises a ValueError if the system or reference do not exist.
+
+        """
+        dataset = models.Dataset(
+            created_by=self.user,
+            system=self.get_system(parsed['system']),
+            reference=self.get_reference(parsed['reference']),
+            primary_property=self.get_property(parsed['primary_property']),
+            primary_unit=self.get_unit(parsed['primary_unit']),
+            visible=True,
+            is_figure=False,
+            is_experimental=True,
+            sample_type=parsed['sample_type'])
+        if parsed['secondary_property']:
+            dataset.secondary_property = self.get_property(
+                parsed['secondary_property'])
+            dataset.secondary_unit = self.get_unit(parsed['secondary_unit'])
+        for key in _DATASET_FIELDS:
+            if key in parsed:
+                setattr(dataset, key, parsed[key])
+        related = set(parsed['related_data_sets'])
+        missing = related - set(models.Dataset.objects.filter(
+            pk__in=related).values_list('pk', flat=True))
+        if missing:
+            raise ValueError(f'Related data set {min(missing)} does not '
+                             'exist')
+        for subset in parsed['subsets']:
+            for fixed_value in subset['fixed_values']:
+                if not fixed_value[1]:
+                    raise ValueError('Fixed values need a unit')
+                self.get_property(fixed_value[0])
+                self.get_unit(fixed_value[1])
+        return dataset
+
+    def create(self, datasets, parsed_datasets):
+        """Insert the data sets returned by build() and their contents.
+
+        Everything is inserted in a single transaction. If it fails,
+        the files written so far are removed again.
+
+        """
+        files = []
+        try:
+            with transaction.atomic():
+                self._create(datasets, parsed_datasets, files)
+        except Exception:
+            for data_file in files:
+                data_file.dataset_file.delete(save=False)
+            for dataset in datasets:
+                dataset.pk = None
+            raise
+        return datasets
+
+    def _create(self, datasets, parsed_datasets, files):
+        # The first data set of a system and property is representative
+        existing = set(models.Dataset.objects.filter(
+            system__in={dataset.system for dataset in datasets}).values_list(
+                'system', 'primary_property'))
+        for dataset in datasets:
+            key = (dataset.system_id, dataset.primary_property_id)
+            dataset.representative = key not in existing
+            existing.add(key)
+            dataset.save()
+        subsets = []
+        for dataset, parsed in zip(datasets, parsed_datasets):
+            for parsed_subset in parsed['subsets']:
+                subsets.append(models.Subset(
+                    created_by=self.user, dataset=dataset,
+                    label=parsed_subset['label'],
+                    crystal_system=parsed_subset['crystal_system']))
+        bulk_create_with_pks(
+            models.Subset, subsets,
+            models.Subset.objects.filter(dataset__in=datasets))
+        writer = DatapointWriter(datasets, self.user)
+        fixed_values = []
+        parsed_subsets = itertools.chain.from_iterable(
+            parsed['subsets'] for parsed in parsed_datasets)
+        for subset, parsed_subset in zip(subsets, parsed_subsets):
+            writer.add_values(subset, parsed_subset['values'])
+            for counter, (name, label, *value) in enumerate(
+                    parsed_subset['fixed_values']):
+                fixed_values.append(models.NumericalValueFixed(
+                    created_by=self.user, subset=subset, counter=counter,
+                    physical_property=self.get_property(name),
+                    unit=self.get_unit(label),
+                    **dict(zip(('value', 'value_type', 'error',
+                                'upper_bound'), value))))
+        writer.flush()
+        models.NumericalValueFixed.objects.bulk_create(fixed_values)
+        input_files, additional_files = [], []
+        for dataset, parsed in zip(datasets, parsed_datasets):
+            subsets = parsed['subsets']
+            for i_subset, subset in enumerate(subsets, start=1):
+                file_name = subset.get('file_name') or (
+                    f'data{i_subset}.txt' if len(subsets) > 1 else
+                    'data.txt')
+                data_file = models.InputDataFile(created_by=self.user,
+                                                 dataset=dataset)
+                data_file.dataset_file.save(
+                    file_name, ContentFile(subset['text'].encode()),
+                    save=False)
+                files.append(data_file)
+                input_files.append(data_file)
+            for path in parsed['files']:
+                data_file = models.AdditionalFile(created_by=self.user,
+                                                  dataset=dataset)
+                with open(path, 'rb') as f:
+                    data_file.dataset_file.save(os.path.basename(path),
+                                                File(f), save=False)
+                files.append(data_file)
+                additional_files.append(data_file)
+            if parsed['related_data_sets']:
+                dataset.link(*parsed['related_data_sets'])
+        models.InputDataFile.objects.bulk_create(input_files)
+        models.AdditionalFile.objects.bulk_create(additional_files)
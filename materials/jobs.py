@@ -0,0 +1,142 @@
+# This file is covered by the BSD license. See LICENSE in the root directory.
+"""Background jobs for the slow side effects of requests.
+
+Functions decorated with @task can be scheduled with enqueue() from
+within a request. The job is stored in the database and later executed
+by the run_jobs management command. Failed jobs are retried with an
+increasing delay until their maximum number of attempts is reached.
+Jobs whose worker was killed while running them are taken back after
+a timeout (see claim).
+
+"""
+import datetime
+import logging
+import os
+import re
+import traceback
+
+import requests
+from django.core import mail
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import models, utils
+
+logger = logging.getLogger(__name__)
+
+TASKS = {}
+
+# Time after which a running job is assumed to have lost its worker
+TIMEOUT = datetime.timedelta(hours=1)
+
+
+def task(function):
+    """Register function so that it can be run as a job."""
+    TASKS[function.__name__] = function
+    return function
+
+
+def enqueue(name, dataset=None, **arguments):
+    """Schedule the task called name to be run with the arguments.
+
+    If dataset is given, it is passed to the task as the first
+    argument and the job is deleted along with the data set. The
+    remaining arguments must be JSON serializable.
+
+    """
+    if name not in TASKS:
+        raise ValueError(f'Unknown task: {name}')
+    return models.Job.objects.create(task=name, dataset=dataset,
+                                     arguments=arguments)
+
+
+def claim(limit, timeout=TIMEOUT):
+    """Mark up to limit pending jobs as running and return their pks.
+
+    A job is only claimed if it is still available at the time of the
+    update, so several workers can safely poll the same queue. A job
+    that has been running for longer than timeout is assumed to have
+    lost its worker, e.g., because it was killed during a deploy or
+    for running out of memory. Such a job is claimed again, or marked
+    as failed if it has no attempts left.
+
+    """
+    now = timezone.now()
+    stale = Q(status=models.Job.RUNNING, started__lt=now - timeout)
+    models.Job.objects.filter(stale, attempts__gte=F('max_attempts')).update(
+        status=models.Job.FAILED, finished=now,
+        error='The worker stopped while running the job')
+    available = Q(status=models.Job.PENDING, run_after__lte=now) | stale
+    pks = models.Job.objects.filter(available).order_by('pk').values_list(
+        'pk', flat=True)[:limit]
+    return [pk for pk in pks if models.Job.objects.filter(
+        available, pk=pk).update(status=models.Job.RUNNING, started=now,
+                                 attempts=F('attempts') + 1)]
+
+
+def run_job(pk):
+    """Execute a claimed job and record the outcome.
+
+    Returns the new status of the job or None if the job no longer
+    exists, e.g., because its data set was deleted in the meantime.
+
+    """
+    job = models.Job.objects.select_related('dataset').filter(pk=pk).first()
+    if job is None:
+        return None
+    args = [job.dataset] if job.dataset_id else []
+    try:
+        TASKS[job.task](*args, **job.arguments)
+    except Exception:
+        logger.exception(f'Job {job} failed (attempt {job.attempts})')
+        job.error = traceback.format_exc()
+        if job.attempts < job.max_attempts:
+            job.status = models.Job.PENDING
+            job.run_after = timezone.now() + datetime.timedelta(
+                minutes=2**job.attempts)
+        else:
+            job.status = models.Job.FAILED
+            job.finished = timezone.now()
+    else:
+        job.status = models.Job.DONE
+        job.finished = timezone.now()
+    job.save()
+    return job.status
+
+
+@task
+def create_static_files(dataset, k_labels=None):
+    """Plot the band structure from the band10xx.out files.
+
+    k_labels are the k-point labels of the band structure plot. The
+    Qresp figure is not created here but on the first request, see
+    qresp.get_figure().
+
+    """
+    if k_labels is not None:
+        files = sorted((f.dataset_file for f in dataset.files.all()
+                        if re.match(r'band10\d+\.out',
+                                    os.path.basename(f.dataset_file.name))),
+                       key=lambda f: f.name)
+        utils.plot_band_structure(k_labels, files, dataset)
+
+
+@task
+def fetch_qresp_chart(dataset, url, chart_nr):
+    """Download a chart from Qresp and attach it to the data set."""
+    paper_detail = requests.get(url, verify=False, timeout=60).json()
+    download_url = paper_detail['fileServerPath']
+    chart_detail = paper_detail['charts'][chart_nr]
+    chart = requests.get(f'{download_url}/{chart_detail["imageFile"]}',
+                         verify=False, timeout=60)
+    chart.raise_for_status()
+    file_name = chart_detail["imageFile"].replace('/', '_')
+    f = SimpleUploadedFile(file_name, chart.content)
+    dataset.files.create(created_by=dataset.created_by, dataset_file=f)
+
+
+@task
+def send_mail(**kwargs):
+    """Same as django.core.mail.send_mail."""
+    mail.send_mail(**kwargs)
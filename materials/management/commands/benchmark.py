@@ -0,0 +1,240 @@
+# This file is covered by the BSD license. See LICENSE in the root directory.
+"""Measure the throughput of the data processing routines."""
+import contextlib
+import os
+import re
+import tempfile
+import time
+
+import numpy
+from django.core.files import File
+from django.core.management.base import BaseCommand
+
+from materials import ingest, models, utils
+
+
+def bench(function, *args, repeat=3):
+    """Return the best wall time of a few calls of function."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def random_values(size, special=True, seed=0):
+    """Generate a data block in the format of the data form.
+
+    If special, about 2% of the values have a marker, an error, or an
+    upper bound. Otherwise, all values are plain numbers.
+
+    """
+    rng = numpy.random.default_rng(seed)
+    values = rng.normal(size=(size, 2)).round(4).astype(str)
+    if not special:
+        return '\n'.join(' '.join(row) for row in values)
+    special = rng.integers(0, 200, size=values.shape)
+    values[special == 0] = numpy.char.add('<', values[special == 0])
+    values[special == 1] = numpy.char.add(values[special == 1], '(12)')
+    values[special == 2] = numpy.char.add(values[special == 2], '±0.1')
+    values[special == 3] = numpy.char.add(values[special == 3], '...9.9')
+    return '\n'.join(' '.join(row) for row in values)
+
+
+def clean_value_loop(value):
+    """Reference implementation of ingest.clean_value.
+
+    This is how each value used to be cleaned in submit_data. The error
+    and the upper bound are returned as strings.
+
+    """
+    error = None
+    upper_bound = None
+    if re.match(r'[-\d]', value):
+        value_type = models.NumericalValue.ACCURATE
+    elif value.startswith('<'):
+        value_type = models.NumericalValue.UPPER_BOUND
+        value = value[1:]
+    elif value.startswith('>'):
+        value_type = models.NumericalValue.LOWER_BOUND
+        value = value[1:]
+    elif value.startswith(('≈', '~')):
+        value_type = models.NumericalValue.APPROXIMATE
+        value = value[1:]
+    if '(' in value:
+        if '(0' in value:
+            value = re.sub(r'\(0+', '(', value)
+        left_paren_start = value.find('(')
+        right_paren_start = value.find(')')
+        error = value[left_paren_start+1:right_paren_start]
+        if '.' not in error and left_paren_start > len(error):
+            error = re.sub('[1-9]', '0',
+                           value[:left_paren_start-len(error)]) + error
+        value = value[:left_paren_start]
+    elif '±' in value:
+        value, error = value.split('±')
+    elif '...' in value:
+        value, upper_bound = value.split('...')
+    return float(value), value_type, error, upper_bound
+
+
+def random_band_file(path, n_kpoints, n_bands, seed=0):
+    """Write an AIMS band file with sorted random energies."""
+    rng = numpy.random.default_rng(seed)
+    rows = numpy.empty((n_kpoints, 4 + 2*n_bands))
+    rows[:, 0] = numpy.arange(1, n_kpoints + 1)
+    rows[:, 1:4] = rng.random((n_kpoints, 3))
+    energies = numpy.sort(rng.normal(scale=20, size=(n_kpoints, n_bands)))
+    rows[:, 4::2] = numpy.where(energies < 0, 2, 0)
+    rows[:, 5::2] = energies
+    numpy.savetxt(path, rows, fmt='%.8f')
+
+
+def read_band_files_loop(files, skip_first, energy_window):
+    """Reference implementation of utils.read_band_files.
+
+    This is how the band files used to be read, one value at a time.
+
+    """
+    data_raw = []
+    n_kpoints = []
+    fermi_energy = -1e10
+    for i_segment, file_ in enumerate(files):
+        file_.open('rb')
+        lines = file_.readlines()
+        file_.close()
+        n_kpoints.append(len(lines))
+        i_skip = 0
+        if skip_first[i_segment]:
+            n_kpoints[-1] -= 1
+            i_skip = 1
+        if i_segment == 0:
+            words = lines[0].split()
+            n_bands = int(len(words[5:])/2)
+            min_index = int(1e10)
+            max_index = 0
+        data_raw.append(numpy.empty([n_kpoints[-1], n_bands]))
+        for i_kpoint in range(n_kpoints[-1]):
+            words = lines[i_kpoint+i_skip].split()
+            n_bands_local = int((len(words)-5)/2)
+            for i_band in range(min(n_bands, n_bands_local)):
+                band_energy = float(words[5+2*i_band])
+                occupation = float(words[4+2*i_band])
+                data_raw[-1][i_kpoint, i_band] = band_energy
+                if occupation > 1e-10:
+                    fermi_energy = max(fermi_energy, band_energy)
+    for i_segment in range(len(data_raw)):
+        data_raw[i_segment] -= fermi_energy
+        for i_kpoint in range(n_kpoints[i_segment]):
+            min_index = min(min_index, numpy.searchsorted(
+                data_raw[i_segment][i_kpoint, :], energy_window[0]))
+            max_index = max(max_index, numpy.searchsorted(
+                data_raw[i_segment][i_kpoint, :], energy_window[1]))
+    return (numpy.concatenate(data_raw)[:, min_index:max_index].T,
+            n_kpoints)
+
+
+def random_geometry(size, seed=0):
+    """Generate an FHI-aims geometry with size atoms."""
+    rng = numpy.random.default_rng(seed)
+    lines = [f'lattice_vector {x:.6f} {y:.6f} {z:.6f}'
+             for x, y, z in 20*rng.random((3, 3))]
+    elements = rng.choice(['Pb', 'I', 'C', 'N', 'H'], size)
+    for (x, y, z), element in zip(rng.random((size, 3)), elements):
+        lines.append(f'atom_frac {x:.8f} {y:.8f} {z:.8f} {element}')
+    return '\n'.join(lines)
+
+
+def parse_geometry_loop(text):
+    """Reference implementation of ingest.parse_geometry.
+
+    This is how geometries used to be parsed, one line and one
+    coordinate at a time.
+
+    """
+    rows = []
+    for line in text.split('\n'):
+        m = re.match(r'\s*lattice_vector' + 3*r'\s+(-?\d+(?:\.\d+)?)' +
+                     r'\b', line)
+        if m:
+            rows.append([ingest.clean_value(x) for x in m.groups()])
+        else:
+            m = re.match(r'\s*(atom|atom_frac)\s+' +
+                         3*r'(-?\d+(?:\.\d+)?(?:\(\d+\))?)\s+' +
+                         r'(\w+)\b', line)
+            coord_type, *coords, element = m.groups()
+            rows.append([coord_type, element] +
+                        [ingest.clean_value(x) for x in coords])
+    return rows
+
+
+class Command(BaseCommand):
+    help = 'Measure the throughput of the data processing routines.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('target', choices=['parser', 'bands', 'geometry'])
+        parser.add_argument('--size', type=int, default=100000,
+                            help='Number of data points (lines) or atoms')
+        parser.add_argument('--bands', type=int, default=200,
+                            help='Number of bands in each band file')
+
+    def handle(self, *args, **options):
+        getattr(self, f'bench_{options["target"]}')(**options)
+
+    def report(self, label, n, seconds):
+        self.stdout.write(f'{label:<30}{seconds:10.3f} s '
+                          f'{n/seconds:14,.0f} values/s')
+
+    def bench_parser(self, size, **options):
+        n = 2*size
+        for special in False, True:
+            text = random_values(size, special)
+            self.stdout.write('Mixed values' if special else 'Plain numbers')
+
+            def per_value(clean_value):
+                return [clean_value(value) for line in text.splitlines()
+                        for value in line.split()[:2]]
+
+            expected = [(value, value_type,
+                         None if error is None else float(error),
+                         None if upper is None else float(upper))
+                        for value, value_type, error, upper
+                        in per_value(clean_value_loop)]
+            assert per_value(ingest.clean_value) == expected
+            self.report('  loop', n,
+                        bench(per_value, clean_value_loop, repeat=1))
+            self.report('  clean_value (per value)', n,
+                        bench(per_value, ingest.clean_value, repeat=1))
+            self.report('  parse_values', n,
+                        bench(ingest.parse_values, text, 2))
+
+    def bench_bands(self, size, bands, **options):
+        n_files = 4
+        with tempfile.TemporaryDirectory() as directory:
+            paths = [os.path.join(directory, f'band100{i}.out')
+                     for i in range(1, n_files + 1)]
+            for i, path in enumerate(paths):
+                random_band_file(path, size//n_files, bands, seed=i)
+            with contextlib.ExitStack() as stack:
+                files = [File(stack.enter_context(open(path, 'rb')))
+                         for path in paths]
+                skip_first = [False] + (n_files - 1)*[True]
+                window = (-8, 8)
+                expected = read_band_files_loop(files, skip_first, window)
+                data = utils.read_band_files(files, skip_first, window)
+                assert numpy.array_equal(data[0], expected[0])
+                assert data[1] == expected[1]
+                n = size*bands
+                self.stdout.write(f'{size} k-points, {bands} bands')
+                self.report('  loop', n, bench(
+                    read_band_files_loop, files, skip_first, window, repeat=1))
+                self.report('  read_band_files', n, bench(
+                    utils.read_band_files, files, skip_first, window))
+
+    def bench_geometry(self, size, **options):
+        text = random_geometry(size)
+        n = 3*(size + 3)
+        self.stdout.write(f'{size} atoms')
+        self.report('  loop', n, bench(parse_geometry_loop, text, repeat=1))
+        self.report('  parse_geometry', n, bench(ingest.parse_geometry, text))
@@ -0,0 +1,83 @@
+# This file is covered by the BSD license. See LICENSE in the root directory.
+"""Check that the most frequent queries use the composite indexes."""
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from materials import models
+
+
+def index_name(model, fields):
+    """Return the name of the index of model on exactly these fields."""
+    for index in model._meta.indexes:
+        if index.fields == list(fields):
+            return index.name
+    raise CommandError(f'{model.__name__} has no index on {fields}')
+
+
+def hot_queries():
+    """Return the queries to check as (description, queryset, index).
+
+    The querysets are the same as those of the views and models, with
+    arbitrary primary keys since the plan does not depend on them.
+
+    """
+    return [
+        ('Data sets of a system and property (num_all_entries, '
+         'PropertyAllEntriesView, representative flag)',
+         models.Dataset.objects.filter(system=1).filter(primary_property=1),
+         index_name(models.Dataset, ['system', 'primary_property'])),
+        ('Values of subsets (get_values)',
+         models.NumericalValue.objects.filter(
+             datapoint__subset__in=[1, 2]).order_by(
+                 'datapoint__subset', 'datapoint_id', 'qualifier').values_list(
+                     'datapoint__subset', 'datapoint_id', 'qualifier',
+                     'value', 'value_type', 'error__value',
+                     'upperbound__value'),
+         index_name(models.NumericalValue,
+                    ['datapoint', 'qualifier', 'value', 'value_type'])),
+        ('Values of subsets per data point (get_datapoint_values)',
+         models.NumericalValue.objects.filter(
+             datapoint__subset__in=[1, 2]).order_by('pk').values_list(
+                 'datapoint', 'qualifier', 'value', 'value_type',
+                 'error__value', 'upperbound__value'),
+         index_name(models.NumericalValue,
+                    ['datapoint', 'qualifier', 'value', 'value_type'])),
+        ('Elements of atomic coordinates (atomic_coordinates_as_json)',
+         models.Symbol.objects.filter(datapoint__subset=1).filter(
+             counter=1).order_by('datapoint_id').values_list(
+                 'value', flat=True),
+         index_name(models.Symbol, ['datapoint', 'counter', 'value'])),
+        ('Fixed values of a subset by property',
+         models.NumericalValueFixed.objects.filter(subset=1).filter(
+             physical_property=1),
+         index_name(models.NumericalValueFixed,
+                    ['subset', 'physical_property'])),
+        ('Systems of a composition (composition.find)',
+         models.SystemElement.objects.filter(
+             component=models.SystemElement.FORMULA).filter(
+                 element=50).filter(count__gte=1).values('system'),
+         index_name(models.SystemElement,
+                    ['component', 'element', 'count', 'system'])),
+    ]
+
+
+class Command(BaseCommand):
+    help = ('Show the EXPLAIN plans of the most frequent queries and check '
+            'that they use the composite indexes. Works with SQLite and '
+            'MySQL. Exits with an error if an index is not used.')
+
+    def handle(self, *args, **options):
+        missing = []
+        for description, queryset, index in hot_queries():
+            plan = queryset.explain()
+            used = index in plan
+            if not used:
+                missing.append(description)
+            self.stdout.write(f'{description}: '
+                              f'{"uses" if used else "does not use"} {index}')
+            if options['verbosity'] > 1 or not used:
+                self.stdout.write(plan)
+        if missing:
+            raise CommandError(
+                f'{len(missing)} queries do not use their index on '
+                f'{connection.vendor}')
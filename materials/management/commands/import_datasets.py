@@ -0,0 +1,172 @@
+# This file is covered by the BSD license. See LICENSE in the root directory.
+"""Import many data sets described by a manifest file."""
+import json
+import multiprocessing
+import os
+import tempfile
+import zipfile
+from concurrent.futures import Future, ProcessPoolExecutor
+
+import django
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from materials import ingest
+
+MANIFEST_NAMES = ('manifest.json', 'manifest.yaml', 'manifest.yml')
+
+
+def load_manifest(path):
+    """Return the list of data set descriptions of a manifest file."""
+    with open(path) as f:
+        if path.endswith('.json'):
+            manifest = json.load(f)
+        else:
+            try:
+                import yaml
+            except ImportError:
+                raise CommandError('PyYAML is required for YAML manifests')
+            manifest = yaml.safe_load(f)
+    if isinstance(manifest, dict):
+        manifest = manifest.get('datasets')
+    if not isinstance(manifest, list):
+        raise CommandError('The manifest must contain a list of data sets')
+    return manifest
+
+
+def find_manifest(directory):
+    """Return the path of the manifest in directory."""
+    for name in MANIFEST_NAMES:
+        if os.path.isfile(os.path.join(directory, name)):
+            return os.path.join(directory, name)
+    raise CommandError(f'No {" or ".join(MANIFEST_NAMES)} in {directory}')
+
+
+def parse(description, base_dir):
+    """Same as ingest.parse_dataset but return the error instead."""
+    try:
+        return ingest.parse_dataset(description, base_dir)
+    except ValueError as error:
+        return error
+
+
+class Command(BaseCommand):
+    help = ('Import the data sets described in a manifest file. The source '
+            'is the manifest (JSON or YAML) or a directory or zip archive '
+            'that contains a manifest.json or manifest.yaml. Data files '
+            'are found relative to the manifest.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', help='Manifest, directory, or zip file')
+        parser.add_argument('--user', required=True,
+                            help='Username of the creator of the data sets')
+        parser.add_argument('--processes', type=int, default=os.cpu_count(),
+                            help='Number of processes for parsing the data. '
+                            'With 0, the data are parsed in this process.')
+        parser.add_argument('--chunk-size', type=int, default=100,
+                            help='Number of data sets inserted together')
+
+    def handle(self, *args, **options):
+        try:
+            user = get_user_model().objects.get(username=options['user'])
+        except get_user_model().DoesNotExist:
+            raise CommandError(f'User {options["user"]} does not exist')
+        source = options['source']
+        if zipfile.is_zipfile(source):
+            with tempfile.TemporaryDirectory() as directory:
+                with zipfile.ZipFile(source) as archive:
+                    archive.extractall(directory)
+                self.import_manifest(find_manifest(directory), user, options)
+        elif os.path.isdir(source):
+            self.import_manifest(find_manifest(source), user, options)
+        elif os.path.isfile(source):
+            self.import_manifest(source, user, options)
+        else:
+            raise CommandError(f'{source} does not exist')
+
+    def import_manifest(self, path, user, options):
+        descriptions = load_manifest(path)
+        base_dir = os.path.dirname(path)
+        chunk_size = max(options['chunk_size'], 1)
+        processes = options['processes']
+        if processes > 0:
+            # The workers only parse and validate. All database access
+            # happens in this process.
+            connections.close_all()
+            pool = ProcessPoolExecutor(
+                processes, mp_context=multiprocessing.get_context('spawn'),
+                initializer=django.setup)
+        else:
+            pool = None
+
+        def submit(start):
+            futures = []
+            for description in descriptions[start:start+chunk_size]:
+                if pool:
+                    futures.append(pool.submit(parse, description, base_dir))
+                else:
+                    futures.append(Future())
+                    futures[-1].set_result(parse(description, base_dir))
+            return futures
+
+        importer = ingest.DatasetImporter(user)
+        self.n_created = self.n_failed = 0
+        try:
+            # The next chunk is parsed while the current one is inserted
+            futures = submit(0)
+            for start in range(0, len(descriptions), chunk_size):
+                results = [future.result() for future in futures]
+                futures = submit(start + chunk_size)
+                self.insert(importer, start, results)
+        finally:
+            if pool:
+                pool.shutdown()
+        self.stdout.write(f'Imported {self.n_created} data sets, '
+                          f'{self.n_failed} failed')
+
+    def insert(self, importer, start, results):
+        """Insert a chunk of parsed data sets.
+
+        Data sets that fail validation are reported and skipped. If the
+        insertion of the whole chunk fails, the data sets are inserted
+        one by one so that only the broken ones are lost.
+
+        """
+        numbers, datasets, parsed_datasets = [], [], []
+        for number, parsed in enumerate(results, start=start+1):
+            try:
+                if isinstance(parsed, Exception):
+                    raise parsed
+                datasets.append(importer.build(parsed))
+                numbers.append(number)
+                parsed_datasets.append(parsed)
+            except ValueError as error:
+                self.report_error(number, error)
+        if not datasets:
+            return
+        try:
+            importer.create(datasets, parsed_datasets)
+        except Exception as error:
+            if len(datasets) == 1:
+                self.report_error(numbers[0], error)
+                return
+            for number, dataset, parsed in zip(numbers, datasets,
+                                               parsed_datasets):
+                try:
+                    importer.create([dataset], [parsed])
+                except Exception as error:
+                    self.report_error(number, error)
+                else:
+                    self.report_success(number, dataset)
+        else:
+            for number, dataset in zip(numbers, datasets):
+                self.report_success(number, dataset)
+
+    def report_success(self, number, dataset):
+        self.n_created += 1
+        self.stdout.write(f'Data set {number}: created #{dataset.pk}')
+
+    def report_error(self, number, error):
+        self.n_failed += 1
+        self.stderr.write(f'Data set {number}: {error}')
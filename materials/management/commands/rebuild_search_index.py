@@ -0,0 +1,20 @@
+# This file is covered by the BSD license. See LICENSE in the root directory.
+"""Rebuild the trigram and composition indexes used by the search."""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from materials import composition, search
+
+
+class Command(BaseCommand):
+    help = ('Index the names and formulas of all systems, properties, and '
+            'authors and the element compositions of all systems from '
+            'scratch. Only needed if the database has been edited by other '
+            'means than Django.')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            n_rows = search.rebuild_index()
+            n_elements = composition.rebuild_compositions()
+        self.stdout.write(f'Indexed {n_rows} trigrams and {n_elements} '
+                          'element counts')
@@ -0,0 +1,55 @@
+# This file is covered by the BSD license. See LICENSE in the root directory.
+"""Rebuild the cached Qresp figures of many data sets in parallel."""
+import os
+
+from django.core.management.base import BaseCommand
+
+from mainproject import settings
+from materials import models, qresp, rendering
+
+
+class Command(BaseCommand):
+    help = ('Rebuild the Qresp figures of the given data sets (all by '
+            'default) that are missing or outdated using the render pool.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('pks', nargs='*', type=int,
+                            help='Primary keys of the data sets')
+        parser.add_argument('--all', action='store_true',
+                            help='Also rebuild figures that are up to date')
+        parser.add_argument('--processes', type=int, default=os.cpu_count(),
+                            help='Number of render processes')
+
+    def handle(self, *args, **options):
+        if settings.MATD3_RENDER_PROCESSES:
+            rendering.get_pool(options['processes'])
+        datasets = models.Dataset.objects.select_related(
+            'primary_property', 'primary_unit', 'secondary_property',
+            'secondary_unit').order_by('pk')
+        if options['pks']:
+            datasets = datasets.filter(pk__in=options['pks'])
+        # The data of all figures are collected first so that the pool
+        # renders them while the next data set is being read.
+        pending = {}
+        for dataset in datasets.iterator():
+            version = qresp.dataset_version(dataset)
+            if (not options['all'] and
+                    os.path.exists(qresp.figure_path(dataset.pk, version))):
+                continue
+            try:
+                pending[dataset.pk] = (version,
+                                       *qresp.render_figure(dataset))
+            except Exception as error:
+                self.stderr.write(f'Data set {dataset.pk}: {error}')
+        for pk, (version, path, future) in pending.items():
+            try:
+                future.result()
+                with qresp.lock(pk):
+                    qresp.publish_figure(pk, version, path)
+            except Exception as error:
+                self.stderr.write(f'Data set {pk}: {error}')
+            else:
+                self.stdout.write(f'Data set {pk}: done')
+            finally:
+                if os.path.exists(path):
+                    os.remove(path)
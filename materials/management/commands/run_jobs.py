@@ -0,0 +1,92 @@
+# This file is covered by the BSD license. See LICENSE in the root directory.
+"""Worker that executes the jobs scheduled with materials.jobs."""
+import datetime
+import multiprocessing
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from materials import jobs, models
+
+
+def run_job(pk):
+    """Run a job and return its status and the error that escaped.
+
+    run_job records the errors of the task itself. Anything else, such
+    as a lost database connection, is returned here so that it does
+    not stop the worker or the other jobs of the batch.
+
+    """
+    try:
+        return jobs.run_job(pk), ''
+    except Exception:
+        return None, traceback.format_exc()
+
+
+class Command(BaseCommand):
+    help = 'Run background jobs such as plots and Qresp files.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=os.cpu_count(),
+                            help='Number of worker processes. With 0, jobs '
+                            'are run in this process.')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit when there are no more pending jobs')
+        parser.add_argument('--sleep', type=float, default=5,
+                            help='Seconds to wait when the queue is empty')
+        parser.add_argument('--timeout', type=float,
+                            default=jobs.TIMEOUT.total_seconds()/60,
+                            help='Minutes after which a running job is '
+                            'assumed to have lost its worker and is run '
+                            'again')
+
+    def get_pool(self, processes):
+        # Workers are spawned rather than forked so that they do not
+        # share the database connection of this process. Each worker
+        # sets up Django once and is then reused.
+        connections.close_all()
+        return ProcessPoolExecutor(
+            processes, mp_context=multiprocessing.get_context('spawn'),
+            initializer=django.setup)
+
+    def handle(self, *args, **options):
+        processes = options['processes']
+        timeout = datetime.timedelta(minutes=options['timeout'])
+        pool = self.get_pool(processes) if processes > 0 else None
+        statuses = dict(models.Job.STATUSES)
+        try:
+            while True:
+                pks = jobs.claim(max(2*processes, 1), timeout)
+                if pks:
+                    run = pool.map if pool else map
+                    try:
+                        for pk, (status, error) in zip(pks,
+                                                       run(run_job, pks)):
+                            if status is None and error:
+                                self.stderr.write(f'Job {pk}: {error}')
+                            elif status is None:
+                                self.stdout.write(f'Job {pk}: deleted')
+                            else:
+                                self.stdout.write(
+                                    f'Job {pk}: {statuses[status]}')
+                    except BrokenProcessPool:
+                        # A worker process died, e.g., of running out of
+                        # memory. Its jobs are taken back by claim after
+                        # the timeout.
+                        self.stderr.write('A worker process died, '
+                                          'restarting the pool')
+                        pool.shutdown(wait=False)
+                        pool = self.get_pool(processes)
+                elif options['once']:
+                    break
+                else:
+                    time.sleep(options['sleep'])
+        finally:
+            if pool:
+                pool.shutdown()
@@ -0,0 +1,54 @@
+# This file is covered by the BSD license. See LICENSE in the root directory.
+"""Repair the stored numbers of data points and data sets."""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+
+from materials import models
+
+
+class Command(BaseCommand):
+    help = ('Recount the data points of each subset and the data sets of '
+            'each system and property and fix the stored counts that are '
+            'wrong, e.g., after editing the database by hand.')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            n_subsets = self.update_subsets()
+            n_datasets = self.update_datasets()
+        self.stdout.write(f'Fixed {n_subsets} subsets and {n_datasets} '
+                          'data sets')
+
+    def update_subsets(self):
+        counts = dict(models.Datapoint.objects.order_by().values(
+            'subset').annotate(count=Count('pk')).values_list(
+                'subset', 'count'))
+        counts.update(models.PackedValues.objects.values_list(
+            'subset', 'count'))
+        wrong = []
+        for subset in models.Subset.objects.only('datapoint_count'):
+            if subset.datapoint_count != counts.get(subset.pk, 0):
+                subset.datapoint_count = counts.get(subset.pk, 0)
+                wrong.append(subset)
+        models.Subset.objects.bulk_update(wrong, ['datapoint_count'],
+                                          batch_size=1000)
+        return len(wrong)
+
+    def update_datasets(self):
+        counts = dict(
+            ((system, primary_property), count)
+            for system, primary_property, count in
+            models.Dataset.objects.order_by().values(
+                'system', 'primary_property').annotate(
+                    count=Count('pk')).values_list(
+                        'system', 'primary_property', 'count'))
+        wrong = []
+        for dataset in models.Dataset.objects.only(
+                'system', 'primary_property', 'all_entries_count'):
+            count = counts[dataset.system_id, dataset.primary_property_id]
+            if dataset.all_entries_count != count:
+                dataset.all_entries_count = count
+                wrong.append(dataset)
+        models.Dataset.objects.bulk_update(wrong, ['all_entries_count'],
+                                           batch_size=1000)
+        return len(wrong)
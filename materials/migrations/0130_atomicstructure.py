@@ -0,0 +1,33 @@
+# Generated by Django 4.1 on 2026-10-18 16:40
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('materials', '0129_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AtomicStructure',
+            fields=[
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(default=django.utils.timezone.now)),
+                ('subset', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='atomic_structure', serialize=False, to='materials.subset')),
+                ('count', models.PositiveIntegerField()),
+                ('lattice_vectors', models.BinaryField()),
+                ('sites', models.BinaryField()),
+                ('created_by', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='materials_atomicstructure_created_by', to=settings.AUTH_USER_MODEL)),
+                ('updated_by', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='materials_atomicstructure_updated_by', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.1 on 2026-10-18 17:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('materials', '0130_atomicstructure'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='dataset',
+            index=models.Index(fields=['system', 'primary_property'], name='materials_d_system__162882_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='numericalvalue',
+            index=models.Index(fields=['datapoint', 'qualifier', 'value', 'value_type'], name='materials_n_datapoi_88cf94_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='numericalvaluefixed',
+            index=models.Index(fields=['subset', 'physical_property'], name='materials_n_subset__47a523_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='symbol',
+            index=models.Index(fields=['datapoint', 'counter', 'value'], name='materials_s_datapoi_e07854_idx'),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 4.1 on 2026-10-18 18:20
+
+from django.db import migrations, models
+
+
+def count(apps, schema_editor):
+    Dataset = apps.get_model('materials', 'Dataset')
+    Subset = apps.get_model('materials', 'Subset')
+    Datapoint = apps.get_model('materials', 'Datapoint')
+    PackedValues = apps.get_model('materials', 'PackedValues')
+    counts = dict(Datapoint.objects.order_by().values('subset').annotate(
+        count=models.Count('pk')).values_list('subset', 'count'))
+    counts.update(PackedValues.objects.values_list('subset', 'count'))
+    for pk, datapoint_count in counts.items():
+        Subset.objects.filter(pk=pk).update(datapoint_count=datapoint_count)
+    for system, primary_property, all_entries_count in (
+            Dataset.objects.order_by().values(
+                'system', 'primary_property').annotate(
+                    count=models.Count('pk')).values_list(
+                        'system', 'primary_property', 'count')):
+        Dataset.objects.filter(
+            system=system, primary_property=primary_property).update(
+                all_entries_count=all_entries_count)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('materials', '0131_composite_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dataset',
+            name='all_entries_count',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+        migrations.AddField(
+            model_name='subset',
+            name='datapoint_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 4.1 on 2026-10-18 19:30
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def create_groups(apps, schema_editor):
+    """Turn the links between data sets into link groups."""
+    Dataset = apps.get_model('materials', 'Dataset')
+    LinkGroup = apps.get_model('materials', 'LinkGroup')
+    parents = {}
+
+    def find(pk):
+        while parents.setdefault(pk, pk) != pk:
+            parents[pk] = parents[parents[pk]]
+            pk = parents[pk]
+        return pk
+
+    for from_pk, to_pk in Dataset.linked_to.through.objects.values_list(
+            'from_dataset', 'to_dataset'):
+        parents[find(from_pk)] = find(to_pk)
+    groups = {}
+    for pk in parents:
+        groups.setdefault(find(pk), []).append(pk)
+    for pks in groups.values():
+        if len(pks) > 1:
+            group = LinkGroup.objects.create()
+            Dataset.objects.filter(pk__in=pks).update(link_group=group)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('materials', '0132_counts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LinkGroup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='dataset',
+            name='link_group',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='datasets', to='materials.linkgroup'),
+        ),
+        migrations.RunPython(create_groups, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='dataset',
+            name='linked_to',
+        ),
+    ]
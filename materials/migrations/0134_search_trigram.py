@@ -0,0 +1,55 @@
+# Generated by Django 4.1 on 2026-10-18 20:45
+
+from django.db import migrations, models
+
+# Same as search.INDEXED_FIELDS at the time of this migration
+INDEXED_FIELDS = {
+    0: ('System', ('formula', 'group', 'iupac', 'compound_name')),
+    1: ('System', ('organic',)),
+    2: ('System', ('inorganic',)),
+    3: ('Property', ('name',)),
+    4: ('Author', ('last_name',)),
+}
+
+
+def build_index(apps, schema_editor):
+    SearchTrigram = apps.get_model('materials', 'SearchTrigram')
+    for field, (model_name, names) in INDEXED_FIELDS.items():
+        model = apps.get_model('materials', model_name)
+        rows = []
+        for pk, *texts in model.objects.values_list('pk', *names):
+            grams = set()
+            for text in texts:
+                text = text.lower()
+                grams.update(text[i:i+3] for i in range(len(text) - 2))
+            rows.extend(SearchTrigram(field=field, object_id=pk, trigram=gram)
+                        for gram in grams)
+        SearchTrigram.objects.bulk_create(rows, batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('materials', '0133_link_group'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchTrigram',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('field', models.PositiveSmallIntegerField(choices=[(0, 'system names and formula'), (1, 'organic component'), (2, 'inorganic component'), (3, 'property name'), (4, 'author last name')])),
+                ('object_id', models.PositiveIntegerField()),
+                ('trigram', models.CharField(max_length=3)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='searchtrigram',
+            index=models.Index(fields=['field', 'trigram', 'object_id'], name='materials_s_field_1505b3_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='searchtrigram',
+            index=models.Index(fields=['field', 'object_id'], name='materials_s_field_bbe122_idx'),
+        ),
+        migrations.RunPython(build_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,166 @@
+# Generated by Django 4.1 on 2026-10-18 21:30
+
+import re
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# Frozen copy of the parser in composition.py at the time of this
+# migration, so that later changes to it do not alter the migration.
+ELEMENTS = (
+    'H', 'He', 'Li', 'Be', 'B', 'C', 'N', 'O', 'F', 'Ne', 'Na', 'Mg', 'Al',
+    'Si', 'P', 'S', 'Cl', 'Ar', 'K', 'Ca', 'Sc', 'Ti', 'V', 'Cr', 'Mn', 'Fe',
+    'Co', 'Ni', 'Cu', 'Zn', 'Ga', 'Ge', 'As', 'Se', 'Br', 'Kr', 'Rb', 'Sr',
+    'Y', 'Zr', 'Nb', 'Mo', 'Tc', 'Ru', 'Rh', 'Pd', 'Ag', 'Cd', 'In', 'Sn',
+    'Sb', 'Te', 'I', 'Xe', 'Cs', 'Ba', 'La', 'Ce', 'Pr', 'Nd', 'Pm', 'Sm',
+    'Eu', 'Gd', 'Tb', 'Dy', 'Ho', 'Er', 'Tm', 'Yb', 'Lu', 'Hf', 'Ta', 'W',
+    'Re', 'Os', 'Ir', 'Pt', 'Au', 'Hg', 'Tl', 'Pb', 'Bi', 'Po', 'At', 'Rn',
+    'Fr', 'Ra', 'Ac', 'Th', 'Pa', 'U', 'Np', 'Pu', 'Am', 'Cm', 'Bk', 'Cf',
+    'Es', 'Fm', 'Md', 'No', 'Lr', 'Rf', 'Db', 'Sg', 'Bh', 'Hs', 'Mt', 'Ds',
+    'Rg', 'Cn', 'Nh', 'Fl', 'Mc', 'Lv', 'Ts', 'Og')
+ATOMIC_NUMBERS = {symbol: i + 1 for i, symbol in enumerate(ELEMENTS)}
+ABBREVIATIONS = {
+    'MA': 'CH3NH3',
+    'FA': 'CH(NH2)2',
+    'GA': 'C(NH2)3',
+    'EA': 'CH3CH2NH3',
+    'BA': 'C4H9NH3',
+    'PEA': 'C6H5C2H4NH3',
+}
+
+MASK_BITS = 60
+COMPONENT_FIELDS = {0: 'formula', 1: 'organic', 2: 'inorganic'}
+
+_TOKEN = re.compile(r'\s*(?:'
+                    rf'({"|".join(sorted(ABBREVIATIONS, key=len)[::-1])})'
+                    r'(?![a-z])|([A-Z][a-z]?)|([(\[{])|([)\]}])|'
+                    r'(\d+(?:\.\d+)?|\.\d+))')
+_ADDUCT = re.compile(r'\s*(\d+(?:\.\d+)?)?(.*)', re.DOTALL)
+
+
+def _add(counts, other, factor):
+    for element, count in other.items():
+        counts[element] = counts.get(element, 0) + factor*count
+
+
+def _parse(text, formula):
+    stack = [{}]
+    last = None  # Counts that a following number multiplies
+    pos = 0
+    text = text.rstrip()
+    while pos < len(text):
+        match = _TOKEN.match(text, pos)
+        if not match:
+            raise ValueError(f'Cannot parse "{text[pos:].strip()}" of '
+                             f'{formula}')
+        abbreviation, element, opening, closing, number = match.groups()
+        pos = match.end()
+        if abbreviation:
+            last = _parse(ABBREVIATIONS[abbreviation], formula)
+            _add(stack[-1], last, 1)
+        elif element:
+            if element not in ATOMIC_NUMBERS:
+                raise ValueError(f'Unknown element {element} in {formula}')
+            last = {element: 1}
+            _add(stack[-1], last, 1)
+        elif opening:
+            stack.append({})
+            last = None
+        elif closing:
+            if len(stack) == 1:
+                raise ValueError(f'Unbalanced parentheses in {formula}')
+            last = stack.pop()
+            _add(stack[-1], last, 1)
+        else:
+            if last is None:
+                raise ValueError(f'Misplaced number {number} in {formula}')
+            _add(stack[-1], last, float(number) - 1)
+            last = None
+    if len(stack) > 1:
+        raise ValueError(f'Unbalanced parentheses in {formula}')
+    return stack[0]
+
+
+def parse_formula(formula):
+    counts = {}
+    for adduct in re.split('[·*]', formula):
+        coefficient, text = _ADDUCT.match(adduct).groups()
+        _add(counts, _parse(text, formula), float(coefficient or 1))
+    counts = {element: round(count, 6) for element, count in counts.items()
+              if round(count, 6) > 0}
+    if not counts:
+        raise ValueError(f'No elements in {formula}')
+    return counts
+
+
+def element_masks(elements):
+    masks = [0, 0]
+    for element in elements:
+        index = ATOMIC_NUMBERS[element] - 1
+        masks[index // MASK_BITS] |= 1 << index % MASK_BITS
+    return tuple(masks)
+
+
+def build_index(apps, schema_editor):
+    System = apps.get_model('materials', 'System')
+    SystemElement = apps.get_model('materials', 'SystemElement')
+    rows, systems = [], []
+    # Not iterated with a cursor since System is updated in the loop
+    for system in System.objects.only(*COMPONENT_FIELDS.values()):
+        for component, name in COMPONENT_FIELDS.items():
+            try:
+                counts = parse_formula(getattr(system, name))
+            except ValueError:
+                continue
+            rows.extend(SystemElement(
+                system_id=system.pk, component=component,
+                element=ATOMIC_NUMBERS[element], count=count)
+                        for element, count in counts.items())
+            if component == 0:
+                system.element_mask_1, system.element_mask_2 = (
+                    element_masks(counts))
+                systems.append(system)
+        if len(rows) >= 2000:
+            SystemElement.objects.bulk_create(rows)
+            rows = []
+        if len(systems) >= 2000:
+            System.objects.bulk_update(
+                systems, ['element_mask_1', 'element_mask_2'])
+            systems = []
+    SystemElement.objects.bulk_create(rows)
+    System.objects.bulk_update(systems, ['element_mask_1', 'element_mask_2'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('materials', '0134_search_trigram'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='system',
+            name='element_mask_1',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='system',
+            name='element_mask_2',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.CreateModel(
+            name='SystemElement',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('component', models.PositiveSmallIntegerField(choices=[(0, 'formula'), (1, 'organic component'), (2, 'inorganic component')])),
+                ('element', models.PositiveSmallIntegerField()),
+                ('count', models.FloatField()),
+                ('system', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='elements', to='materials.system')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='systemelement',
+            index=models.Index(fields=['component', 'element', 'count', 'system'], name='materials_s_compone_d2b38c_idx'),
+        ),
+        migrations.RunPython(build_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.1 on 2026-10-18 22:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('materials', '0135_system_element'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='started',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 4.1 on 2026-10-18 22:40
+
+from django.db import migrations
+
+# Same as search.INDEXED_FIELDS and search.PADDING at the time of this
+# migration
+INDEXED_FIELDS = {
+    0: ('System', ('formula', 'group', 'iupac', 'compound_name')),
+    1: ('System', ('organic',)),
+    2: ('System', ('inorganic',)),
+    3: ('Property', ('name',)),
+    4: ('Author', ('last_name',)),
+}
+PADDING = '  '
+
+
+def rebuild_index(apps, schema_editor):
+    SearchTrigram = apps.get_model('materials', 'SearchTrigram')
+    SearchTrigram.objects.all().delete()
+    for field, (model_name, names) in INDEXED_FIELDS.items():
+        model = apps.get_model('materials', model_name)
+        rows = []
+        for pk, *texts in model.objects.values_list('pk', *names):
+            grams = set()
+            for text in texts:
+                text = (text + PADDING).lower()
+                grams.update(text[i:i+3] for i in range(len(text) - 2))
+            rows.extend(SearchTrigram(field=field, object_id=pk, trigram=gram)
+                        for gram in grams)
+        SearchTrigram.objects.bulk_create(rows, batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('materials', '0136_job_started'),
+    ]
+
+    operations = [
+        migrations.RunPython(rebuild_index, migrations.RunPython.noop),
+    ]
@@ -1,8 +1,12 @@
 # This file is covered by the BSD license. See LICENSE in the root directory.
+import io
+import itertools
 import logging
+import operator
 import os
 import shutil
 
+import numpy
 from django.contrib.auth import get_user_model
 from django.core.mail import send_mail
 from django.db import models
@@ -134,6 +138,9 @@ class System(models.Model):
     dimensionality = models.PositiveSmallIntegerField(choices=DIMENSIONALITIES, default=0 )
     n = models.CharField(max_length=50, blank=True)
     tags = models.ManyToManyField(Tag, blank=True)
+    # Elements of the formula, see composition.py
+    element_mask_1 = models.BigIntegerField(default=0, editable=False)
+    element_mask_2 = models.BigIntegerField(default=0, editable=False)
 
     def __str__(self):
         return self.compound_name
@@ -142,6 +149,45 @@ class System(models.Model):
         return self.group.replace(',', ' ').split()
 
 
+class SystemElement(models.Model):
+    """Number of atoms of an element per formula unit of a system.
+
+    The rows are derived from the formula and the organic and
+    inorganic components of the system whenever it is saved (see
+    composition.py) and serve as the index of the composition search.
+    The element is given by its atomic number.
+
+    """
+    FORMULA = 0
+    ORGANIC = 1
+    INORGANIC = 2
+    COMPONENTS = (
+        (FORMULA, 'formula'),
+        (ORGANIC, 'organic component'),
+        (INORGANIC, 'inorganic component'),
+    )
+    system = models.ForeignKey(System, on_delete=models.CASCADE,
+                               related_name='elements')
+    component = models.PositiveSmallIntegerField(choices=COMPONENTS)
+    element = models.PositiveSmallIntegerField()
+    count = models.FloatField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['component', 'element', 'count', 'system']),
+        ]
+
+
+class LinkGroup(models.Model):
+    """Group of data sets that are linked to each other.
+
+    Linking is transitive: if A is linked to B and B to C, then A and
+    C are linked as well. Linked data sets thus form groups and each
+    data set belongs to at most one of them (Dataset.link_group).
+
+    """
+
+
 class Dataset(Base):
     """Class for mainly tables and figures.
 
@@ -196,20 +242,33 @@ class Dataset(Base):
     sample_type = models.PositiveSmallIntegerField(choices=SAMPLE_TYPES)
     extraction_method = models.CharField(max_length=300, blank=True)
     representative = models.BooleanField(default=False)
-    linked_to = models.ManyToManyField('self', blank=True)
+    link_group = models.ForeignKey(
+        LinkGroup, null=True, blank=True, on_delete=models.SET_NULL,
+        related_name='datasets')
     verified_by = models.ManyToManyField(get_user_model())
     doi = models.CharField(max_length=50, blank=True)
     space_group_ID = models.ForeignKey(SpaceGroup, blank=True, null=True, on_delete=models.PROTECT)
     space_group = models.CharField(max_length=20, blank=True)
     notice = models.CharField(max_length=1000, blank=True, default="")
+    # Number of data sets with the same system and primary property,
+    # including this one. Kept up to date by save() and delete().
+    all_entries_count = models.PositiveIntegerField(default=1,
+                                                    editable=False)
 
     class Meta:
         verbose_name_plural = 'data sets'
+        # For all data sets of a system and property, e.g., counting
+        # them and updating the representative flag
+        indexes = [models.Index(fields=['system', 'primary_property'])]
 
     def __str__(self):
         return f'ID: {self.pk} ({self.primary_property})'
 
     def save(self, *args, **kwargs):
+        previous = None
+        if self.pk:
+            previous = Dataset.objects.filter(pk=self.pk).values_list(
+                'system', 'primary_property').first()
         if self.representative:
             # Unset the representative flag of the dataset that was
             # previously representative
@@ -245,6 +304,12 @@ class Dataset(Base):
             for user in self.verified_by.all():
                 self.verified_by.remove(user)
         super().save(*args, **kwargs)
+        current = (self.system_id, self.primary_property_id)
+        if previous != current:
+            if previous:
+                Dataset.update_all_entries_count(*previous)
+            self.all_entries_count = Dataset.update_all_entries_count(
+                *current)
 
     def delete(self, *args, **kwargs):
         """Additionally remove all files uploaded by the user."""
@@ -262,20 +327,106 @@ class Dataset(Base):
         qresp_loc = os.path.join(settings.MEDIA_ROOT, f'qresp/dataset_{self.pk}')
         if os.path.exists(qresp_loc):
             shutil.rmtree(qresp_loc)
+        band_structure_loc = os.path.join(
+            settings.MEDIA_ROOT, f'band_structures/dataset_{self.pk}')
+        if os.path.exists(band_structure_loc):
+            shutil.rmtree(band_structure_loc)
+
+        return super().delete(*args, **kwargs)
+
+    @staticmethod
+    def update_all_entries_count(system_id, primary_property_id):
+        """Recount the data sets of a system and property.
 
-        super().delete(*args, **kwargs)
+        Stores the count in all_entries_count of each of them and
+        returns it.
+
+        """
+        datasets = Dataset.objects.filter(system=system_id).filter(
+            primary_property=primary_property_id)
+        count = datasets.count()
+        datasets.update(all_entries_count=count)
+        return count
 
     def num_all_entries(self):
-        return Dataset.objects.filter(system=self.system).filter(
-            primary_property=self.primary_property).count()
+        """Return the number of data sets of this system and property."""
+        return self.all_entries_count
+
+    def linked_datasets(self):
+        """Return the other data sets of the link group.
+
+        Prefetch link_group__datasets to avoid the query.
+
+        """
+        if not self.link_group_id:
+            return []
+        return [dataset for dataset in self.link_group.datasets.all()
+                if dataset.pk != self.pk]
+
+    def link(self, *datasets):
+        """Link this data set to the given data sets or primary keys.
+
+        The link groups of all of them are merged into one, so that
+        the number of queries does not depend on the sizes of the
+        groups.
+
+        """
+        pks = {self.pk} | {getattr(dataset, 'pk', dataset)
+                           for dataset in datasets}
+        groups = set(Dataset.objects.filter(pk__in=pks).exclude(
+            link_group=None).values_list('link_group', flat=True))
+        if groups:
+            group = min(groups)
+        else:
+            group = LinkGroup.objects.create().pk
+        Dataset.objects.filter(
+            models.Q(pk__in=pks) | models.Q(link_group__in=groups)).update(
+                link_group=group)
+        if len(groups) > 1:
+            LinkGroup.objects.filter(pk__in=groups - {group}).delete()
+        self.link_group_id = group
+
+    def unlink(self):
+        """Remove this data set from its link group.
+
+        A group that would be left with a single data set is removed.
+
+        """
+        group = self.link_group_id
+        if not group:
+            return
+        Dataset.objects.filter(pk=self.pk).update(link_group=None)
+        self.link_group_id = None
+        if Dataset.objects.filter(link_group=group).count() < 2:
+            LinkGroup.objects.filter(pk=group).delete()
+
+    def set_linked(self, datasets):
+        """Make the link group consist of this and the given data sets.
+
+        Other data sets that were in the group are unlinked. The
+        groups of the given data sets are merged as with link().
+
+        """
+        pks = {dataset.pk for dataset in datasets}
+        removed = {dataset.pk for dataset in self.linked_datasets()} - pks
+        Dataset.objects.filter(pk__in=removed).update(link_group=None)
+        if pks:
+            self.link(*pks)
+        else:
+            self.unlink()
 
     def get_all_fixed_temperatures(self):
-        """Return a formatted list of all fixed temperatures."""
+        """Return a formatted list of all fixed temperatures.
+
+        Goes through the subsets and fixed values of the data set so
+        that prefetched values are used if present.
+
+        """
         values = []
-        for value in NumericalValueFixed.objects.filter(
-                subset__dataset=self).filter(
-                    physical_property__name='temperature'):
-            values.append(f'{value.formatted()} {value.unit}')
+        for subset in self.subsets.all():
+            for value in subset.fixed_values.all():
+                if value.physical_property.name == 'temperature':
+                    values.append(f'{value.formatted()} {value.unit}')
         return ('(T = ' + ', '.join(values) + ')' if values else '')
 
     def get_geometry_file_location(self):
@@ -319,12 +470,15 @@ class Subset(Base):
     space_group_ID = models.ForeignKey(SpaceGroup, blank=True, null=True, on_delete=models.PROTECT)
     space_group = models.CharField(default="", max_length=20, blank=True)
     crystal_system = models.PositiveSmallIntegerField(choices=CRYSTAL_SYSTEMS)
+    # Number of data points, whether packed or not. Kept up to date
+    # by ingest.DatapointWriter.
+    datapoint_count = models.PositiveIntegerField(default=0, editable=False)
 
     class Meta:
         verbose_name_plural = 'data subsets (read-only)'
 
     def __str__(self):
-        return f'ID: {self.pk} ({self.datapoints.count()} data points)'
+        return f'ID: {self.pk} ({self.num_datapoints()} data points)'
 
     def get_fixed_values(self):
         """Return all fixed properties for the given subset."""
@@ -337,7 +491,25 @@ class Subset(Base):
         return output
 
     def get_lattice_constants(self):
-        """Return three lattice constants and angles."""
+        """Return three lattice constants and angles.
+
+        If the subset was fetched with the lattice constants
+        prefetched into lattice_constant_datapoints (data points with
+        a single symbol), those are used instead of querying the
+        database.
+
+        """
+        if self.dataset.primary_unit:
+            units = 3*[f' {self.dataset.primary_unit.label}'] + 3*['°']
+        else:
+            units = 3*[' '] + 3*['°']
+        if hasattr(self, 'lattice_constant_datapoints'):
+            symbols = []
+            values = []
+            for datapoint in self.lattice_constant_datapoints:
+                symbols.append(datapoint.symbols.all()[0].value)
+                values.append(datapoint.values.all()[0].formatted('.10g'))
+            return zip(symbols, values, units)
         symbols = Symbol.objects.filter(datapoint__subset=self).annotate(
             num=models.Count('datapoint__symbols')).filter(num=1).order_by(
                 'datapoint_id').values_list('value', flat=True)
@@ -346,15 +518,29 @@ class Subset(Base):
                 num=models.Count('datapoint__values')).filter(
                     num=1).select_related('error').select_related(
                         'upperbound').order_by('datapoint_id')
-        if self.dataset.primary_unit:
-            units = 3*[f' {self.dataset.primary_unit.label}'] + 3*['°']
-        else:
-            units = 3*[' '] + 3*['°']
         values = []
         for value in values_float:
             values.append(value.formatted('.10g'))
         return zip(symbols, values, units)
 
+    def num_datapoints(self):
+        """Return the number of data points, whether packed or not."""
+        return self.datapoint_count
+
+    def get_values(self):
+        """Return the numerical values as a structured NumPy array.
+
+        The array has one row per data point and one column per
+        qualifier (primary, secondary) with the fields of
+        PackedValues.DTYPE. Missing errors and upper bounds are
+        NaN. The values are read from the packed storage if present
+        and are otherwise assembled from the individual rows with a
+        single query. Not meant for data such as atomic coordinates
+        that use the counter field.
+
+        """
+        return get_values([self])[self.pk]
+
     def first_with_atomic_coordinates(self):
         """Whether this is the first subset to contain atomic coordinates.
 
@@ -365,10 +551,96 @@ class Subset(Base):
 
         """
         for subset in self.dataset.subsets.all():
-            if subset.datapoints.count() > 6:
+            if subset.has_atomic_coordinates():
                 return subset.pk == self.pk
         return False
 
+    def has_atomic_coordinates(self):
+        """Whether there are atomic coordinates besides lattice constants.
+
+        Newer structures are stored as AtomicStructure. Older ones
+        consist of more than the six data points of the lattice
+        constants.
+
+        """
+        return (hasattr(self, 'atomic_structure') or
+                self.num_datapoints() > 6)
+
+
+def get_values(subsets):
+    """Return the numerical values of several subsets.
+
+    Same as Subset.get_values() for each subset, but the values of
+    all subsets that are not packed are fetched with a single
+    query. Returns a dictionary keyed by the primary keys of the
+    subsets.
+
+    """
+    arrays = {}
+    unpacked = []
+    for subset in subsets:
+        if hasattr(subset, 'packed_values'):
+            arrays[subset.pk] = subset.packed_values.get_array()
+        else:
+            arrays[subset.pk] = numpy.zeros((0, 1), dtype=PackedValues.DTYPE)
+            unpacked.append(subset.pk)
+    rows = NumericalValue.objects.filter(
+        datapoint__subset__in=unpacked).order_by(
+            'datapoint__subset', 'datapoint_id', 'qualifier').values_list(
+                'datapoint__subset', 'datapoint_id', 'qualifier', 'value',
+                'value_type', 'error__value', 'upperbound__value')
+    for subset_pk, subset_rows in itertools.groupby(
+            rows, operator.itemgetter(0)):
+        _, ids, qualifiers, *fields = zip(*subset_rows)
+        _, index = numpy.unique(ids, return_inverse=True)
+        array = numpy.zeros((index.max() + 1, max(qualifiers) + 1),
+                            dtype=PackedValues.DTYPE)
+        array['error'] = array['upper_bound'] = numpy.nan
+        for name, field in zip(PackedValues.DTYPE.names, fields):
+            array[name][index, qualifiers] = numpy.array(
+                field, dtype=PackedValues.DTYPE[name])
+        arrays[subset_pk] = array
+    return arrays
+
+
+def get_datapoint_values(subsets):
+    """Return the numerical values of several subsets per data point.
+
+    Unlike get_values(), the data points are not assumed to share the
+    same layout, so that this works for any kind of subset. For each
+    subset the result contains a list of data points, each of which
+    is a list of (qualifier, value, value_type, error, upper_bound)
+    tuples. Missing errors and upper bounds are None. The values of
+    all subsets that are not packed are fetched with two queries.
+    Returns a dictionary keyed by the primary keys of the subsets.
+
+    """
+    datapoints = {}
+    unpacked = []
+    for subset in subsets:
+        if hasattr(subset, 'packed_values'):
+            datapoints[subset.pk] = [
+                [(qualifier, value, value_type,
+                  None if numpy.isnan(error) else error,
+                  None if numpy.isnan(upper_bound) else upper_bound)
+                 for qualifier, (value, value_type, error, upper_bound)
+                 in enumerate(row)]
+                for row in subset.packed_values.get_array().tolist()]
+        else:
+            datapoints[subset.pk] = []
+            unpacked.append(subset.pk)
+    values = {}
+    for subset_pk, datapoint_pk in Datapoint.objects.filter(
+            subset__in=unpacked).order_by('pk').values_list('subset', 'pk'):
+        values[datapoint_pk] = []
+        datapoints[subset_pk].append(values[datapoint_pk])
+    for datapoint_pk, *value in NumericalValue.objects.filter(
+            datapoint__subset__in=unpacked).order_by('pk').values_list(
+                'datapoint', 'qualifier', 'value', 'value_type',
+                'error__value', 'upperbound__value'):
+        values[datapoint_pk].append(tuple(value))
+    return datapoints
+
 
 class Datapoint(Base):
     """Container for the data point.
@@ -401,6 +673,32 @@ class NumericalValueBase(Base):
         abstract = True
 
 
+def format_value(value, value_type, error=None, upper_bound=None, F=''):
+    """Return the value as a formatted string, e.g., ">12.3 (±0.4)"."""
+    value_str = f'{NumericalValueBase.VALUE_TYPES[value_type][1]}{value:{F}}'
+    if error is not None:
+        value_str += f' (±{error:{F}})'
+    if upper_bound is not None:
+        value_str += f'...{upper_bound:{F}}'
+    return value_str
+
+
+def format_values(array, F=''):
+    """Format a structured array of Subset.get_values() element-wise.
+
+    Returns nested lists of strings with the same shape as the array.
+
+    """
+    def none_if_nan(x):
+        return None if numpy.isnan(x) else x
+
+    if array.ndim > 1:
+        return [format_values(row, F) for row in array]
+    return [format_value(value, value_type, none_if_nan(error),
+                         none_if_nan(upper_bound), F)
+            for value, value_type, error, upper_bound in array.tolist()]
+
+
 class NumericalValue(NumericalValueBase):
     """Numerical value(s) associated with a data point."""
     PRIMARY = 0
@@ -414,6 +712,12 @@ class NumericalValue(NumericalValueBase):
     qualifier = models.PositiveSmallIntegerField(
         default=PRIMARY, choices=QUALIFIER_TYPES)
 
+    class Meta:
+        # Covers reading the values of the data points of a subset in
+        # the order of the qualifier without touching the table
+        indexes = [models.Index(fields=['datapoint', 'qualifier', 'value',
+                                        'value_type'])]
+
     def formatted(self, F=''):
         """Return the value as a formatted string.
 
@@ -421,12 +725,11 @@ class NumericalValue(NumericalValueBase):
         attached to the value, e.g., ">12.3 (±0.4)".
 
         """
-        value_str = f'{self.VALUE_TYPES[self.value_type][1]}{self.value:{F}}'
-        if hasattr(self, 'error'):
-            value_str += f' (±{self.error.value:{F}})'
-        if hasattr(self, 'upperbound'):
-            value_str += f'...{self.upperbound.value:{F}}'
-        return value_str
+        return format_value(
+            self.value, self.value_type,
+            self.error.value if hasattr(self, 'error') else None,
+            self.upperbound.value if hasattr(self, 'upperbound') else None,
+            F)
 
 
 class NumericalValueFixed(NumericalValueBase):
@@ -438,6 +741,9 @@ class NumericalValueFixed(NumericalValueBase):
     error = models.FloatField(null=True)
     upper_bound = models.FloatField(null=True)
 
+    class Meta:
+        indexes = [models.Index(fields=['subset', 'physical_property'])]
+
     def formatted(self):
         """Same as for NumericalValue but error is now a class member."""
         value_str = f'{self.VALUE_TYPES[self.value_type][1]}{self.value}'
@@ -460,6 +766,9 @@ class Symbol(Base):
     value = models.CharField(max_length=10)
     counter = models.PositiveSmallIntegerField(default=0)
 
+    class Meta:
+        indexes = [models.Index(fields=['datapoint', 'counter', 'value'])]
+
 
 class ComputationalDetails(Base):
     dataset = models.ForeignKey(
@@ -537,6 +846,101 @@ class UpperBound(Base):
     value = models.FloatField()
 
 
+class PackedValues(Base):
+    """Numerical values of a subset stored as a single array.
+
+    Large subsets, such as curves with many thousands of points, are
+    not split into Datapoint, NumericalValue, Error, and UpperBound
+    rows. Instead, all values are stored here as one NumPy array in
+    the .npy format. The array has one row per data point and one
+    column per qualifier (primary, secondary). See
+    Subset.get_values() for reading the values of any subset.
+
+    """
+    DTYPE = numpy.dtype([('value', 'f8'), ('value_type', 'u1'),
+                         ('error', 'f8'), ('upper_bound', 'f8')])
+    subset = models.OneToOneField(Subset, on_delete=models.CASCADE,
+                                  primary_key=True,
+                                  related_name='packed_values')
+    count = models.PositiveIntegerField()
+    data = models.BinaryField()
+
+    def set_array(self, array):
+        """Serialize the structured array into the data field."""
+        buffer = io.BytesIO()
+        numpy.save(buffer, array.astype(self.DTYPE), allow_pickle=False)
+        self.data = buffer.getvalue()
+        self.count = len(array)
+
+    def get_array(self):
+        """Return the structured array stored in the data field."""
+        return numpy.load(io.BytesIO(self.data), allow_pickle=False)
+
+
+class AtomicStructure(Base):
+    """Lattice vectors and atomic sites of an atomic structure subset.
+
+    Instead of one data point per lattice vector and atom, the whole
+    geometry is stored as two NumPy arrays in the .npy format so that
+    even large supercells are read with a single query. Each
+    coordinate has the fields of PackedValues.DTYPE, i.e., it may
+    carry an error and an upper bound. The lattice constants are
+    still stored as data points.
+
+    """
+    SITE_DTYPE = numpy.dtype([('element', 'U10'), ('fractional', '?'),
+                              ('position', PackedValues.DTYPE, (3,))])
+    subset = models.OneToOneField(Subset, on_delete=models.CASCADE,
+                                  primary_key=True,
+                                  related_name='atomic_structure')
+    count = models.PositiveIntegerField()
+    lattice_vectors = models.BinaryField()
+    sites = models.BinaryField()
+
+    def set_arrays(self, lattice_vectors, sites):
+        """Serialize the lattice vectors and sites.
+
+        lattice_vectors has the shape (number of vectors, 3) and the
+        dtype PackedValues.DTYPE and sites is an array of SITE_DTYPE.
+
+        """
+        for name, array, dtype in (
+                ('lattice_vectors', lattice_vectors, PackedValues.DTYPE),
+                ('sites', sites, self.SITE_DTYPE)):
+            buffer = io.BytesIO()
+            numpy.save(buffer, array.astype(dtype), allow_pickle=False)
+            setattr(self, name, buffer.getvalue())
+        self.count = len(sites)
+
+    def get_lattice_vectors(self):
+        """Return the lattice vectors as an array of shape (n, 3)."""
+        return numpy.load(io.BytesIO(self.lattice_vectors),
+                          allow_pickle=False)
+
+    def get_sites(self):
+        """Return the sites as an array of SITE_DTYPE."""
+        return numpy.load(io.BytesIO(self.sites), allow_pickle=False)
+
+    def as_json(self):
+        """Return the structure as shown on the website.
+
+        The coordinates are formatted the same way as the values of
+        data points. The coordinate type ("atom" or "atom_frac") is
+        that of the first site.
+
+        """
+        sites = self.get_sites()
+        data = {'vectors': format_values(self.get_lattice_vectors(), '.10g')}
+        if len(sites):
+            data['coord-type'] = (
+                'atom_frac' if sites['fractional'][0] else 'atom')
+        data['coordinates'] = [
+            (element, *position) for element, position in zip(
+                sites['element'].tolist(),
+                format_values(sites['position'], '.9g'))]
+        return data
+
+
 def data_file_path(instance, filename):
     return os.path.join(
         'data_files', f'dataset_{instance.dataset.pk}', filename)
@@ -587,3 +991,76 @@ class PhaseTransition(NumericalValueBase):
         if self.upper_bound:
             value_str += f'...{self.upper_bound}'
         return value_str
+
+
+class Job(models.Model):
+    """Slow side effect of a request that is run in the background.
+
+    A job is created in the same transaction as the data it refers to,
+    so that it becomes visible to the run_jobs command only after the
+    data have been committed. The task is the name of a function in
+    materials.jobs and arguments are passed to it as keywords.
+
+    """
+    PENDING = 0
+    RUNNING = 1
+    DONE = 2
+    FAILED = 3
+    STATUSES = (
+        (PENDING, 'pending'),
+        (RUNNING, 'running'),
+        (DONE, 'done'),
+        (FAILED, 'failed'),
+    )
+    task = models.CharField(max_length=100)
+    arguments = models.JSONField(default=dict, blank=True)
+    dataset = models.ForeignKey(Dataset, null=True, blank=True,
+                                on_delete=models.CASCADE, related_name='jobs')
+    status = models.PositiveSmallIntegerField(default=PENDING,
+                                              choices=STATUSES)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=3)
+    run_after = models.DateTimeField(default=timezone.now)
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+    error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'run_after'])]
+
+    def __str__(self):
+        return f'{self.task} #{self.pk}'
+
+
+class SearchTrigram(models.Model):
+    """Inverted index of the text that can be searched for.
+
+    Each row states that the text of an indexed field (see search.py)
+    of the object with object_id contains the trigram, i.e., the
+    three consecutive characters in lower case. A search then only
+    needs to look up the trigrams of the search text instead of
+    scanning the tables.
+
+    """
+    SYSTEM = 0
+    ORGANIC = 1
+    INORGANIC = 2
+    PROPERTY = 3
+    AUTHOR = 4
+    FIELDS = (
+        (SYSTEM, 'system names and formula'),
+        (ORGANIC, 'organic component'),
+        (INORGANIC, 'inorganic component'),
+        (PROPERTY, 'property name'),
+        (AUTHOR, 'author last name'),
+    )
+    field = models.PositiveSmallIntegerField(choices=FIELDS)
+    object_id = models.PositiveIntegerField()
+    trigram = models.CharField(max_length=3)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['field', 'trigram', 'object_id']),
+            models.Index(fields=['field', 'object_id']),
+        ]
@@ -1,28 +1,136 @@
-"""Functions related to the MatD3/Qresp interface."""
-import matplotlib
+"""Functions related to the MatD3/Qresp interface.
+
+The figure that represents a data set at Qresp is not created when
+the data set is submitted but on the first request, see get_figure().
+It is then cached on disk under a name that contains the version of
+the data set, so that it is regenerated whenever the data set, or the
+properties and units shown in it, change.
+
+"""
+import contextlib
+import fcntl
+import glob
 import os
 import shutil
+import tempfile
+from concurrent.futures import Future
 
 from . import models
+from . import rendering
 from mainproject import settings
 
-matplotlib.use('Agg')
 
-from matplotlib import pyplot  # noqa
+def figure_location(pk):
+    """Return the directory of the Qresp files of a data set."""
+    return os.path.join(settings.MEDIA_ROOT, f'qresp/dataset_{pk}')
+
+
+def dataset_version(dataset):
+    """Return the version of the data set as a string.
+
+    This is the time of the last change to the data set or to any of
+    the properties and units shown in its figure. The related objects
+    should be loaded with select_related.
+
+    """
+    timestamps = [dataset.updated]
+    for related in (dataset.primary_property, dataset.primary_unit,
+                    dataset.secondary_property, dataset.secondary_unit):
+        if related:
+            timestamps.append(related.updated)
+    return f'{max(timestamps):%Y%m%d%H%M%S%f}'
+
+
+def figure_path(pk, version):
+    """Return the path of the cached figure for the version."""
+    return os.path.join(figure_location(pk), f'figure_{version}.png')
+
+
+@contextlib.contextmanager
+def lock(pk):
+    """Hold an exclusive lock on the Qresp files of a data set.
+
+    The lock is a file lock, so that it is respected by all processes
+    of the web server and by the management commands.
+
+    """
+    location = figure_location(pk)
+    os.makedirs(location, exist_ok=True)
+    with open(os.path.join(location, '.lock'), 'w') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def publish_figure(pk, version, path):
+    """Move a rendered figure into the cache and remove old versions.
 
+    Should be called with the lock held.
 
-def create_static_files(request, dataset):
-    # Create static files for Qresp
-    qresp_loc = os.path.join(settings.MEDIA_ROOT,
-                             f'qresp/dataset_{dataset.pk}')
+    """
+    new_path = figure_path(pk, version)
+    os.replace(path, new_path)
+    for old_path in glob.glob(os.path.join(figure_location(pk),
+                                           'figure_*.png')):
+        if old_path != new_path:
+            os.remove(old_path)
+
+
+def get_figure(dataset):
+    """Return the path of the Qresp figure, creating it if necessary.
+
+    If several requests ask for a missing or outdated figure at the
+    same time, only the first one renders it while the others wait
+    for the result.
+
+    """
+    version = dataset_version(dataset)
+    path = figure_path(dataset.pk, version)
+    if os.path.exists(path):
+        return path
+    with lock(dataset.pk):
+        if not os.path.exists(path):
+            temporary_path, future = render_figure(dataset)
+            try:
+                future.result()
+                publish_figure(dataset.pk, version, temporary_path)
+            finally:
+                if os.path.exists(temporary_path):
+                    os.remove(temporary_path)
+    return path
+
+
+def render_figure(dataset):
+    """Start rendering the Qresp figure into a new temporary file.
+
+    Returns the path of the temporary file and a Future that is done
+    once the file has been written.
+
+    """
+    location = figure_location(dataset.pk)
+    os.makedirs(location, exist_ok=True)
+    fd, path = tempfile.mkstemp(suffix='.png', dir=location)
+    os.close(fd)
+    try:
+        return path, create_static_files(None, dataset, path)
+    except Exception:
+        os.remove(path)
+        raise
+
+
+def create_static_files(request, dataset, path):
+    """Create static files for Qresp.
+
+    The figure is rendered in the render pool and written to path.
+    Returns a Future that is done once the figure has been written.
+
+    """
     qresp_plot_title = (
         f'Generated from numerical data:\n{dataset.primary_property}')
     if dataset.primary_unit:
         qresp_plot_title += f', {dataset.primary_unit}'
-    try:
-        os.makedirs(qresp_loc)
-    except FileExistsError:
-        print(f"Error: I am trying to create a directory called {qresp_loc} but this directory already exists.")
     if dataset.primary_property.name == 'atomic structure':
         value_sets = []
         for subset in dataset.subsets.all():
@@ -41,21 +149,16 @@ def create_static_files(request, dataset):
                         [f'Subset {i_values+1}', symbol, value, unit])
                 else:
                     values_transposed.append(['', symbol, value, unit])
-        fig, ax = pyplot.subplots(
-            figsize=(6, max(len(values_transposed)/4, 3)))
-        ax.set_title(qresp_plot_title)
-        fig.patch.set_visible(False)
-        ax.axis('off')
-        ax.axis('tight')
-        pyplot.table(cellText=values_transposed, loc='center')
-        fig.tight_layout()
-        pyplot.savefig(os.path.join(qresp_loc, 'figure.png'))
-        pyplot.close()
+        return rendering.render(rendering.table, values_transposed,
+                                qresp_plot_title, 6, path=path)
     elif dataset.primary_property.name == 'band structure':
         bs_file_loc = os.path.join(
             settings.MEDIA_ROOT,
             f'uploads/dataset_{dataset.pk}/band_structure_full.png')
-        shutil.copyfile(bs_file_loc, os.path.join(qresp_loc, 'figure.png'))
+        shutil.copyfile(bs_file_loc, path)
+        future = Future()
+        future.set_result(None)
+        return future
     elif dataset.primary_property.name.startswith('phase transition '):
         value_sets = []
         for subset in dataset.subsets.all():
@@ -92,24 +195,14 @@ def create_static_files(request, dataset):
                         [f'Subset {i_values+1}', label, value])
                 else:
                     values_transposed.append(['', label, value])
-        fig, ax = pyplot.subplots(
-            figsize=(4, max(len(values_transposed)/4, 3)))
-        ax.set_title(qresp_plot_title)
-        fig.patch.set_visible(False)
-        ax.axis('off')
-        ax.axis('tight')
-        pyplot.table(cellText=values_transposed, loc='center')
-        fig.tight_layout()
-        pyplot.savefig(os.path.join(qresp_loc, 'figure.png'))
-        pyplot.close()
+        return rendering.render(rendering.table, values_transposed,
+                                qresp_plot_title, 4, path=path)
     elif dataset.secondary_property:
+        lines = []
         for subset in dataset.subsets.all():
-            values = models.NumericalValue.objects.filter(
-                datapoint__subset=subset).order_by(
-                    'qualifier', 'datapoint__pk').values_list(
-                        'value', flat=True)
-            y_values = values[:len(values)//2]
-            x_values = values[len(values)//2:len(values)]
+            values = subset.get_values()['value']
+            y_values = values[:, 0]
+            x_values = values[:, -1]
             fixed_values = []
             for v in subset.fixed_values.all():
                 fixed_values.append(
@@ -119,29 +212,24 @@ def create_static_files(request, dataset):
                 sub_label = ', '.join(fixed_values)
             if subset.label:
                 sub_label = subset.label + ' ' + sub_label
-            pyplot.plot(x_values, y_values, '-o', linewidth=0.5, ms=3,
-                        label=sub_label)
-        pyplot.title(qresp_plot_title)
+            lines.append((x_values.tolist(), y_values.tolist(), sub_label))
         if dataset.primary_unit:
             primary_unit_label = dataset.primary_unit.label
         else:
             primary_unit_label = ''
-        pyplot.ylabel(f'{dataset.primary_property.name}, {primary_unit_label}')
         if dataset.secondary_unit:
             secondary_unit_label = dataset.secondary_unit.label
         else:
             secondary_unit_label = ''
-        pyplot.xlabel(f'{dataset.secondary_property.name}, '
-                      f'{secondary_unit_label}')
-        pyplot.legend(loc='upper left')
-        pyplot.savefig(os.path.join(qresp_loc, 'figure.png'))
-        pyplot.close()
+        return rendering.render(
+            rendering.line_plot, lines, qresp_plot_title,
+            f'{dataset.secondary_property.name}, {secondary_unit_label}',
+            f'{dataset.primary_property.name}, {primary_unit_label}',
+            path=path)
     else:
         value_sets = []
         for subset in dataset.subsets.all():
-            value_sets.append(models.NumericalValue.objects.filter(
-                datapoint__subset=subset).order_by(
-                    'datapoint__pk').values_list('value', flat=True))
+            value_sets.append(subset.get_values()['value'].ravel().tolist())
         values_transposed = []
         for i_values, values in enumerate(value_sets):
             for i_value, value in enumerate(values):
@@ -151,13 +239,5 @@ def create_static_files(request, dataset):
                     values_transposed.append([f'Subset {i_values+1}', value])
                 else:
                     values_transposed.append(['', value])
-        fig, ax = pyplot.subplots(
-            figsize=(3, max(len(values_transposed)/4, 3)))
-        ax.set_title(qresp_plot_title)
-        fig.patch.set_visible(False)
-        ax.axis('off')
-        ax.axis('tight')
-        pyplot.table(cellText=values_transposed, loc='center')
-        fig.tight_layout()
-        pyplot.savefig(os.path.join(qresp_loc, 'figure.png'))
-        pyplot.close()
+        return rendering.render(rendering.table, values_transposed,
+                                qresp_plot_title, 3, path=path)
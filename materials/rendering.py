@@ -0,0 +1,154 @@
+# This file is covered by the BSD license. See LICENSE in the root directory.
+"""Rendering of static figures in a pool of worker processes.
+
+Figures are built with the object-oriented API of Matplotlib, i.e.,
+matplotlib.figure.Figure with an Agg canvas, instead of the global
+state of pyplot. Each figure is thus owned by the function that draws
+it and nothing leaks into the next one, even if drawing fails.
+
+The drawing functions below take plain Python data and return PNG
+images as bytes, so that they can be sent to other processes. Use
+render() to run them in the pool. The number of worker processes is
+set by MATD3_RENDER_PROCESSES. With 0, figures are rendered in the
+calling process.
+
+"""
+import io
+import multiprocessing
+import os
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+from mainproject import settings
+
+_pool = None
+
+
+def new_figure(**kwargs):
+    """Return a Figure with an Agg canvas attached."""
+    figure = Figure(**kwargs)
+    FigureCanvasAgg(figure)
+    return figure
+
+
+def to_png(figure, **kwargs):
+    """Return the figure as PNG image."""
+    in_memory_object = io.BytesIO()
+    figure.savefig(in_memory_object, format='png', **kwargs)
+    return in_memory_object.getvalue()
+
+
+def band_structure(bands, segment_locations, x_labels, energy_windows):
+    """Plot the band structure and return one image per energy window.
+
+    bands is a list of bands, each of which is a list of energies at
+    all k-points. x_labels contains a label for each k-point, which
+    is empty except at the segment locations. The images differ only
+    in the limits of the y-axis, which are given by the pairs in
+    energy_windows.
+
+    """
+    HELPER_LINE_WIDTH = 0.2
+    figure = new_figure()
+    ax = figure.add_subplot(111)
+    x_ticks = range(len(x_labels))
+    for band in bands:
+        ax.plot(x_ticks, band, color='blue', lw=1.0)
+    # Set x-axis labels
+    ax.xaxis.set_ticks_position('none')
+    ax.set_xticks(x_ticks)
+    ax.set_xticklabels(x_labels)
+    ax.set_xlim(left=0, right=len(x_ticks))
+    # Set y-axis label
+    ax.set_ylabel('Energy, eV')
+    # Draw some vertical and horizontal helper lines
+    for segment_i in segment_locations:
+        ax.axvline(x=segment_i, color='black', linestyle='--',
+                   lw=HELPER_LINE_WIDTH)
+    ax.axhline(y=0, color='black', linestyle='--', lw=HELPER_LINE_WIDTH)
+    images = []
+    for bottom, top in energy_windows:
+        ax.set_ylim(bottom=bottom, top=top)
+        images.append(to_png(figure, bbox_inches='tight'))
+    return images
+
+
+def table(cells, title, width):
+    """Draw the cells as a table without axes."""
+    figure = new_figure(figsize=(width, max(len(cells)/4, 3)))
+    ax = figure.add_subplot(111)
+    ax.set_title(title)
+    figure.patch.set_visible(False)
+    ax.axis('off')
+    ax.axis('tight')
+    ax.table(cellText=cells, loc='center')
+    figure.tight_layout()
+    return to_png(figure)
+
+
+def line_plot(lines, title, x_label, y_label):
+    """Plot each (x values, y values, label) of lines with markers."""
+    figure = new_figure()
+    ax = figure.add_subplot(111)
+    for x_values, y_values, label in lines:
+        ax.plot(x_values, y_values, '-o', linewidth=0.5, ms=3, label=label)
+    ax.set_title(title)
+    ax.set_xlabel(x_label)
+    ax.set_ylabel(y_label)
+    if any(label for _, _, label in lines):
+        ax.legend(loc='upper left')
+    return to_png(figure)
+
+
+def _render(function, args, path):
+    """Call function with args and write the result to path if given."""
+    image = function(*args)
+    if path is None:
+        return image
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(image)
+
+
+def _warm_up():
+    """Load the fonts and the Agg backend once per worker."""
+    to_png(new_figure(figsize=(1, 1)))
+
+
+def get_pool(processes=None):
+    """Return the pool of render processes, starting it if necessary.
+
+    The workers are spawned rather than forked, so that they share
+    nothing with the web server process, and are reused for all
+    subsequent figures. The number of processes defaults to
+    MATD3_RENDER_PROCESSES and only applies if the pool has not been
+    started yet.
+
+    """
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(
+            processes or settings.MATD3_RENDER_PROCESSES,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_warm_up)
+    return _pool
+
+
+def render(function, *args, path=None):
+    """Run one of the drawing functions in the pool.
+
+    Returns a Future whose result is the return value of function. If
+    path is given, the image is instead written to that file by the
+    worker and the result is None.
+
+    """
+    if not settings.MATD3_RENDER_PROCESSES:
+        future = Future()
+        try:
+            future.set_result(_render(function, args, path))
+        except Exception as error:
+            future.set_exception(error)
+        return future
+    return get_pool().submit(_render, function, args, path)
@@ -0,0 +1,117 @@
+# This file is covered by the BSD license. See LICENSE in the root directory.
+"""Substring search through the trigram index.
+
+The indexed fields are listed in INDEXED_FIELDS. Their trigrams are
+stored as SearchTrigram rows whenever an object is saved (see
+signals.py). A search for a text of at least three characters first
+finds the objects that contain all of its trigrams with an indexed
+query and only then checks the actual text of those few candidates.
+The texts are padded with two spaces before indexing, so that any
+shorter text is the beginning of a trigram and can be found with a
+range lookup on the index.
+
+"""
+import functools
+import operator
+
+from django.db.models import Case, Count, IntegerField, Q, When
+from django.db.models.functions import Length, Lower
+
+from . import models
+
+Trigram = models.SearchTrigram
+
+# Appended to the indexed texts
+PADDING = '  '
+
+# Model and names of the model fields of each indexed field
+INDEXED_FIELDS = {
+    Trigram.SYSTEM: (models.System,
+                     ('formula', 'group', 'iupac', 'compound_name')),
+    Trigram.ORGANIC: (models.System, ('organic',)),
+    Trigram.INORGANIC: (models.System, ('inorganic',)),
+    Trigram.PROPERTY: (models.Property, ('name',)),
+    Trigram.AUTHOR: (models.Author, ('last_name',)),
+}
+
+
+def trigrams(text):
+    """Return the set of trigrams of text in lower case."""
+    text = text.lower()
+    return {text[i:i+3] for i in range(len(text) - 2)}
+
+
+def _index_rows(field, object_id, texts):
+    grams = set().union(*(trigrams(text + PADDING) for text in texts))
+    return [Trigram(field=field, object_id=object_id, trigram=gram)
+            for gram in sorted(grams)]
+
+
+def update_index(instance):
+    """Replace the index entries of a saved object."""
+    for field, (model, names) in INDEXED_FIELDS.items():
+        if isinstance(instance, model):
+            Trigram.objects.filter(field=field,
+                                   object_id=instance.pk).delete()
+            Trigram.objects.bulk_create(_index_rows(
+                field, instance.pk,
+                [getattr(instance, name) for name in names]))
+
+
+def remove_from_index(instance):
+    """Remove the index entries of a deleted object."""
+    fields = [field for field, (model, _) in INDEXED_FIELDS.items()
+              if isinstance(instance, model)]
+    Trigram.objects.filter(field__in=fields, object_id=instance.pk).delete()
+
+
+def rebuild_index(batch_size=2000):
+    """Index all objects from scratch and return the number of rows."""
+    Trigram.objects.all().delete()
+    n_rows = 0
+    for field, (model, names) in INDEXED_FIELDS.items():
+        rows = []
+        for pk, *texts in model.objects.values_list('pk', *names).iterator():
+            rows.extend(_index_rows(field, pk, texts))
+            if len(rows) >= batch_size:
+                n_rows += len(Trigram.objects.bulk_create(rows))
+                rows = []
+        n_rows += len(Trigram.objects.bulk_create(rows))
+    return n_rows
+
+
+def find(field, text):
+    """Return the pks of the objects whose field contains text.
+
+    The search is case insensitive. The objects are ranked by how
+    well they match: exact matches come first, followed by those that
+    start with the text and then by all others. Within each group,
+    the objects are ordered by the length and then the text of the
+    first model field. The ranking is done by the database, so the
+    returned queryset can be sliced to fetch only one page.
+
+    """
+    model, names = INDEXED_FIELDS[field]
+    grams = trigrams(text)
+    if grams:
+        candidates = Trigram.objects.filter(
+            field=field, trigram__in=grams).values('object_id').annotate(
+                count=Count('pk')).filter(count=len(grams)).values(
+                    'object_id')
+    else:
+        # All trigrams that start with the text
+        start = text.lower()
+        candidates = Trigram.objects.filter(
+            field=field, trigram__gte=start,
+            trigram__lt=start + '\uffff').values('object_id')
+
+    def any_name(lookup):
+        return functools.reduce(operator.or_, (
+            Q(**{f'{name}__{lookup}': text}) for name in names))
+    return model.objects.filter(pk__in=candidates).filter(
+        any_name('icontains')).annotate(rank=Case(
+            When(any_name('iexact'), then=0),
+            When(any_name('istartswith'), then=1),
+            default=2, output_field=IntegerField())).order_by(
+                'rank', Length(names[0]), Lower(names[0]), 'pk').values_list(
+                    'pk', flat=True)
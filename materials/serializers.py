@@ -135,8 +135,9 @@ class FixedValueSerializer(BaseSerializer):
 
 class SubsetSerializer(BaseSerializer):
     crystal_system = serializers.CharField(source='get_crystal_system_display')
-    datapoints = DatapointSerializer(many=True)
+    datapoints = serializers.SerializerMethodField()
     fixed_values = FixedValueSerializer(many=True)
+    atomic_structure = serializers.SerializerMethodField()
 
     class Meta:
         model = models.Subset
@@ -147,12 +148,97 @@ class SubsetSerializer(BaseSerializer):
             'crystal_system',
             'fixed_values',
             'datapoints',
+            'atomic_structure',
+        )
+
+    def get_datapoints(self, subset):
+        """Same as DatapointSerializer but from bulk value lists.
+
+        The values of all subsets that are being serialized, e.g., all
+        data sets of a page, are fetched together the first time this
+        is called and stored in the context.
+
+        """
+        if 'datapoint_values' not in self.context:
+            self.context['datapoint_values'] = models.get_datapoint_values(
+                self.root_subsets(subset))
+        datapoint_values = self.context['datapoint_values']
+        if subset.pk not in datapoint_values:
+            datapoint_values.update(models.get_datapoint_values([subset]))
+        qualifiers = dict(models.NumericalValue.QUALIFIER_TYPES)
+        return [{'values': [{'qualifier': qualifiers[qualifier],
+                             'formatted': models.format_value(*value)}
+                            for qualifier, *value in values]}
+                for values in datapoint_values[subset.pk]]
+
+    def get_atomic_structure(self, subset):
+        """Lattice vectors and sites if stored as AtomicStructure."""
+        if hasattr(subset, 'atomic_structure'):
+            return subset.atomic_structure.as_json()
+        return None
+
+    def root_subsets(self, subset):
+        """Return all subsets of the instance of the root serializer."""
+        instance = self.root.instance
+        if isinstance(instance, (models.Dataset, models.Subset)):
+            instance = [instance]
+        subsets = []
+        for obj in instance:
+            if isinstance(obj, models.Dataset):
+                subsets.extend(obj.subsets.all())
+            elif isinstance(obj, models.Subset):
+                subsets.append(obj)
+        return subsets or [subset]
+
+
+class NestedSystemSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = models.System
+        exclude = ('element_mask_1', 'element_mask_2')
+
+
+class LinkedDatasetSerializer(serializers.ModelSerializer):
+    linked_to = serializers.PrimaryKeyRelatedField(
+        source='linked_datasets', many=True, read_only=True)
+
+    class Meta:
+        model = models.Dataset
+        fields = (
+            'id',
+            'created',
+            'updated',
+            'caption',
+            'primary_property_label',
+            'secondary_property_label',
+            'visible',
+            'is_figure',
+            'is_experimental',
+            'dimensionality',
+            'sample_type',
+            'extraction_method',
+            'representative',
+            'doi',
+            'space_group',
+            'notice',
+            'created_by',
+            'updated_by',
+            'system',
+            'primary_property',
+            'primary_unit',
+            'secondary_property',
+            'secondary_unit',
+            'reference',
+            'space_group_ID',
+            'linked_to',
+            'verified_by',
         )
 
 
 class DatasetSerializer(BaseSerializer):
     sample_type = serializers.CharField(source='get_sample_type_display')
+    system = NestedSystemSerializer()
     subsets = SubsetSerializer(many=True)
+    linked_to = LinkedDatasetSerializer(source='linked_datasets', many=True)
 
     class Meta:
         model = models.Dataset
@@ -184,6 +270,7 @@ class DatasetSerializer(BaseSerializer):
 
 class DatasetSerializerInfo(serializers.ModelSerializer):
     sample_type = serializers.CharField(source='get_sample_type_display')
+    system = NestedSystemSerializer()
 
     class Meta:
         model = models.Dataset
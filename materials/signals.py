@@ -1,27 +1,47 @@
 # This file is covered by the BSD license. See LICENSE in the root directory.
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
-from django.db.models.signals import m2m_changed
 
-from . import models
+from . import composition, models, search
 
 
-@receiver(m2m_changed, sender=models.Dataset.linked_to.through)
-def interconnect_all_links(sender, **kwargs):
-    """Make linking of data sets transitive.
+@receiver(post_save, sender=models.System)
+@receiver(post_save, sender=models.Property)
+@receiver(post_save, sender=models.Author)
+def update_search_index(sender, instance, **kwargs):
+    """Keep the search index up to date with the searchable text."""
+    search.update_index(instance)
 
-    If A is linked to B and B is linked to C then A and C should also
-    be linked.
+
+@receiver(post_delete, sender=models.System)
+@receiver(post_delete, sender=models.Property)
+@receiver(post_delete, sender=models.Author)
+def remove_from_search_index(sender, instance, **kwargs):
+    search.remove_from_index(instance)
+
+
+@receiver(post_save, sender=models.System)
+def update_composition(sender, instance, **kwargs):
+    """Keep the element composition up to date with the formula."""
+    composition.update_composition(instance)
+
+
+@receiver(post_delete, sender=models.Dataset)
+def update_entries_count(sender, instance, **kwargs):
+    """Recount the remaining data sets of the system and property.
+
+    Unlike Dataset.delete, this also covers data sets deleted through a
+    queryset or along with their system, property, or reference.
 
     """
-    if kwargs['action'] == 'post_add' and kwargs['pk_set']:
-        target_pk = list(kwargs['pk_set'])[0]
-        direct_datasets = kwargs['instance'].linked_to.all()
-        indirect_datasets = models.Dataset.objects.filter(
-            linked_to__pk=target_pk)
-        all_datasets = list(set(direct_datasets | indirect_datasets))
-        for i in range(len(all_datasets)):
-            dataset_i = all_datasets[i]
-            for j in range(i+1, len(all_datasets)):
-                dataset_j = all_datasets[j]
-                if dataset_j not in dataset_i.linked_to.all():
-                    dataset_i.linked_to.add(dataset_j)
+    models.Dataset.update_all_entries_count(instance.system_id,
+                                            instance.primary_property_id)
+
+
+@receiver(post_delete, sender=models.Dataset)
+def remove_link_group(sender, instance, **kwargs):
+    """Remove the link group if less than two data sets are left in it."""
+    group = instance.link_group_id
+    if group and models.Dataset.objects.filter(
+            link_group=group).count() < 2:
+        models.LinkGroup.objects.filter(pk=group).delete()
@@ -0,0 +1,70 @@
+'use strict';
+
+// Band structures are plotted from the band energies returned by
+// /materials/band-structure/<pk> for the energy window of the form.
+
+const band_structure_charts = {};
+
+function plot_band_structure(pk, data, energy_min, energy_max) {
+  const datasets = data['bands'].map(band => ({
+    data: band.map((energy, i) => ({x: data['k-points'][i], y: energy})),
+    borderColor: 'blue',
+    borderWidth: 1,
+    backgroundColor: 'rgba(0,0,0,0)',
+    pointRadius: 0,
+    fill: false,
+  }));
+  const locations = data['segments'].map(segment => segment['location']);
+  const labels = {};
+  for (let segment of data['segments']) {
+    labels[segment['location']] = segment['label'];
+  }
+  if (band_structure_charts[pk]) {
+    band_structure_charts[pk].destroy();
+  }
+  const ctx = document.getElementById('band_structure_' + pk).getContext('2d');
+  band_structure_charts[pk] = new Chart(ctx, {
+    type: 'line',
+    data: {datasets: datasets},
+    options: {
+      legend: {display: false},
+      tooltips: {enabled: false},
+      animation: false,
+      scales: {
+        xAxes: [{
+          type: 'linear',
+          afterBuildTicks: scale => { scale.ticks = locations.slice(); },
+          ticks: {callback: value => labels[value]},
+        }],
+        yAxes: [{
+          ticks: {min: energy_min, max: energy_max},
+          scaleLabel: {
+            display: true,
+            labelString: 'Energy, eV',
+            fontSize: 14,
+          },
+        }]
+      }
+    }
+  });
+}
+
+function fetch_band_structure(form) {
+  const pk = form.dataset.pk;
+  const energy_min = parseFloat(form.elements['emin'].value);
+  const energy_max = parseFloat(form.elements['emax'].value);
+  axios
+    .get('/materials/band-structure/' + pk,
+         {params: {emin: energy_min, emax: energy_max}})
+    .then(response => {
+      plot_band_structure(pk, response['data'], energy_min, energy_max);
+    });
+}
+
+for (let form of document.querySelectorAll('form.band-structure-range')) {
+  form.addEventListener('submit', event => {
+    event.preventDefault();
+    fetch_band_structure(form);
+  });
+  fetch_band_structure(form);
+}
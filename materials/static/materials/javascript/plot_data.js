@@ -44,16 +44,20 @@ function plot_data(element, data, x_property, x_unit, y_property, y_unit) {
   });
 }
 
-for (let element of document.getElementsByTagName('canvas')) {
-  const plot_id = element.id;
-  const plot_pk = plot_id.split('_')[1];
+const figures = document.querySelectorAll('canvas[id^="figure_"]');
+if (figures.length > 0) {
+  const plot_pks = Array.from(figures, element => element.id.split('_')[1]);
   axios
-    .get('/materials/data-for-chart/' + plot_pk)
+    .get('/materials/data-for-chart', {params: {pks: plot_pks.join(',')}})
     .then(response => {
-      plot_data(plot_id, response['data']['data'],
-                response['data']['secondary-property'],
-                response['data']['secondary-unit'],
-                response['data']['primary-property'],
-                response['data']['primary-unit']);
+      for (let plot_pk of plot_pks) {
+        const data = response['data'][plot_pk];
+        if (data === undefined) {
+          continue;
+        }
+        plot_data('figure_' + plot_pk, data['data'],
+                  data['secondary-property'], data['secondary-unit'],
+                  data['primary-property'], data['primary-unit']);
+      }
     });
 }
@@ -3,15 +3,36 @@ from selenium import webdriver
 from selenium.common.exceptions import NoAlertPresentException
 from selenium.webdriver.common.keys import Keys
 from time import sleep
+from unittest import mock
+import datetime
+import io
+import json
 import os
 import shutil
+import tempfile
+import zipfile
 
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
 from django.shortcuts import reverse
 from django.test import LiveServerTestCase
 from django.test import TestCase
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 
+from . import composition
+from . import ingest
+from . import jobs
 from . import models
+from . import qresp
+from . import search
+from . import utils
+from . import views
 from accounts.tests import USERNAME
 from accounts.tests import PASSWORD
 
@@ -37,6 +58,22 @@ class ModelsTestCase(TestCase):
                 'systems.json',
                 'datasets.json']
 
+    def setUp(self):
+        """Write the uploaded and generated files to a temporary directory.
+
+        The models read MEDIA_ROOT from mainproject.settings and the file
+        storage from django.conf.settings, so both are changed.
+
+        """
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        patcher = mock.patch.object(settings, 'MEDIA_ROOT', media_root)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        override = override_settings(MEDIA_ROOT=media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+
     @classmethod
     def setUpTestData(cls):
         """Start with three data sets of different property"""
@@ -52,43 +89,741 @@ class ModelsTestCase(TestCase):
 
     def test_dataset_links(self):
         datasets = models.Dataset.objects.all()
+
+        def linked(dataset):
+            dataset.refresh_from_db()
+            return [x.pk for x in dataset.linked_datasets()]
+
         # Basic functionality
-        datasets[0].linked_to.add(datasets[1])
-        self.assertEqual(models.Dataset.linked_to.through.objects.count(), 2)
-        self.assertEqual(datasets[0].linked_to.last().pk, datasets[1].pk)
-        self.assertEqual(datasets[1].linked_to.last().pk, datasets[0].pk)
-        self.assertEqual(datasets[2].linked_to.count(), 0)
+        datasets[0].link(datasets[1])
+        self.assertEqual(linked(datasets[0]), [datasets[1].pk])
+        self.assertEqual(linked(datasets[1]), [datasets[0].pk])
+        self.assertEqual(linked(datasets[2]), [])
         # Test if datasets[1] and datasets[2] automatically become linked
-        datasets[0].linked_to.add(datasets[2])
-        self.assertEqual(models.Dataset.linked_to.through.objects.count(), 6)
-        self.assertEqual(datasets[2].linked_to.last().pk, datasets[1].pk)
-        [self.assertEqual(ds.linked_to.count(), 2) for ds in datasets]
+        datasets[0].link(datasets[2])
+        self.assertEqual(models.LinkGroup.objects.count(), 1)
+        [self.assertEqual(len(linked(ds)), 2) for ds in datasets]
         # This should have no effect
-        datasets[2].linked_to.add(datasets[1])
-        [self.assertEqual(ds.linked_to.count(), 2) for ds in datasets]
+        datasets[2].link(datasets[1])
+        [self.assertEqual(len(linked(ds)), 2) for ds in datasets]
         # Simple removal of a link
-        datasets[2].linked_to.remove(datasets[1])
-        self.assertEqual(datasets[2].linked_to.last().pk, datasets[0].pk)
-        self.assertEqual(models.Dataset.linked_to.through.objects.count(), 4)
+        datasets[2].unlink()
+        self.assertEqual(linked(datasets[2]), [])
+        self.assertEqual(linked(datasets[0]), [datasets[1].pk])
         # Deletion should remove all references to the given data set
-        datasets[2].linked_to.add(datasets[1])
+        datasets[2].link(datasets[1])
         datasets[2].delete()
-        self.assertEqual(models.Dataset.linked_to.through.objects.count(), 2)
+        self.assertEqual(linked(datasets[0]), [datasets[1].pk])
+        # A group of one is removed
+        datasets[0].unlink()
+        self.assertEqual(linked(datasets[1]), [])
+        self.assertFalse(models.LinkGroup.objects.exists())
+        # Also when the data set is deleted through a queryset
+        first, second = datasets[0], datasets[1]
+        first.link(second)
+        models.Dataset.objects.filter(pk=first.pk).delete()
+        self.assertEqual(linked(second), [])
+        self.assertFalse(models.LinkGroup.objects.exists())
 
     def test_dataset_links_advanced(self):
-        for _ in range(2):
-            dataset = models.Dataset.objects.last()
+        dataset = models.Dataset.objects.last()
+        for _ in range(50):
             dataset.pk = None
             dataset.save()
-        datasets = models.Dataset.objects.all()
-        datasets[0].linked_to.add(datasets[1])
-        datasets[4].linked_to.add(datasets[3])
-        datasets[1].linked_to.add(datasets[3])
-        self.assertEqual(models.Dataset.linked_to.through.objects.count(), 12)
-        datasets[2].linked_to.add(datasets[3])
-        self.assertEqual(models.Dataset.linked_to.through.objects.count(), 20)
-        models.Dataset.objects.last().delete()
-        self.assertEqual(models.Dataset.linked_to.through.objects.count(), 12)
+        datasets = list(models.Dataset.objects.all())
+        datasets[0].link(datasets[1])
+        datasets[4].link(datasets[3])
+        self.assertEqual(models.LinkGroup.objects.count(), 2)
+        # Merging groups takes the same number of queries regardless of
+        # their size
+        with CaptureQueriesContext(connection) as queries:
+            datasets[1].link(datasets[3])
+        self.assertEqual(models.LinkGroup.objects.count(), 1)
+        self.assertEqual(
+            models.Dataset.objects.exclude(link_group=None).count(), 4)
+        datasets[5].link(*datasets[6:])
+        with self.assertNumQueries(len(queries)):
+            datasets[3].link(datasets[6])
+        datasets[2].link(datasets[3])
+        self.assertEqual(models.LinkGroup.objects.count(), 1)
+        self.assertEqual(
+            models.Dataset.objects.exclude(link_group=None).count(), 53)
+        response = self.client.get(reverse('materials:linked_data',
+                                           args=[datasets[0].pk]))
+        self.assertEqual(len(response.context['object_list']), 53)
+        self.assertEqual(response.context['object_list'][-1].pk,
+                         datasets[0].pk)
+        # The number of API queries does not depend on the size of the
+        # link groups
+        url = reverse('materials:dataset-list')
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url, {'page_size': 5})
+        n_queries = len(queries)
+        datasets[-1].refresh_from_db()
+        datasets[-1].set_linked(datasets[-3:-1])
+        response = self.client.get(url, {'page_size': 5})
+        # Each linked data set is serialized with its own links
+        dataset = response.json()['results'][0]
+        self.assertEqual(dataset['pk'], datasets[-1].pk)
+        linked_to = sorted(dataset['linked_to'], key=lambda x: x['id'])
+        self.assertEqual([x['id'] for x in linked_to],
+                         [datasets[-3].pk, datasets[-2].pk])
+        self.assertEqual(list(linked_to[0]), [
+            'id', 'created', 'updated', 'caption', 'primary_property_label',
+            'secondary_property_label', 'visible', 'is_figure',
+            'is_experimental', 'dimensionality', 'sample_type',
+            'extraction_method', 'representative', 'doi', 'space_group',
+            'notice', 'created_by', 'updated_by', 'system',
+            'primary_property', 'primary_unit', 'secondary_property',
+            'secondary_unit', 'reference', 'space_group_ID', 'linked_to',
+            'verified_by'])
+        self.assertEqual(sorted(linked_to[0]['linked_to']),
+                         [datasets[-2].pk, datasets[-1].pk])
+        with self.assertNumQueries(n_queries):
+            self.client.get(url, {'page_size': 5})
+
+    def submit_data(self, **fields):
+        """Post a data set with the given fields to submit_data."""
+        data = {
+            'select_reference': 1,
+            'select_system': 1,
+            'primary_property': 1,
+            'primary_unit': 1,
+            'origin_of_data': 'is_experimental',
+            'dimensionality_of_the_inorganic_component': 3,
+            'sample_type': models.Dataset.SINGLE_CRYSTAL,
+            'number_of_subsets': 1,
+            'crystal_system_1': models.Subset.CUBIC,
+            'related_data_sets': '',
+        }
+        data.update(fields)
+        for i_subset in range(1, int(data['number_of_subsets']) + 1):
+            data.setdefault(f'import_file_name_{i_subset}', '')
+        self.client.force_login(User.objects.get(pk=1))
+        return self.client.post(reverse('materials:submit_data'), data)
+
+    def test_submit_data(self):
+        self.submit_data(two_axes=True,
+                         secondary_property=2,
+                         secondary_unit=3,
+                         number_of_subsets=2,
+                         crystal_system_2=models.Subset.CUBIC,
+                         subset_datapoints_1='1 2(1)\n3 <4\n',
+                         subset_datapoints_2='5±0.5 6...7\n')
+        dataset = models.Dataset.objects.last()
+        values = models.NumericalValue.objects.filter(
+            datapoint__subset__dataset=dataset).order_by(
+                'datapoint__subset', 'datapoint', 'qualifier')
+        self.assertEqual([v.formatted() for v in values],
+                         ['2.0 (±1.0)', '1.0', '<4.0', '3.0',
+                          '6.0...7.0', '5.0 (±0.5)'])
+        self.assertEqual(
+            [s.datapoints.count() for s in dataset.subsets.all()], [2, 1])
+
+    @mock.patch.object(ingest.DatapointWriter, 'batch_size', 3)
+    def test_submit_data_in_batches(self):
+        rows = [f'{i} {i}({i})' if i % 3 else f'{i} <{i}' for i in range(10)]
+        with CaptureQueriesContext(connection) as queries:
+            self.submit_data(two_axes=True,
+                             secondary_property=2,
+                             secondary_unit=3,
+                             subset_datapoints_1='\n'.join(rows))
+        dataset = models.Dataset.objects.last()
+        datapoints = models.Datapoint.objects.filter(
+            subset__dataset=dataset).order_by('pk')
+        self.assertEqual(
+            [[v.formatted() for v in datapoint.values.order_by('qualifier')]
+             for datapoint in datapoints],
+            [[f'<{i}.0' if i % 3 == 0 else f'{i}.0 (±{i}.0)', f'{i}.0']
+             for i in range(10)])
+        self.assertGreater(len([query for query in queries
+                                if 'INSERT INTO "materials_datapoint"'
+                                in query['sql']]), 3)
+
+    def test_submit_atomic_structure(self):
+        constants = {f'lattice_constant_{key}_1': value for key, value in zip(
+            ('a', 'b', 'c', 'alpha', 'beta', 'gamma'),
+            ('5', '5.1(2)', '5', '90', '90', '<120'))}
+        geometry = ('lattice_vector 5 0 0\n'
+                    '  lattice_vector 0 5.1 0\n'
+                    '# comment\n'
+                    'lattice_vector 0 0 5\n'
+                    'atom_frac 0 0 0 Al\n'
+                    'atom_frac 0.5 0.5(2) 0.5 Ga\n')
+        with mock.patch.object(ingest.DatapointWriter, 'batch_size', 4):
+            self.submit_data(primary_property=3, primary_unit=2,
+                             geometry_format_1='aims',
+                             atomic_coordinates_1=geometry, **constants)
+        subset = models.Subset.objects.last()
+        self.assertEqual(
+            [(symbol, value) for symbol, value, _ in
+             subset.get_lattice_constants()],
+            [('a', '5'), ('b', '5.1 (±0.2)'), ('c', '5'), ('α', '90'),
+             ('β', '90'), ('γ', '<120')])
+        self.assertEqual(subset.datapoints.count(), 6)
+        self.assertEqual(subset.atomic_structure.count, 2)
+        self.assertTrue(subset.has_atomic_coordinates())
+        with self.assertNumQueries(1):
+            data = utils.atomic_coordinates_as_json(subset.pk)
+        self.assertEqual(data['vectors'], [['5', '0', '0'], ['0', '5.1', '0'],
+                                           ['0', '0', '5']])
+        self.assertEqual(data['coord-type'], 'atom_frac')
+        self.assertEqual(data['coordinates'],
+                         [('Al', '0', '0', '0'),
+                          ('Ga', '0.5', '0.5 (±0.2)', '0.5')])
+        with self.assertRaisesRegex(ValueError, 'line: atom 0 0 Al'):
+            ingest.parse_geometry('atom 0 0 Al\n')
+
+    @mock.patch.object(settings, 'MATD3_PACK_THRESHOLD', 2)
+    def test_packed_values(self):
+        self.submit_data(two_axes=True,
+                         secondary_property=2,
+                         secondary_unit=3,
+                         number_of_subsets=2,
+                         crystal_system_2=models.Subset.CUBIC,
+                         subset_datapoints_1='1 2(1)\n3 <4\n',
+                         subset_datapoints_2='5±0.5 6...7\n')
+        packed, unpacked = models.Dataset.objects.last().subsets.all()
+        self.assertFalse(packed.datapoints.exists())
+        self.assertEqual(packed.num_datapoints(), 2)
+        self.assertFalse(hasattr(unpacked, 'packed_values'))
+        response = self.client.get(
+            reverse('materials:get_subset_values', args=[packed.pk]))
+        self.assertEqual(response.json(), [{'y': '2.0 (±1.0)', 'x': '1.0'},
+                                           {'y': '<4.0', 'x': '3.0'}])
+        response = self.client.get(
+            reverse('materials:get_subset_values', args=[unpacked.pk]))
+        self.assertEqual(response.json(), [{'y': '6.0...7.0',
+                                            'x': '5.0 (±0.5)'}])
+        response = self.client.get(reverse('materials:data_for_chart',
+                                           args=[packed.dataset.pk]))
+        self.assertEqual([subset['values'] for subset in response.json()[
+            'data']], [[{'y': 2, 'x': 1}, {'y': 4, 'x': 3}],
+                       [{'y': 6, 'x': 5}]])
+        response = self.client.get(reverse('materials:dataset-detail',
+                                           args=[packed.dataset.pk]))
+        self.assertEqual(response.json()['subsets'][0]['datapoints'][1], {
+            'values': [{'qualifier': 'primary', 'formatted': '<4.0'},
+                       {'qualifier': 'secondary', 'formatted': '3.0'}]})
+
+    def test_data_for_chart(self):
+        self.submit_data(two_axes=True,
+                         secondary_property=2,
+                         secondary_unit=3,
+                         subset_datapoints_1='1 2\n3 4\n')
+        url = reverse('materials:data_for_chart',
+                      args=[models.Dataset.objects.last().pk])
+        with self.assertNumQueries(5):
+            response = self.client.get(url)
+        self.assertEqual(response.json()['data'][0]['values'],
+                         [{'y': 2, 'x': 1}, {'y': 4, 'x': 3}])
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(url).content, response.content)
+        with self.assertNumQueries(1):
+            response = self.client.get(
+                url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        pks = [dataset.pk for dataset in models.Dataset.objects.all()]
+        cache.clear()
+        with self.assertNumQueries(5):
+            response = self.client.get(reverse('materials:data_for_charts'),
+                                       {'pks': ','.join(map(str, pks))})
+        self.assertEqual(list(response.json()), list(map(str, pks)))
+        self.assertEqual(response.json()[str(pks[-1])]['data'][0]['values'],
+                         [{'y': 2, 'x': 1}, {'y': 4, 'x': 3}])
+
+    def test_system_view_queries(self):
+        """Number of queries must not depend on the amount of data."""
+        url = reverse('materials:system', args=[1])
+        self.submit_data(subset_datapoints_1='1 2 3')
+        models.Dataset.objects.update(visible=True, representative=True)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        n_queries = len(queries)
+        self.submit_data(number_of_subsets=2, subset_datapoints_1='1',
+                         crystal_system_2=models.Subset.CUBIC,
+                         subset_datapoints_2='2', fixed_property_1_1=4,
+                         fixed_unit_1_1=4, fixed_value_1_1='300')
+        models.Dataset.objects.update(visible=True, representative=True)
+        with self.assertNumQueries(n_queries):
+            response = self.client.get(url)
+        self.assertContains(response, 'phase transition temperature')
+
+    def test_dataset_api_queries(self):
+        """Number of queries must not depend on the amount of data."""
+        url = reverse('materials:dataset-list')
+        self.submit_data(subset_datapoints_1='1 2 3', fixed_property_1_1=4,
+                         fixed_unit_1_1=4, fixed_value_1_1='200')
+        models.Dataset.objects.last().verified_by.add(1)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        n_queries = len(queries)
+        self.submit_data(two_axes=True,
+                         secondary_property=2,
+                         secondary_unit=3,
+                         number_of_subsets=2,
+                         crystal_system_2=models.Subset.CUBIC,
+                         subset_datapoints_1='1 2(1)\n3 <4\n',
+                         subset_datapoints_2='5 6\n',
+                         fixed_property_1_1=4,
+                         fixed_unit_1_1=4,
+                         fixed_value_1_1='300')
+        models.Dataset.objects.last().verified_by.add(1)
+        with self.assertNumQueries(n_queries):
+            response = self.client.get(url)
+        self.assertEqual(
+            response.json()['results'][0]['subsets'][0]['datapoints'][0],
+            {'values': [{'qualifier': 'secondary', 'formatted': '1.0'},
+                        {'qualifier': 'primary', 'formatted': '2.0 (±1.0)'}]})
+
+    def test_counts(self):
+        self.submit_data(number_of_subsets=2,
+                         crystal_system_2=models.Subset.CUBIC,
+                         subset_datapoints_1='1 2 3',
+                         subset_datapoints_2='4')
+        dataset = models.Dataset.objects.last()
+        self.assertEqual([subset.num_datapoints()
+                          for subset in dataset.subsets.all()], [3, 1])
+        first = models.Dataset.objects.get(pk=1)
+        self.assertEqual(first.num_all_entries(), 2)
+        self.assertEqual(dataset.num_all_entries(), 2)
+        dataset.primary_property_id = 4
+        dataset.save()
+        first.refresh_from_db()
+        self.assertEqual(first.num_all_entries(), 1)
+        self.assertEqual(dataset.num_all_entries(), 1)
+        dataset.primary_property_id = 1
+        dataset.save()
+        dataset.delete()
+        first.refresh_from_db()
+        self.assertEqual(first.num_all_entries(), 1)
+        # Deleting through a queryset
+        pks = list(models.Dataset.objects.values_list('pk', flat=True))
+        self.submit_data(subset_datapoints_1='1')
+        first.refresh_from_db()
+        self.assertEqual(first.num_all_entries(), 2)
+        models.Dataset.objects.exclude(pk__in=pks).delete()
+        first.refresh_from_db()
+        self.assertEqual(first.num_all_entries(), 1)
+        models.Dataset.objects.update(all_entries_count=5)
+        models.Subset.objects.update(datapoint_count=5)
+        out = io.StringIO()
+        call_command('update_counts', stdout=out)
+        self.assertEqual(out.getvalue().strip(),
+                         f'Fixed {models.Subset.objects.count()} subsets and '
+                         f'{models.Dataset.objects.count()} data sets')
+        self.assertEqual(set(models.Dataset.objects.values_list(
+            'all_entries_count', flat=True)), {1})
+
+    def test_explain_queries(self):
+        """The frequent queries must use the composite indexes."""
+        out = io.StringIO()
+        call_command('explain_queries', stdout=out)
+        self.assertNotIn('does not use', out.getvalue())
+
+    def test_search(self):
+        Trigram = models.SearchTrigram
+        for formula in ('CsPbCl3', 'PbCl', 'CsSnBr3'):
+            models.System.objects.create(compound_name=formula,
+                                         formula=formula, organic='Cs')
+        self.assertEqual(
+            [models.System.objects.get(pk=pk).formula
+             for pk in search.find(Trigram.SYSTEM, 'pbcl')],
+            ['PbCl', 'CsPbCl3', '(CH3NH3)PbCl3'])
+        # Shorter texts are found through the beginnings of trigrams
+        self.assertEqual(len(search.find(Trigram.SYSTEM, 'Pb')), 3)
+        self.assertEqual(len(search.find(Trigram.SYSTEM, 'l3')), 2)
+        self.assertEqual(list(search.find(Trigram.ORGANIC, 'ch')), [1])
+        # The index stays up to date
+        system = models.System.objects.get(formula='PbCl')
+        system.formula = system.compound_name = 'PbBr'
+        system.save()
+        self.assertEqual(len(search.find(Trigram.SYSTEM, 'pbcl')), 2)
+        system.delete()
+        self.assertFalse(Trigram.objects.filter(object_id=system.pk,
+                                                field=Trigram.SYSTEM))
+        n_rows = Trigram.objects.count()
+        out = io.StringIO()
+        call_command('rebuild_search_index', stdout=out)
+        self.assertEqual(Trigram.objects.count(), n_rows)
+        # Search page
+        url = reverse('materials:search')
+        response = self.client.post(url, {'search_term': 'author',
+                                          'search_text': 'x las'})
+        self.assertEqual([system.pk for system in response.context['systems']],
+                         [1])
+        response = self.client.post(url, {'search_term': 'physical_property',
+                                          'search_text': 'GAP'})
+        self.assertEqual(response.context['physical_properties'],
+                         ['band gap'])
+        self.assertEqual(len(response.context['systems']), 1)
+        with mock.patch.object(views.SearchFormView, 'paginate_by', 1):
+            response = self.client.post(url, {'search_term': 'organic',
+                                              'search_text': 'cs',
+                                              'page': 2})
+        self.assertEqual(response.context['page_obj'].paginator.count, 2)
+        self.assertEqual(response.context['systems'][0].formula, 'CsSnBr3')
+
+    def test_composition(self):
+        self.assertEqual(composition.parse_formula(
+            'Cs0.05(FA0.83MA0.17)0.95Pb(I0.83Br0.17)3'),
+                         {'Cs': 0.05, 'C': 0.95, 'H': 4.9115, 'N': 1.7385,
+                          'Pb': 1, 'I': 2.49, 'Br': 0.51})
+        self.assertEqual(composition.parse_formula('CuSO4·5H2O'),
+                         {'Cu': 1, 'S': 1, 'O': 9, 'H': 10})
+        for formula in ('', 'XyPbI3', '(CH3NH3PbI3', '2'):
+            with self.assertRaises(ValueError):
+                composition.parse_formula(formula)
+        for formula in ('CsSnBr3', 'CsPbBr3', 'MASnI2Br', 'Unknown'):
+            models.System.objects.create(compound_name=formula,
+                                         formula=formula, inorganic=formula)
+        system = models.System.objects.get(pk=1)
+        self.assertEqual(system.elements.get(
+            component=models.SystemElement.ORGANIC, element=6).count, 1)
+
+        def formulas(query, **kwargs):
+            return [system.formula for system in composition.find(
+                **composition.parse_query(query), **kwargs)]
+        self.assertEqual(formulas('Sn Br'), ['CsSnBr3', 'MASnI2Br'])
+        self.assertEqual(formulas('Br -I'), ['CsPbBr3', 'CsSnBr3'])
+        self.assertEqual(formulas('Br=2:'), ['CsPbBr3', 'CsSnBr3'])
+        self.assertEqual(formulas('I=2 Sn=:1'), ['MASnI2Br'])
+        self.assertEqual(formulas('-Pb'), ['CsSnBr3', 'MASnI2Br'])
+        self.assertEqual(formulas('Pb', only=['Cs', 'Pb', 'Br']),
+                         ['CsPbBr3'])
+        self.assertEqual(
+            formulas('Cl', component=models.SystemElement.INORGANIC),
+            ['(CH3NH3)PbCl3'])
+        self.assertEqual(formulas('Br -Pb',
+                                  component=models.SystemElement.INORGANIC),
+                         ['CsSnBr3', 'MASnI2Br'])
+        for query in ('', 'Xy', '-Pb=1', 'Pb=a'):
+            with self.assertRaises(ValueError):
+                composition.parse_query(query)
+        # The index stays up to date
+        system.formula = 'CsSnCl3'
+        system.save()
+        self.assertEqual(formulas('Sn -Br'), ['CsSnCl3'])
+        self.assertEqual(models.SystemElement.objects.filter(
+            system=system, component=models.SystemElement.FORMULA).count(), 3)
+        n_rows = models.SystemElement.objects.count()
+        call_command('rebuild_search_index', stdout=io.StringIO())
+        self.assertEqual(models.SystemElement.objects.count(), n_rows)
+        self.assertEqual(formulas('Sn -Br'), ['CsSnCl3'])
+        # Search page and API
+        response = self.client.post(reverse('materials:search'), {
+            'search_term': 'elements', 'search_text': 'Sn Br'})
+        self.assertEqual(response.context['page_obj'].paginator.count, 2)
+        url = reverse('materials:system-list')
+        response = self.client.get(url, {'elements': 'Cs -Sn'})
+        self.assertEqual([system['formula'] for system in
+                          response.json()['results']], ['CsPbBr3'])
+        response = self.client.get(url, {'organic_elements': 'N=1'})
+        self.assertEqual(len(response.json()['results']), 1)
+        response = self.client.get(url, {'elements': 'Xy'})
+        self.assertEqual(response.status_code, 400)
+        # The bitmasks are not part of the API
+        systems = self.client.get(url).json()['results']
+        for action in 'detail', 'info':
+            systems.append(self.client.get(reverse(
+                f'materials:dataset-{action}', args=[1])).json()['system'])
+        for system in systems:
+            self.assertIn('formula', system)
+            self.assertNotIn('element_mask_1', system)
+            self.assertNotIn('element_mask_2', system)
+
+    def test_export(self):
+        self.submit_data(subset_datapoints_1='1 2 3')
+        self.submit_data(subset_datapoints_1='4')
+        with mock.patch.object(views.DatasetViewSet, 'export_chunk_size', 1):
+            response = self.client.get(reverse('materials:dataset-export'),
+                                       {'system': 1})
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), models.Dataset.objects.count())
+        self.assertEqual(json.loads(lines[0])['subsets'][0]['datapoints'],
+                         [{'values': [{'qualifier': 'primary',
+                                       'formatted': '4.0'}]}])
+
+    def test_files(self):
+        self.submit_data(subset_datapoints_1='1 2 3', uploaded_files=[
+            SimpleUploadedFile('notes.txt', b'notes'),
+            SimpleUploadedFile('image.png', b'image')])
+        response = self.client.get(reverse(
+            'materials:dataset-files',
+            args=[models.Dataset.objects.last().pk]))
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(
+            response.streaming_content)))
+        self.assertEqual(archive.testzip(), None)
+        self.assertEqual(archive.read('files/additional/notes.txt'), b'notes')
+        self.assertEqual(
+            archive.getinfo('files/additional/image.png').compress_type,
+            zipfile.ZIP_STORED)
+        self.assertIn(b'Origin: experimental', archive.read('files/info.txt'))
+
+    def test_archive(self):
+        self.submit_data(subset_datapoints_1='1 2 3', uploaded_files=[
+            SimpleUploadedFile('notes.txt', b'notes')])
+        self.submit_data(subset_datapoints_1='4')
+        pk1, pk2 = models.Dataset.objects.order_by('-pk').values_list(
+            'pk', flat=True)[:2]
+        url = reverse('materials:dataset-archive')
+        with CaptureQueriesContext(connection) as queries:
+            b''.join(self.client.get(url, {'pks': pk1}).streaming_content)
+        n_queries = len(queries)
+        # The number of queries does not depend on the number of data sets
+        with self.assertNumQueries(n_queries):
+            response = self.client.get(url, {'pks': f'{pk1},{pk2}'})
+            archive = zipfile.ZipFile(io.BytesIO(b''.join(
+                response.streaming_content)))
+        self.assertEqual(
+            archive.read(f'dataset_{pk2}/additional/notes.txt'), b'notes')
+        manifest = json.loads(archive.read('manifest.json'))
+        self.assertEqual([dataset['pk'] for dataset in manifest], [pk1, pk2])
+        self.assertIn(f'dataset_{pk1}/info.txt', manifest[0]['files'])
+        response = self.client.get(url, {'pks': 'x'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_jobs(self):
+        self.submit_data(subset_datapoints_1='1 2 3')
+        dataset = models.Dataset.objects.last()
+        self.assertFalse(dataset.jobs.exists())
+        job = jobs.enqueue('send_mail', subject='', message='',
+                           from_email='', recipient_list=[''])
+        with mock.patch('django.core.mail.send_mail'):
+            call_command('run_jobs', processes=0, once=True,
+                         stdout=io.StringIO())
+        job.refresh_from_db()
+        self.assertEqual(job.status, models.Job.DONE)
+        # A job deleted after being claimed or an error outside of the
+        # task do not stop the worker
+        job = jobs.enqueue('send_mail', subject='', message='',
+                           from_email='', recipient_list=[''])
+        pk = jobs.claim(1)[0]
+        job.delete()
+        self.assertIsNone(jobs.run_job(pk))
+        first, second = [jobs.enqueue('send_mail', subject='', message='',
+                                      from_email='', recipient_list=[''])
+                         for _ in range(2)]
+        stdout, stderr = io.StringIO(), io.StringIO()
+        with mock.patch('django.core.mail.send_mail'), mock.patch.object(
+                jobs, 'run_job', side_effect=[RuntimeError, models.Job.DONE]):
+            call_command('run_jobs', processes=0, once=True,
+                         stdout=stdout, stderr=stderr)
+        self.assertIn(f'Job {first.pk}: Traceback', stderr.getvalue())
+        self.assertIn(f'Job {second.pk}: done', stdout.getvalue())
+        job = jobs.enqueue('send_mail', subject='', message='',
+                           from_email='', recipient_list=[''])
+        with mock.patch('django.core.mail.send_mail', side_effect=OSError):
+            jobs.run_job(jobs.claim(1)[0])
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts),
+                         (models.Job.PENDING, 1))
+        self.assertIn('OSError', job.error)
+        # A job whose worker was killed is taken back after the timeout
+        models.Job.objects.filter(pk=job.pk).update(run_after=timezone.now())
+        self.assertEqual(jobs.claim(1), [job.pk])
+        self.assertEqual(jobs.claim(1), [])
+        started = timezone.now() - datetime.timedelta(minutes=30)
+        models.Job.objects.filter(pk=job.pk).update(started=started)
+        self.assertEqual(jobs.claim(1), [])
+        self.assertEqual(jobs.claim(1, datetime.timedelta(minutes=10)),
+                         [job.pk])
+        models.Job.objects.filter(pk=job.pk).update(started=started)
+        self.assertEqual(jobs.claim(1, datetime.timedelta(minutes=10)), [])
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (models.Job.FAILED, 3))
+
+    def test_qresp_figure(self):
+        self.submit_data(two_axes=True,
+                         secondary_property=2,
+                         secondary_unit=3,
+                         subset_datapoints_1='1 2\n3 4\n')
+        dataset = models.Dataset.objects.last()
+        location = qresp.figure_location(dataset.pk)
+        self.addCleanup(shutil.rmtree, location, ignore_errors=True)
+        self.assertFalse(os.path.exists(location))
+        url = reverse('materials:qresp_figure', args=[dataset.pk])
+        with mock.patch.object(settings, 'MATD3_RENDER_PROCESSES', 0):
+            response = self.client.get(url)
+            self.assertEqual(b''.join(response)[:8], b'\x89PNG\r\n\x1a\n')
+            response.close()
+            first_figure = os.listdir(location)
+            with mock.patch.object(qresp, 'render_figure') as render:
+                self.client.get(url).close()
+            render.assert_not_called()
+            models.Dataset.objects.filter(pk=dataset.pk).update(
+                updated=timezone.now())
+            call_command('render_figures', stdout=io.StringIO(),
+                         stderr=io.StringIO())
+        figures = [name for name in os.listdir(location)
+                   if name.endswith('.png')]
+        self.assertEqual(len(figures), 1)
+        self.assertNotIn(figures[0], first_figure)
+        self.assertEqual(self.client.get(
+            f'/media/qresp/dataset_{dataset.pk}/figure.png').status_code, 200)
+
+    def test_import_datasets(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        with open(os.path.join(directory, 'gaps.txt'), 'w') as f:
+            f.write('# band gap\n1.5\n1.6(1)\n')
+        system = {'formula': 'CsPbI3', 'compound_name': 'cesium lead iodide'}
+        manifest = {'datasets': [
+            {'system': system, 'reference': 1,
+             'primary_property': 'band gap', 'primary_unit': 'eV',
+             'is_experimental': False,
+             'subsets': [{'file': 'gaps.txt', 'crystal_system': 'cubic',
+                          'fixed_values': [{'property': 'temperature',
+                                            'unit': 'K', 'value': 300}]}]},
+            {'system': system, 'reference': 1,
+             'primary_property': 'band gap', 'primary_unit': 'eV',
+             'secondary_property': 'pressure', 'secondary_unit': 'GPa',
+             'subsets': [{'values': [[0, 1.5], [1, 1.4]]},
+                         {'values': '0 x'}]},
+            {'system': system, 'reference': 1000,
+             'primary_property': 'band gap', 'subsets': [{'values': [1]}]},
+        ]}
+        with open(os.path.join(directory, 'manifest.json'), 'w') as f:
+            json.dump(manifest, f)
+        stdout, stderr = io.StringIO(), io.StringIO()
+        call_command('import_datasets', directory, user='testuser',
+                     processes=0, chunk_size=2, stdout=stdout,
+                     stderr=stderr)
+        self.assertIn('Imported 1 data sets, 2 failed', stdout.getvalue())
+        self.assertIn('Data set 2: Subset 2: Could not process line: 0 x',
+                      stderr.getvalue())
+        self.assertIn('Data set 3: Reference 1000 does not exist',
+                      stderr.getvalue())
+        dataset = models.Dataset.objects.get(system__formula='CsPbI3')
+        self.assertTrue(dataset.representative)
+        self.assertFalse(dataset.is_experimental)
+        subset = dataset.subsets.get()
+        self.assertEqual(subset.crystal_system, models.Subset.CUBIC)
+        self.assertEqual(str(subset.fixed_values.get().physical_property),
+                         'temperature')
+        self.assertEqual([v.formatted() for v in models.NumericalValue.objects
+                          .filter(datapoint__subset=subset).order_by('pk')],
+                         ['1.5', '1.6 (±0.1)'])
+        self.assertEqual(os.path.basename(
+            dataset.input_files.get().dataset_file.name), 'gaps.txt')
+        description = {'system': 1, 'reference': 1,
+                       'primary_property': 'band gap',
+                       'subsets': [{'values': [1]}]}
+        self.assertFalse(ingest.parse_dataset(
+            dict(description, visible='false'))['visible'])
+        for invalid, error in (
+                ({'visible': 'maybe'}, "Invalid visible: 'maybe'"),
+                ({'related_data_sets': [[1]]}, 'Invalid related data set'),
+                ({'subsets': [{'values': [1], 'fixed_values': ['x']}]},
+                 'Subset 1: A fixed value must be a mapping')):
+            with self.assertRaisesMessage(ValueError, error):
+                ingest.parse_dataset(dict(description, **invalid))
+
+    def test_create_datasets_api(self):
+        url = reverse('materials:dataset-list')
+        description = {
+            'system': {'formula': 'MAPbI3'}, 'reference': 1,
+            'primary_property': 'band gap', 'primary_unit': 'eV',
+            'secondary_property': 'temperature', 'secondary_unit': 'K',
+            'subsets': [{'values': [[100, 1.6], [200, 1.61]],
+                         'crystal_system': 'tetragonal'}]}
+        response = self.client.post(url, [description],
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 403)
+        self.client.force_login(User.objects.get(pk=1))
+        n_datasets = models.Dataset.objects.count()
+        invalid = dict(description, subsets=[{'file': '/etc/passwd'}])
+        response = self.client.post(url, [description, invalid],
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'errors': [
+            {'index': 1, 'error': 'Files are not supported here'}]})
+        response = self.client.post(url, [
+            dict(description, system=[1, 2]),
+            dict(description, reference={'title': 'x', 'authors': [1]}),
+            dict(description, related_data_sets=[[1]])],
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([error['index'] for error in
+                          response.json()['errors']], [0, 1, 2])
+        self.assertEqual(models.Dataset.objects.count(), n_datasets)
+        self.assertFalse(models.System.objects.filter(
+            formula='MAPbI3').exists())
+        response = self.client.post(url, [description, description],
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        pks = [dataset['pk'] for dataset in response.json()]
+        datasets = models.Dataset.objects.filter(pk__in=pks)
+        self.assertEqual([d.representative for d in datasets], [True, False])
+        response = self.client.get(
+            reverse('materials:dataset-detail', args=[pks[1]]))
+        self.assertEqual(
+            [[value['formatted'] for value in datapoint['values']]
+             for datapoint in response.json()['subsets'][0]['datapoints']],
+            [['100.0', '1.6'], ['200.0', '1.61']])
+
+    def test_read_band_files(self):
+        files = [ContentFile(b'1 0 0 0 2 -10 2 -1 0 3\n'
+                             b'2 0 0 .5 2 -11 2 -2 0 3\n'),
+                 ContentFile(b'1 0 0 .5 2 -11 2 -2 0 3\n'
+                             b'2 0 0 1 2 -9 2 -0.5 0 3')]
+        for chunk_size in 16, 2**24:
+            data, n_kpoints = utils.read_band_files(
+                files, [False, True], (-8, 8), chunk_size)
+            self.assertEqual(data.tolist(), [[-0.5, -1.5, 0]])
+            self.assertEqual(n_kpoints, [2, 1])
+        with self.assertRaises(ValueError):
+            utils.read_band_files([ContentFile(b'1 0 0 0 2 x 2 -1 0 3\n')],
+                                  [False], (-8, 8))
+
+    def test_band_structure(self):
+        files = [ContentFile(b'1 0 0 0 2 -10 2 -1 0 3\n'
+                             b'2 0 0 .5 2 -11 2 -2 0 3\n'),
+                 ContentFile(b'2 0 0 .5 2 -11 2 -2 0 3\n'
+                             b'3 0 0 1 2 -9 2 -0.5 0 3')]
+        location = utils.band_structure_location(1)
+        os.makedirs(location, exist_ok=True)
+        self.addCleanup(shutil.rmtree, location)
+        utils.read_band_files(files, [False, True], (-8, 8),
+                              path=os.path.join(location, 'energies.npy'))
+        with open(os.path.join(location, 'segments.json'), 'w') as f:
+            json.dump({'locations': [0, 1, 2], 'labels': ['G', 'X', 'L']}, f)
+        url = reverse('materials:band_structure', args=[1])
+        response = self.client.get(url, {'emin': -2, 'emax': 2})
+        self.assertEqual(response.json(), {
+            'k-points': [0, 1, 2],
+            'bands': [[-0.5, -1.5, 0]],
+            'segments': [{'location': 0, 'label': 'G'},
+                         {'location': 1, 'label': 'X'},
+                         {'location': 2, 'label': 'L'}]})
+        response = self.client.get(url, {'emin': -2, 'emax': 2, 'kmin': 1,
+                                         'points': 1})
+        self.assertEqual(response.json()['k-points'], [1, 2])
+        self.assertEqual(
+            self.client.get(url, {'emin': 'low'}).status_code, 400)
+        self.assertEqual(self.client.get(
+            reverse('materials:band_structure', args=[2])).status_code, 404)
+
+    def test_parse_values(self):
+        parsed = ingest.parse_values('# x y\n1 2 ignored\n\n~3 4.56(12)\n',
+                                     columns=2)
+        self.assertEqual(parsed.values.tolist(), [[1, 2], [3, 4.56]])
+        self.assertEqual(parsed.value_types.tolist(),
+                         [[0, 0], [models.NumericalValue.APPROXIMATE, 0]])
+        self.assertEqual(parsed.errors[1, 1], 0.12)
+        self.assertEqual(ingest.parse_values('1.234(12) -1...2').errors[0],
+                         0.012)
+        with self.assertRaisesMessage(ValueError,
+                                      'Could not process line: 1 2,3'):
+            ingest.parse_values('0\n1 2,3', columns=None)
+        with self.assertRaisesMessage(ValueError,
+                                      'Could not process value: 1e999'):
+            ingest.parse_values('1 2\n1e999 2', columns=2)
+        with self.assertRaisesMessage(ValueError, 'Subset 1: Could not '
+                                      'process value: 1e999'):
+            ingest.parse_dataset({
+                'system': 1, 'reference': 1, 'primary_property': 'band gap',
+                'subsets': [{'values': '1e999'}]})
 
     def test_verifiction(self):
         user1 = User.objects.get(pk=1)
@@ -35,12 +35,17 @@ urlpatterns = [
     path('autofill-input-data', views.autofill_input_data),
     path('<int:system_pk>/property-all-entries/<int:prop_pk>',
          views.PropertyAllEntriesView.as_view(), name='property_all_entries'),
+    path('data-for-chart', views.data_for_charts, name='data_for_charts'),
     path('data-for-chart/<int:pk>', views.data_for_chart,
          name='data_for_chart'),
     path('get-atomic-coordinates/<int:pk>', views.get_atomic_coordinates,
          name='get_atomic_coordinates'),
     path('get-subset-values/<int:pk>', views.get_subset_values,
          name='get_subset_values'),
+    path('dataset/<int:pk>/qresp-figure', views.qresp_figure,
+         name='qresp_figure'),
+    path('band-structure/<int:pk>', views.get_band_structure,
+         name='band_structure'),
     path('get-jsmol-input/<int:pk>', views.get_jsmol_input,
          name='get_jsmol_input'),
     path('report-issue', views.report_issue, name='report_issue'),
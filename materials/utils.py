@@ -1,27 +1,43 @@
 # This file is covered by the BSD license. See LICENSE in the root directory.
 """Helper functions for this project."""
 import io
-import matplotlib
+import json
 import numpy
+import os
 import re
+import tempfile
+import time
+import zipfile
 
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db.models import Prefetch
 
 from . import models
+from . import rendering
+from mainproject import settings
 
-matplotlib.use('Agg')  # noqa
 
-from matplotlib import pyplot
+# Files in these formats are stored in zip archives without compression
+COMPRESSED_EXTENSIONS = {
+    '.7z', '.bz2', '.gif', '.gz', '.jpeg', '.jpg', '.npz', '.png', '.rar',
+    '.tgz', '.xz', '.zip',
+}
 
 
 def atomic_coordinates_as_json(pk):
     """Get atomic coordinates from the atomic structure list.
 
-    The first six entries of the "atomic structure" property are the
-    lattice constants and angles. These need to be skipped when
-    fetching for the lattice vectors and atomic coordinates.
+    Structures stored as AtomicStructure are read with a single
+    query. For older data, the first six entries of the "atomic
+    structure" property are the lattice constants and angles. These
+    need to be skipped when fetching for the lattice vectors and
+    atomic coordinates.
 
     """
+    atomic_structure = models.AtomicStructure.objects.filter(
+        subset_id=pk).first()
+    if atomic_structure:
+        return atomic_structure.as_json()
     subset = models.Subset.objects.get(pk=pk)
     vectors = models.NumericalValue.objects.filter(
         datapoint__subset=subset).filter(
@@ -56,6 +72,108 @@ def atomic_coordinates_as_json(pk):
     return data
 
 
+def _band_file_chunks(file_, chunk_size):
+    """Read an AIMS band file as 2-d arrays of at most chunk_size bytes.
+
+    Each row of the arrays is one line of the file: the k-point index,
+    the three k-point coordinates, and the occupation and the energy
+    of each band.
+
+    """
+    file_.open('rb')
+    try:
+        rest = b''
+        n_columns = None
+        while True:
+            chunk = file_.read(chunk_size)
+            if chunk:
+                text = rest + chunk
+                end = text.rfind(b'\n') + 1
+                text, rest = text[:end], text[end:]
+            else:
+                text, rest = rest, b''
+            if not text.strip():
+                if not chunk:
+                    break
+                continue
+            if n_columns is None:
+                n_columns = len(text.split(b'\n', 1)[0].split())
+            values = numpy.array(text.split(), dtype=float)
+            yield values.reshape(-1, n_columns)
+    finally:
+        file_.close()
+
+
+def read_band_files(files, skip_first, energy_window, chunk_size=2**24,
+                    path=None):
+    """Read the band energies from AIMS band10xx.out files.
+
+    skip_first indicates for each file whether its first k-point is to
+    be skipped. The energies are shifted by the Fermi level, i.e., the
+    highest occupied energy of all files, and only the bands that lie
+    within energy_window at some k-point are kept. Returns the band
+    energies as an array of shape (number of bands, number of
+    k-points) and the number of k-points per file.
+
+    The files are read chunk_size bytes at a time and the energies are
+    buffered in a temporary file, so that only the returned bands
+    within the window need to fit in memory, not the whole files. If
+    path is given, all energies are also saved there as an .npy file
+    of shape (number of k-points, number of bands) in single
+    precision. A ValueError is raised if a file contains anything but
+    numbers or rows of different lengths.
+
+    """
+    energy_min, energy_max = energy_window
+    fermi_energy = -1e10
+    n_bands = None
+    n_kpoints = []
+    with tempfile.TemporaryFile() as buffer:
+        for file_, skip in zip(files, skip_first):
+            n_kpoints.append(0)
+            for rows in _band_file_chunks(file_, chunk_size):
+                if n_bands is None:
+                    # The last band is not used
+                    n_bands = (rows.shape[1] - 5)//2
+                if skip:
+                    rows, skip = rows[1:], False
+                occupations = rows[:, 4:4+2*n_bands:2]
+                energies = rows[:, 5:5+2*n_bands:2]
+                if energies.shape[1] < n_bands:
+                    raise ValueError(f'{file_.name} has fewer bands than '
+                                     'the first band file')
+                occupied = energies[occupations > 1e-10]
+                if occupied.size:
+                    fermi_energy = max(fermi_energy, occupied.max())
+                numpy.ascontiguousarray(energies).tofile(buffer)
+                n_kpoints[-1] += len(energies)
+        buffer.flush()
+        energies = numpy.memmap(buffer, dtype=float, mode='r',
+                                shape=(sum(n_kpoints), n_bands))
+        # The energies at each k-point are sorted, so the bands within
+        # the window follow from the number of energies below each
+        # limit.
+        min_index, max_index = n_bands, 0
+        rows_per_chunk = max(chunk_size//(8*n_bands), 1)
+        for start in range(0, len(energies), rows_per_chunk):
+            block = energies[start:start+rows_per_chunk] - fermi_energy
+            min_index = min(min_index,
+                            (block < energy_min).sum(axis=1).min())
+            max_index = max(max_index,
+                            (block < energy_max).sum(axis=1).max())
+        data = energies[:, min_index:max_index].T - fermi_energy
+        if path is not None:
+            output = numpy.lib.format.open_memmap(
+                path, mode='w+', dtype=numpy.float32, shape=energies.shape)
+            for start in range(0, len(energies), rows_per_chunk):
+                output[start:start+rows_per_chunk] = (
+                    energies[start:start+rows_per_chunk] - fermi_energy)
+            output.flush()
+            del output
+        del energies
+    return data, n_kpoints
+
+
 def plot_band_structure(k_labels, files, dataset):
     """Generate two images of the band structure.
 
@@ -69,7 +187,6 @@ def plot_band_structure(k_labels, files, dataset):
     ENERGY_FULL_MAX = 8
     ENERGY_SMALL_MIN = -2
     ENERGY_SMALL_MAX = 5
-    HELPER_LINE_WIDTH = 0.2
     # Compress k_labels into a 1-dim list. If the endpoint of a pairs
     # differs from the beginning of the next pair, use both labels
     # with a "|" in between.
@@ -84,94 +201,83 @@ def plot_band_structure(k_labels, files, dataset):
     for ik in range(len(k_labels_reduced)):
         k_labels_reduced[ik] = re.sub('[Gg](?:amma)?', 'Γ',
                                       k_labels_reduced[ik])
+    # If the first k-point of a segment is the same as the last
+    # k-point of the previous segment, it needs to be skipped.
+    skip_first = [i_segment > 0 and '|' not in k_labels_reduced[i_segment]
+                  for i_segment in range(len(files))]
+    location = band_structure_location(dataset.pk)
+    os.makedirs(location, exist_ok=True)
+    data, n_kpoints = read_band_files(
+        files, skip_first, (ENERGY_FULL_MIN, ENERGY_FULL_MAX),
+        path=os.path.join(location, 'energies.npy'))
     # A segment location is where a k-point should be displayed
-    segment_locations = numpy.empty(len(files)+1, dtype=int)
-    segment_locations[0] = 0
-    # Read in all data points (energies) next
-    data_raw = []
-    n_kpoints = []
-    fermi_energy = -1e10
-    for i_segment, file_ in enumerate(files):
-        lines = file_.readlines()
-        n_kpoints.append(len(lines))
-        # If the first k-point is the same as the last k-point of
-        # the previous segment, it needs to be skipped.
-        skip_first = i_segment > 0 and '|' not in k_labels_reduced[i_segment]
-        if skip_first:
-            n_kpoints[-1] -= 1
-            i_skip = 1
-        else:
-            i_skip = 0
-        segment_locations[i_segment+1] = sum(n_kpoints)-1
-        # Determine the number of bands from the first line of the
-        # first file.
-        if i_segment == 0:
-            words = lines[0].split()
-            n_bands = int(len(words[5:])/2)
-            min_index = int(1e10)
-            max_index = 0
-        data_raw.append(numpy.empty([n_kpoints[-1], n_bands]))
-        for i_kpoint in range(n_kpoints[-1]):
-            words = lines[i_kpoint+i_skip].split()
-            n_bands_local = int((len(words)-5)/2)
-            for i_band in range(min(n_bands, n_bands_local)):
-                band_energy = float(words[5+2*i_band])
-                occupation = float(words[4+2*i_band])
-                data_raw[-1][i_kpoint, i_band] = band_energy
-                if occupation > 1e-10:
-                    fermi_energy = max(fermi_energy, band_energy)
-    for i_segment in range(len(data_raw)):
-        data_raw[i_segment] -= fermi_energy
-        for i_kpoint in range(n_kpoints[i_segment]):
-            min_index = min(min_index, numpy.searchsorted(
-                data_raw[i_segment][i_kpoint, :], ENERGY_FULL_MIN))
-            max_index = max(max_index, numpy.searchsorted(
-                data_raw[i_segment][i_kpoint, :], ENERGY_FULL_MAX))
-        file_.close()
-    # Reduce the full data because we are only interested in a small
-    # energy window.
-    n_bands_reduced = max_index - min_index
-    data = numpy.empty([n_bands_reduced, sum(n_kpoints)])
-    k_start = 0
-    for i_segment in range(len(data_raw)):
-        n_kpoints = data_raw[i_segment].shape[0]
-        for i_kpoint in range(n_kpoints):
-            data[:, k_start+i_kpoint] = (
-                data_raw[i_segment][i_kpoint, min_index:max_index])
-        k_start += n_kpoints
+    segment_locations = numpy.zeros(len(files)+1, dtype=int)
+    segment_locations[1:] = numpy.cumsum(n_kpoints) - 1
+    with open(os.path.join(location, 'segments.json'), 'w') as f:
+        json.dump({'locations': segment_locations.tolist(),
+                   'labels': k_labels_reduced}, f)
     # Transfer the data into the plot
-    x_ticks = range(data.shape[1])
-    ax = pyplot.axes()
-    for i_band in range(data.shape[0]):
-        ax.plot(x_ticks, data[i_band, :], color='blue', lw=1.0)
-    # Set x-axis labels
-    ax.xaxis.set_ticks_position('none')
-    x_labels = len(x_ticks)*['']
+    x_labels = data.shape[1]*['']
     for i, loc in enumerate(segment_locations):
         x_labels[loc] = k_labels_reduced[i]
-    pyplot.xticks(x_ticks, x_labels)
-    ax.set_xlim(left=0, right=len(x_ticks))
-    # Set y-axis label
-    pyplot.ylabel('Energy, eV')
-    # Draw some vertical and horizontal helper lines
-    for segment_i in segment_locations:
-        ax.axvline(x=segment_i, color='black', linestyle='--',
-                   lw=HELPER_LINE_WIDTH)
-    ax.axhline(y=0, color='black', linestyle='--', lw=HELPER_LINE_WIDTH)
-    # Save to file
-    ax.set_ylim(bottom=ENERGY_FULL_MIN, top=ENERGY_FULL_MAX)
-
-    def save_plot(name):
-        in_memory_object = io.BytesIO()
-        pyplot.savefig(in_memory_object, format='png', bbox_inches='tight')
-        f = SimpleUploadedFile(name, in_memory_object.getvalue())
+    images = rendering.render(
+        rendering.band_structure, data.tolist(), segment_locations.tolist(),
+        x_labels, [(ENERGY_FULL_MIN, ENERGY_FULL_MAX),
+                   (ENERGY_SMALL_MIN, ENERGY_SMALL_MAX)]).result()
+    for name, image in zip(
+            ['band_structure_full.png', 'band_structure_small.png'], images):
+        f = SimpleUploadedFile(name, image)
         dataset.files.create(created_by=dataset.created_by, dataset_file=f)
-        in_memory_object.close()
 
-    save_plot('band_structure_full.png')
-    ax.set_ylim(bottom=ENERGY_SMALL_MIN, top=ENERGY_SMALL_MAX)
-    save_plot('band_structure_small.png')
-    pyplot.close()
+
+def band_structure_location(pk):
+    """Return the directory of the band energies of a data set.
+
+    It contains energies.npy, which is written by read_band_files, and
+    segments.json with the locations and labels of the k-points that
+    separate the segments.
+
+    """
+    return os.path.join(settings.MEDIA_ROOT, f'band_structures/dataset_{pk}')
+
+
+def band_structure_window(pk, energy_min, energy_max, k_min=0, k_max=None,
+                          max_points=1000):
+    """Return the part of a band structure within the given window.
+
+    Only the bands that enter the energy window somewhere between the
+    k-points k_min and k_max (exclusive) are included. If there are
+    more than max_points k-points in that range, every n-th k-point is
+    kept, as well as the first and last k-point of each segment. The
+    energies are read from a memory-mapped file, so that only the
+    requested part is loaded into memory.
+
+    """
+    location = band_structure_location(pk)
+    energies = numpy.load(os.path.join(location, 'energies.npy'),
+                          mmap_mode='r')
+    with open(os.path.join(location, 'segments.json')) as f:
+        segments = json.load(f)
+    k_min = max(k_min, 0)
+    k_max = len(energies) if k_max is None else min(k_max, len(energies))
+    step = max(-(-(k_max - k_min)//max_points), 1)
+    locations = numpy.array(segments['locations'])
+    k_points = numpy.union1d(
+        numpy.arange(k_min, k_max, step),
+        locations[(locations >= k_min) & (locations < k_max)])
+    if k_max > k_min:
+        k_points = numpy.union1d(k_points, [k_max - 1])
+    bands = numpy.asarray(energies[k_points], dtype=float)
+    in_window = ((bands.max(axis=0, initial=-numpy.inf) >= energy_min) &
+                 (bands.min(axis=0, initial=numpy.inf) <= energy_max))
+    return {
+        'k-points': k_points.tolist(),
+        'bands': bands[:, in_window].T.round(4).tolist(),
+        'segments': [
+            {'location': location, 'label': label} for location, label in
+            zip(segments['locations'], segments['labels'])
+            if k_min <= location < k_max],
+    }
 
 
 def dataset_info(dataset, server):
@@ -219,7 +325,7 @@ def dataset_info(dataset, server):
             for symbol, value, unit in subset.get_lattice_constants():
                 data.write(f'{symbol} {value}{unit}\n')
         elif dataset.primary_property.name.startswith('phase transition '):
-            pt = subset.phase_transitions.first()
+            pt = subset.phase_transitions.all()[0]
             CS = models.Subset.CRYSTAL_SYSTEMS
             data.write('Initial crystal system: '
                        f'{CS[subset.crystal_system][1]}\n')
@@ -237,3 +343,138 @@ def dataset_info(dataset, server):
             data.write(f'Value: {pt.formatted()}\n')
         data.write('\n\n')
     return data.getvalue()
+
+
+def chart_data_versions(pks):
+    """Return the time of the last change to the chart of each data set.
+
+    Besides the data set itself, the properties and units shown in
+    the chart are taken into account. The result is a dictionary
+    keyed by the primary keys of the data sets and is obtained with a
+    single query.
+
+    """
+    versions = {}
+    for pk, *timestamps in models.Dataset.objects.filter(
+            pk__in=pks).values_list(
+                'pk', 'updated', 'primary_property__updated',
+                'primary_unit__updated', 'secondary_property__updated',
+                'secondary_unit__updated'):
+        versions[pk] = max(filter(None, timestamps))
+    return versions
+
+
+def chart_data(datasets):
+    """Return the data for plotting each data set with Chart.js.
+
+    The argument is a queryset of data sets and the result is a
+    dictionary keyed by their primary keys. The number of queries does
+    not depend on the number of data sets or subsets.
+
+    """
+    fixed_values = models.NumericalValueFixed.objects.select_related(
+        'physical_property', 'unit')
+    subsets = models.Subset.objects.select_related(
+        'packed_values').prefetch_related(
+            Prefetch('fixed_values', queryset=fixed_values))
+    datasets = list(datasets.select_related(
+        'primary_property', 'primary_unit', 'secondary_property',
+        'secondary_unit').prefetch_related(
+            Prefetch('subsets', queryset=subsets)))
+    values = models.get_values(
+        [subset for dataset in datasets for subset in dataset.subsets.all()])
+    payloads = {}
+    for dataset in datasets:
+        if dataset.primary_unit:
+            primary_unit_label = dataset.primary_unit.label
+        else:
+            primary_unit_label = ''
+        if dataset.secondary_unit:
+            secondary_unit_label = dataset.secondary_unit.label
+        else:
+            secondary_unit_label = ''
+        if dataset.secondary_property:
+            secondary_property_name = dataset.secondary_property.name
+        else:
+            secondary_property_name = ''
+        payload = {'primary-property': dataset.primary_property.name,
+                   'primary-unit': primary_unit_label,
+                   'secondary-property': secondary_property_name,
+                   'secondary-unit': secondary_unit_label,
+                   'data': []}
+        if dataset.primary_property_label:
+            payload['primary-property'] = dataset.primary_property_label
+        if dataset.secondary_property_label:
+            payload['secondary-property'] = (
+                f'{secondary_property_name} '
+                f'({dataset.secondary_property_label})')
+        for subset in dataset.subsets.all():
+            fixed_values = [f' {value.physical_property} = '
+                            f'{value.formatted()} {value.unit}'
+                            for value in subset.fixed_values.all()]
+            if subset.label:
+                label = f'{subset.label}:{",".join(fixed_values)}'
+            else:
+                label = ','.join(fixed_values).lstrip()
+            label += (
+                f' ({models.Subset.CRYSTAL_SYSTEMS[subset.crystal_system][1]})')
+            payload['data'].append({
+                'subset-label': label,
+                'values': [dict(zip(('y', 'x'), row))
+                           for row in values[subset.pk]['value'].tolist()],
+            })
+        payloads[dataset.pk] = payload
+    return payloads
+
+
+class _ZipBuffer(io.RawIOBase):
+    """Unseekable file object that collects what zipfile writes to it."""
+    def __init__(self):
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def pop(self):
+        """Return everything written since the last call."""
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def stream_zip(entries, chunk_size=2**20):
+    """Generate a zip archive piece by piece.
+
+    entries is an iterable of (name in archive, contents) pairs, where
+    contents is either bytes or the path of a file. Files are read and
+    compressed chunk_size bytes at a time and each compressed piece is
+    yielded as soon as it is available, so that the archive never has
+    to be held in memory. Files that are compressed already are stored
+    as they are.
+
+    """
+    buffer = _ZipBuffer()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, contents in entries:
+            if isinstance(contents, bytes):
+                info = zipfile.ZipInfo(name, time.localtime()[:6])
+                info.compress_type = zipfile.ZIP_DEFLATED
+                archive.writestr(info, contents)
+                yield buffer.pop()
+                continue
+            info = zipfile.ZipInfo.from_file(contents, name)
+            if os.path.splitext(name)[1].lower() in COMPRESSED_EXTENSIONS:
+                info.compress_type = zipfile.ZIP_STORED
+            else:
+                info.compress_type = zipfile.ZIP_DEFLATED
+            with open(contents, 'rb') as source, archive.open(
+                    info, 'w') as destination:
+                for chunk in iter(lambda: source.read(chunk_size), b''):
+                    destination.write(chunk)
+                    yield buffer.pop()
+            yield buffer.pop()
+    yield buffer.pop()
@@ -1,12 +1,10 @@
 # This file is covered by the BSD license. See LICENSE in the root directory.
-import io
+import hashlib
+import itertools
 import json
 import logging
-import operator
 import os
 import re
-import zipfile
-from functools import reduce
 
 import django_filters.rest_framework
 import requests
@@ -14,23 +12,31 @@ from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.core.files.uploadedfile import SimpleUploadedFile, UploadedFile
-from django.core.mail import send_mail
+from django.core.paginator import Paginator
 from django.db import transaction
-from django.db.models import BooleanField, Case, Q, Value, When
+from django.db.models import (BooleanField, Case, Count, Prefetch, Q,
+                              Subquery, Value, When)
 from django.db.models.fields import TextField
-from django.http import (Http404, HttpResponse, HttpResponseForbidden,
-                         JsonResponse)
+from django.http import (FileResponse, Http404, HttpResponse,
+                         HttpResponseBadRequest, HttpResponseForbidden,
+                         JsonResponse, StreamingHttpResponse)
 from django.shortcuts import get_object_or_404, redirect, render, reverse
 from django.utils.html import escape
 from django.utils.safestring import mark_safe
 from django.views import generic
-from rest_framework import filters, viewsets
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+from rest_framework import filters, status, viewsets
 from rest_framework.decorators import action
+from rest_framework.exceptions import ParseError
 from rest_framework.pagination import PageNumberPagination
 from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
 
-from . import forms, models, permissions, qresp, serializers, utils
+from . import (composition, forms, ingest, jobs, models, permissions, qresp,
+               search, serializers, utils)
 
 logger = logging.getLogger(__name__)
 
@@ -76,17 +82,97 @@ class StaffStatusMixin(LoginRequiredMixin):
         return super().dispatch(request, *args, **kwargs)
 
 
+def lattice_constants_prefetch():
+    """Prefetch the lattice constants of the subsets of atomic structures.
+
+    The data points with a single symbol are stored in
+    lattice_constant_datapoints of each subset, which is then used by
+    Subset.get_lattice_constants.
+
+    """
+    lattice_constants = models.Datapoint.objects.filter(
+        subset__dataset__primary_property__name='atomic structure').annotate(
+            num_symbols=Count('symbols')).filter(num_symbols=1).order_by(
+                'pk').prefetch_related(
+                    'symbols',
+                    Prefetch('values',
+                             queryset=models.NumericalValue.objects.
+                             select_related('error', 'upperbound')))
+    return Prefetch('datapoints', queryset=lattice_constants,
+                    to_attr='lattice_constant_datapoints')
+
+
+def prefetch_dataset_contents(datasets):
+    """Fetch everything that dataset_contents.html needs up front.
+
+    Returns the queryset of data sets with the related objects
+    selected or prefetched. The counts used by the template are
+    stored in the data sets and subsets themselves. Rendering the
+    data sets then takes a fixed number of queries regardless of how
+    many data sets and subsets there are. The templates must use the
+    prefetched managers (e.g., subsets.all.0 instead of
+    subsets.first) to benefit from this.
+
+    """
+    users = User.objects.select_related('userprofile')
+    subsets = models.Subset.objects.select_related(
+        'space_group_ID', 'packed_values', 'atomic_structure').defer(
+            'packed_values__data', 'atomic_structure__lattice_vectors',
+            'atomic_structure__sites').prefetch_related(
+                Prefetch('fixed_values',
+                         queryset=models.NumericalValueFixed.objects.
+                         select_related('physical_property', 'unit')),
+                'phase_transitions', lattice_constants_prefetch())
+    return datasets.select_related(
+        'system', 'primary_property', 'primary_unit', 'secondary_property',
+        'secondary_unit', 'reference', 'created_by__userprofile',
+        'updated_by__userprofile', 'link_group').prefetch_related(
+            Prefetch('subsets', queryset=subsets),
+            Prefetch('link_group__datasets', queryset=models.Dataset.objects.
+                     select_related('primary_property')),
+            Prefetch('verified_by', queryset=users),
+            'reference__authors', 'synthesis__comment',
+            'experimental__comment', 'computational__comment',
+            'computational__repositories', 'files', 'note')
+
+
+def prefetch_dataset_files(datasets):
+    """Fetch everything that dataset_zip_entries needs up front.
+
+    This is the part of prefetch_dataset_contents that is written to
+    the zip file: the data files, the additional files, and what
+    utils.dataset_info prints about the data set and its subsets.
+
+    """
+    subsets = models.Subset.objects.prefetch_related(
+        Prefetch('fixed_values', queryset=models.NumericalValueFixed.objects.
+                 select_related('physical_property', 'unit')),
+        'phase_transitions', lattice_constants_prefetch())
+    return datasets.select_related(
+        'system', 'primary_property', 'primary_unit', 'secondary_property',
+        'secondary_unit', 'reference').prefetch_related(
+            Prefetch('subsets', queryset=subsets), 'reference__authors',
+            'experimental', 'input_files', 'files')
+
+
 class SystemView(generic.ListView):
     template_name = 'materials/system.html'
     context_object_name = 'dataset_list'
 
     def get_queryset(self, **kwargs):
-        return models.Dataset.objects.filter(
+        return prefetch_dataset_contents(models.Dataset.objects.filter(
             system__pk=self.kwargs['pk']).annotate(is_atomic_structure=Case(
                 When(primary_property__name='atomic structure',
                      then=Value(True)),
                 default=Value(False), output_field=BooleanField())).order_by(
-                    '-is_atomic_structure')
+                    '-is_atomic_structure'))
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['system'] = get_object_or_404(
+            models.System.objects.prefetch_related('derived_to_from'),
+            pk=self.kwargs['pk'])
+        return context
 
 
 class PropertyAllEntriesView(generic.ListView):
@@ -94,13 +180,15 @@ class PropertyAllEntriesView(generic.ListView):
     template_name = 'materials/property_all_entries.html'
 
     def get_queryset(self, **kwargs):
-        return models.Dataset.objects.filter(
+        return list(prefetch_dataset_contents(models.Dataset.objects.filter(
             system__pk=self.kwargs['system_pk']).filter(
-                primary_property__pk=self.kwargs['prop_pk'])
+                primary_property__pk=self.kwargs['prop_pk'])))
 
 
 class ReferenceDetailView(generic.DetailView):
-    model = models.Reference
+    queryset = models.Reference.objects.prefetch_related(
+        'authors', Prefetch('datasets', queryset=prefetch_dataset_contents(
+            models.Dataset.objects.all())))
 
 
 class DatasetView(generic.ListView):
@@ -114,7 +202,8 @@ class DatasetView(generic.ListView):
     template_name = 'materials/property_all_entries.html'
 
     def get_queryset(self, **kwargs):
-        return models.Dataset.objects.filter(pk=self.kwargs['pk'])
+        return list(prefetch_dataset_contents(
+            models.Dataset.objects.filter(pk=self.kwargs['pk'])))
 
 class CompareView(generic.ListView):
     """Display information about two datasets side by side.
@@ -127,7 +216,8 @@ class CompareView(generic.ListView):
     template_name = 'materials/property_all_entries.html'
 
     def get_queryset(self, **kwargs):
-        return models.Dataset.objects.filter(pk__in=[self.kwargs['pk1'], self.kwargs['pk2']])
+        return list(prefetch_dataset_contents(models.Dataset.objects.filter(
+            pk__in=[self.kwargs['pk1'], self.kwargs['pk2']])))
 
 
 class LinkedDataView(generic.ListView):
@@ -135,20 +225,28 @@ class LinkedDataView(generic.ListView):
     template_name = 'materials/linked_data.html'
 
     def get_queryset(self, **kwargs):
-        dataset = models.Dataset.objects.get(pk=self.kwargs['pk'])
-        datasets = dataset.linked_to.all()
-        return list(datasets) + [dataset]
+        """Return the link group with the given data set last."""
+        pk = self.kwargs['pk']
+        group = models.Dataset.objects.filter(pk=pk).values('link_group')
+        datasets = list(prefetch_dataset_contents(
+            models.Dataset.objects.filter(
+                Q(pk=pk) | Q(link_group=Subquery(group)))))
+        if not datasets:
+            raise Http404
+        return sorted(datasets, key=lambda dataset: dataset.pk == pk)
 
 
 class SearchFormView(generic.TemplateView):
     """Search for system page"""
     template_name = 'materials/search.html'
+    paginate_by = 50
     search_terms = [
         ['formula', 'Formula'],
         ['physical_property', 'Physical property'],
         ['organic', 'Organic Component'],
         ['inorganic', 'Inorganic Component'],
         ['author', 'Author'],
+        ['elements', 'Elements'],
     ]
 
     def get(self, request):
@@ -163,46 +261,65 @@ class SearchFormView(generic.TemplateView):
         })
 
     def post(self, request):
+        """Return a page of the ranked search results.
+
+        The systems are found through the trigram index (see
+        search.py). Only the systems of the requested page are then
+        fetched.
+
+        """
         template_name = 'materials/search_results.html'
         form = forms.SearchForm(request.POST)
         search_text = ''
         # default search_term
         search_term = 'formula'
         physical_properties = []
+        system_pks = []
         if form.is_valid():
             search_text = form.cleaned_data['search_text']
             search_term = request.POST.get('search_term')
-            systems_info = []
             if search_term == 'formula':
-                systems = models.System.objects.filter(
-                    Q(formula__icontains=search_text) |
-                    Q(group__icontains=search_text) |
-                    Q(iupac__icontains=search_text) |
-                    Q(compound_name__icontains=search_text)).order_by(
-                        'formula')
+                system_pks = search.find(models.SearchTrigram.SYSTEM,
+                                         search_text)
             elif search_term == 'physical_property':
-                physical_properties = models.Property.objects.filter(
-                    name__icontains=search_text).values_list('name', flat=True)
-                systems = models.System.objects.filter(
-                    dataset__primary_property__name__icontains=search_text)
+                property_pks = list(search.find(
+                    models.SearchTrigram.PROPERTY, search_text))
+                properties = models.Property.objects.in_bulk(property_pks)
+                physical_properties = [properties[pk].name
+                                       for pk in property_pks]
+                system_pks = models.System.objects.filter(
+                    dataset__primary_property__in=property_pks).order_by(
+                        'formula').values_list('pk', flat=True).distinct()
             elif search_term == 'organic':
-                systems = models.System.objects.filter(
-                    organic__icontains=search_text).order_by('organic')
+                system_pks = search.find(models.SearchTrigram.ORGANIC,
+                                         search_text)
             elif search_term == 'inorganic':
-                systems = models.System.objects.filter(
-                    inorganic__icontains=search_text).order_by('inorganic')
+                system_pks = search.find(models.SearchTrigram.INORGANIC,
+                                         search_text)
+            elif search_term == 'elements':
+                try:
+                    system_pks = composition.find(
+                        **composition.parse_query(search_text)).values_list(
+                            'pk', flat=True)
+                except ValueError:
+                    pass
             elif search_term == 'author':
-                keywords = search_text.split()
-                query = reduce(operator.or_, (
-                    Q(dataset__reference__authors__last_name__icontains=x) for
-                    x in keywords))
-                systems = models.System.objects.filter(query).distinct()
+                authors = Q()
+                for keyword in search_text.split():
+                    authors |= Q(dataset__reference__authors__in=search.find(
+                        models.SearchTrigram.AUTHOR, keyword))
+                system_pks = models.System.objects.filter(authors).order_by(
+                    'formula').values_list('pk', flat=True).distinct()
             else:
                 raise KeyError('Invalid search term.')
+        page = Paginator(system_pks, self.paginate_by).get_page(
+            request.POST.get('page'))
+        pks = list(page.object_list)
+        systems = models.System.objects.in_bulk(pks)
         args = {
-            'systems': systems,
+            'systems': [systems[pk] for pk in pks],
+            'page_obj': page,
             'search_term': search_term,
-            'systems_info': systems_info,
             'physical_properties': physical_properties,
         }
         return render(request, template_name, args)
@@ -286,7 +403,50 @@ class SmallResultsSetPagination(PageNumberPagination):
     page_size_query_param = 'page_size'
     max_page_size = 100000
 
-class ReferenceViewSet(viewsets.ModelViewSet):
+
+def queryset_chunks(queryset, chunk_size):
+    """Split queryset into querysets of at most chunk_size objects.
+
+    The primary keys are walked with a database iterator and each
+    chunk is fetched separately, so that prefetch_related still
+    applies while only one chunk is held in memory at a time.
+
+    """
+    pks = queryset.values_list('pk', flat=True).iterator(
+        chunk_size=chunk_size)
+    while True:
+        chunk = list(itertools.islice(pks, chunk_size))
+        if not chunk:
+            break
+        yield queryset.filter(pk__in=chunk)
+
+
+class ExportMixin:
+    """Add an export action that streams all objects as NDJSON.
+
+    Unlike the paginated list, the response is sent while the objects
+    are being read from the database, one JSON object per line. The
+    primary keys are walked with a database iterator and the objects
+    are serialized export_chunk_size at a time, so that the memory
+    use of the worker does not depend on the number of objects. The
+    usual filters apply.
+
+    """
+    export_chunk_size = 1000
+
+    @action(detail=False)
+    def export(self, request):
+        queryset = self.filter_queryset(self.get_queryset())
+
+        def lines():
+            for chunk in queryset_chunks(queryset, self.export_chunk_size):
+                for obj in self.get_serializer(chunk, many=True).data:
+                    yield json.dumps(obj, cls=JSONEncoder) + '\n'
+        return StreamingHttpResponse(lines(),
+                                     content_type='application/x-ndjson')
+
+
+class ReferenceViewSet(ExportMixin, viewsets.ModelViewSet):
     queryset = models.Reference.objects.all().order_by('-pk')
     serializer_class = serializers.ReferenceSerializer
     permission_classes = (permissions.IsStaffOrReadOnly,)
@@ -323,14 +483,39 @@ class ReferenceViewSet(viewsets.ModelViewSet):
                 author.references.add(reference)
 
 
-class SystemViewSet(viewsets.ModelViewSet):
+class SystemViewSet(ExportMixin, viewsets.ModelViewSet):
     queryset = models.System.objects.all().order_by('-pk')
     serializer_class = serializers.SystemSerializer
     permission_classes = (permissions.IsStaffOrReadOnly,)
     pagination_class = LargeResultsSetPagination
+    composition_params = {
+        'elements': models.SystemElement.FORMULA,
+        'organic_elements': models.SystemElement.ORGANIC,
+        'inorganic_elements': models.SystemElement.INORGANIC,
+    }
+
+    def get_queryset(self):
+        """Filter by composition through the composition index.
 
+        The query parameters elements, organic_elements, and
+        inorganic_elements take a query as accepted by
+        composition.parse_query, e.g., ?elements=Sn Br -Pb, and apply
+        to the formula and the organic and inorganic components.
+
+        """
+        queryset = super().get_queryset()
+        for param, component in self.composition_params.items():
+            if param in self.request.query_params:
+                try:
+                    queryset = queryset.filter(pk__in=composition.find(
+                        component=component, **composition.parse_query(
+                            self.request.query_params[param])).values('pk'))
+                except ValueError as error:
+                    raise ParseError(f'{param}: {error}')
+        return queryset
 
-class PropertyViewSet(viewsets.ModelViewSet):
+
+class PropertyViewSet(ExportMixin, viewsets.ModelViewSet):
     queryset = models.Property.objects.all().order_by('-pk')
     serializer_class = serializers.PropertySerializer
     permission_classes = (permissions.IsStaffOrReadOnly,)
@@ -340,7 +525,7 @@ class PropertyViewSet(viewsets.ModelViewSet):
         serializer.save(created_by=self.request.user)
 
 
-class UnitViewSet(viewsets.ModelViewSet):
+class UnitViewSet(ExportMixin, viewsets.ModelViewSet):
     queryset = models.Unit.objects.all().order_by('-pk')
     serializer_class = serializers.UnitSerializer
     permission_classes = (permissions.IsStaffOrReadOnly,)
@@ -350,26 +535,26 @@ class UnitViewSet(viewsets.ModelViewSet):
         serializer.save(created_by=self.request.user)
 
 
-def dataset_to_zip(request, dataset):
-    """Generate a zip file from data set contents."""
-    in_memory_object = io.BytesIO()
-    zf = zipfile.ZipFile(in_memory_object, 'w')
+def dataset_zip_entries(request, dataset, directory='files'):
+    """Generate the contents of the zip file of a data set.
+
+    All files are placed in directory. See utils.stream_zip for the
+    format of the entries.
+
+    """
     # Header file to the data
-    zf.writestr('files/info.txt',
-                utils.dataset_info(dataset, request.get_host()))
+    yield (os.path.join(directory, 'info.txt'),
+           utils.dataset_info(dataset, request.get_host()).encode())
     # Main data
     for file_ in (f.dataset_file.path for f in dataset.input_files.all()):
-        zf.write(file_,
-                 os.path.join('files', os.path.basename(file_)))
+        yield os.path.join(directory, os.path.basename(file_)), file_
     # Additional files
     for file_ in (f.dataset_file.path for f in dataset.files.all()):
-        zf.write(file_,
-                 os.path.join('files/additional', os.path.basename(file_)))
-    zf.close()
-    return in_memory_object
+        yield (os.path.join(directory, 'additional',
+                            os.path.basename(file_)), file_)
 
 
-class DatasetViewSet(viewsets.ReadOnlyModelViewSet):
+class DatasetViewSet(ExportMixin, viewsets.ReadOnlyModelViewSet):
     queryset = models.Dataset.objects.all().order_by('-pk')
     serializer_class = serializers.DatasetSerializer
     filter_backends = [django_filters.rest_framework.DjangoFilterBackend,
@@ -383,6 +568,91 @@ class DatasetViewSet(viewsets.ReadOnlyModelViewSet):
         'dimensionality': ['exact']
         }
     search_fields = filterset_fields
+    permission_classes = (permissions.IsStaffOrReadOnly,)
+    export_chunk_size = 50
+    create_chunk_size = 100
+
+    def get_queryset(self):
+        """Prefetch everything that is serialized by DatasetSerializer.
+
+        The prefetch plan follows the tree of nested serializers so that
+        the number of queries does not depend on the number of data
+        sets or their size. The numerical values themselves are fetched
+        in bulk by SubsetSerializer.
+
+        """
+        queryset = super().get_queryset()
+        if self.action not in ('list', 'retrieve', 'export'):
+            return queryset
+        users = User.objects.prefetch_related('groups', 'user_permissions')
+        details = ('created_by', 'updated_by', 'comment')
+        return queryset.select_related(
+            'created_by', 'updated_by', 'system', 'primary_property',
+            'primary_unit', 'secondary_property', 'secondary_unit',
+            'reference').prefetch_related(
+                'system__derived_to_from', 'system__tags',
+                Prefetch('link_group__datasets',
+                         queryset=models.Dataset.objects.prefetch_related(
+                             'verified_by')),
+                Prefetch('verified_by', queryset=users),
+                Prefetch('computational', queryset=models.
+                         ComputationalDetails.objects.select_related(
+                             *details)),
+                Prefetch('synthesis', queryset=models.SynthesisMethod.
+                         objects.select_related(*details)),
+                Prefetch('experimental', queryset=models.ExperimentalDetails.
+                         objects.select_related(*details)),
+                Prefetch('subsets', queryset=models.Subset.objects.
+                         select_related('created_by', 'updated_by',
+                                        'packed_values',
+                                        'atomic_structure')),
+                Prefetch('subsets__fixed_values',
+                         queryset=models.NumericalValueFixed.objects.
+                         select_related('physical_property', 'unit',
+                                        'subset')))
+
+    def create(self, request):
+        """Create one or more data sets from JSON descriptions.
+
+        The request body is a description as accepted by
+        ingest.parse_dataset or a list of them, except that files are
+        not allowed. All descriptions are validated before anything is
+        inserted. If any of them is invalid, nothing is created and
+        the errors are returned along with the positions of the
+        invalid data sets in the list. Otherwise, the data sets are
+        inserted in a single transaction, create_chunk_size at a time.
+
+        """
+        many = isinstance(request.data, list)
+        descriptions = request.data if many else [request.data]
+        importer = ingest.DatasetImporter(request.user)
+        errors, datasets, parsed_datasets = [], [], []
+        with transaction.atomic():
+            for index, description in enumerate(descriptions):
+                try:
+                    parsed = ingest.parse_dataset(description)
+                    datasets.append(importer.build(parsed))
+                    parsed_datasets.append(parsed)
+                except ValueError as error:
+                    errors.append({'index': index, 'error': str(error)})
+            if errors:
+                # Undo the systems, references, etc. created by build()
+                transaction.set_rollback(True)
+                return Response({'errors': errors},
+                                status=status.HTTP_400_BAD_REQUEST)
+            for start in range(0, len(datasets), self.create_chunk_size):
+                end = start + self.create_chunk_size
+                importer.create(datasets[start:end],
+                                parsed_datasets[start:end])
+        created = []
+        for dataset in datasets:
+            logger.info(f'Create dataset #{dataset.pk}')
+            created.append({'pk': dataset.pk,
+                            'url': request.build_absolute_uri(reverse(
+                                'materials:dataset-detail',
+                                args=[dataset.pk]))})
+        return Response(created if many else created[0],
+                        status=status.HTTP_201_CREATED)
 
     @action(detail=True)
     def info(self, request, pk):
@@ -406,125 +676,62 @@ class DatasetViewSet(viewsets.ReadOnlyModelViewSet):
     def files(self, request, pk):
         """Retrieve data set contents and uploaded files as zip."""
         dataset = self.get_object()
-        in_memory_object = dataset_to_zip(request, dataset)
-        response = HttpResponse(in_memory_object.getvalue(),
-                                content_type='application/x-zip-compressed')
+        response = StreamingHttpResponse(
+            utils.stream_zip(dataset_zip_entries(request, dataset)),
+            content_type='application/x-zip-compressed')
         response['Content-Disposition'] = 'attachment; filename=files.zip'
         return response
 
+    @action(detail=False)
+    def archive(self, request):
+        """Retrieve the files of all matching data sets as a single zip.
 
-@staff_status_required
-@transaction.atomic
-def submit_data(request):
-    """Primary function for submitting data from the user."""
-    def clean_value(value):
-        """Return value as float and determine its type.
-
-        The value is first stripped of markers such as '<', which are
-        used to determine its type. If the value contains an error (or
-        uncertainty), the error is also returned.
-
-        """
-        error = None
-        upper_bound = None
-        if re.match(r'[-\d]', value):
-            value_type = models.NumericalValue.ACCURATE
-        elif value.startswith('<'):
-            value_type = models.NumericalValue.UPPER_BOUND
-            value = value[1:]
-        elif value.startswith('>'):
-            value_type = models.NumericalValue.LOWER_BOUND
-            value = value[1:]
-        elif value.startswith(('≈', '~')):
-            value_type = models.NumericalValue.APPROXIMATE
-            value = value[1:]
-        if '(' in value:
-            if '(0' in value:
-                value = re.sub(r'\(0+', '(', value)
-            left_paren_start = value.find('(')
-            right_paren_start = value.find(')')
-            error = value[left_paren_start+1:right_paren_start]
-            if '.' not in error and left_paren_start > len(error):
-                error = re.sub('[1-9]', '0',
-                               value[:left_paren_start-len(error)]) + error
-            value = value[:left_paren_start]
-        elif '±' in value:
-            value, error = value.split('±')
-        elif '...' in value:
-            value, upper_bound = value.split('...')
-        return float(value), value_type, error, upper_bound
-
-    def add_numerical_value(numerical_values, errors, upper_bounds, value,
-                            is_secondary=False, counter=0):
-        """Clean and add a numerical value to a list.
-
-        numerical_values: list
-            list that contains numerical values that will be created
-            by a bulk_create once the list is complete
-        error: list
-            same as numerical_values but for errors
-        value: string
-            numerical value to be processed and added to the list
-        is_secondary: boolean
-            whether the numerical value is of secondary or primary
-            type
-        counter: int
-            numerical value counter
+        The usual filters apply. In addition, the data sets can be
+        selected with a comma-separated list of primary keys, e.g.,
+        ?pks=1,2,3. Each data set is placed in its own directory and
+        manifest.json at the end of the archive lists the data sets
+        and their files.
 
         """
-        numerical_value = models.NumericalValue(created_by=request.user)
-        if is_secondary:
-            numerical_value.qualifier = models.NumericalValue.SECONDARY
-        if counter > 0:
-            numerical_value.counter = counter
-        value, value_type, error, upper_bound = clean_value(value)
-        numerical_value.value = value
-        numerical_value.value_type = value_type
-        numerical_values.append(numerical_value)
-        errors.append(error)
-        upper_bounds.append(upper_bound)
-
-    def add_datapoint_ids(values, n_values, n_datapoints):
-        """Set datapoint_id for all elements in an array.
-
-        The data points must already have been created using
-        bulk_create. Now, fetch the ids of the latest data points and
-        manually attach them to each element in "values". After this
-        is done, bulk_create may be called on "values".
-
-        The number of values and datapoints are necessary to determine
-        how many values are associated with each data point.
+        queryset = self.filter_queryset(self.get_queryset())
+        if 'pks' in request.query_params:
+            try:
+                pks = [int(pk) for pk in
+                       request.query_params['pks'].split(',') if pk]
+            except ValueError:
+                raise ParseError('pks must be a list of integers')
+            queryset = queryset.filter(pk__in=pks)
+        queryset = prefetch_dataset_files(queryset)
+
+        def entries():
+            manifest = []
+            for chunk in queryset_chunks(queryset, self.export_chunk_size):
+                for dataset in chunk:
+                    files = []
+                    for name, contents in dataset_zip_entries(
+                            request, dataset, f'dataset_{dataset.pk}'):
+                        files.append(name)
+                        yield name, contents
+                    manifest.append({
+                        'pk': dataset.pk,
+                        'system': dataset.system.compound_name,
+                        'primary_property': dataset.primary_property.name,
+                        'reference': dataset.reference_id,
+                        'updated': dataset.updated.isoformat(),
+                        'files': files,
+                    })
+            yield 'manifest.json', json.dumps(manifest, indent=1).encode()
+        response = StreamingHttpResponse(
+            utils.stream_zip(entries()),
+            content_type='application/x-zip-compressed')
+        response['Content-Disposition'] = 'attachment; filename=datasets.zip'
+        return response
 
-        """
-        if n_values == 0:
-            return
-        step = int(n_values/n_datapoints)
-        n_datapoints = int(len(values)/step)
-        pks = list(models.Datapoint.objects.all().order_by(
-            '-pk')[:n_datapoints].values_list('pk', flat=True))
-        for i_pk, pk in enumerate(reversed(pks)):
-            for i_step in range(step):
-                values[step*i_pk+i_step].datapoint_id = pk
-
-    def generate_numerical_value_ids(array, model):
-        """Set numerical_value_id for all elements in array.
-
-        This is similar to add_datapoint_ids, except the structure of
-        the array is different. Some or all elements in the array may
-        be None. Filter out non-None elements and return an array that
-        may be given as argument to bulk_create.
-
-        """
-        pks = list(models.NumericalValue.objects.all().order_by(
-            '-pk')[:len(array)].values_list('pk', flat=True))
-        filtered_list = []
-        for i, pk in enumerate(reversed(pks)):
-            if array[i]:
-                filtered_list.append(model(created_by=request.user,
-                                           numerical_value_id=pk,
-                                           value=array[i]))
-        return filtered_list
 
+@staff_status_required
+@transaction.atomic
+def submit_data(request):
+    """Primary function for submitting data from the user."""
     def error_and_return(form, dataset=None, text=None):
         """Shortcut for returning with info about the error."""
         if form.cleaned_data['return_url']:
@@ -544,10 +751,6 @@ def submit_data(request):
             'base_template': base_template
         })
 
-    def skip_this_line(line):
-        """Test whether the line is empty or a comment."""
-        return re.match(r'\s*#', line) or not line or line == '\r'
-
     def create_input_file(dataset, import_file_name, data_as_str, i_subset,
                           multiple_subsets):
         """Read data points from the input form and save as file.
@@ -673,14 +876,11 @@ def submit_data(request):
                     created_by=request.user,
                     url=url)
     # For best performance, the main data should be inserted with
-    # calls to bulk_create. The following work arrays are are
-    # populated with data during the loop over subsets and then
-    # inserted into the database after the main loop.
-    datapoints = []
-    symbols = []
-    numerical_values = []
-    errors = []
-    upper_bounds = []
+    # calls to bulk_create. The writer is populated with data during
+    # the loop over subsets and writes it in batches whenever enough
+    # has been collected. The rest is inserted after the main loop.
+    writer = ingest.DatapointWriter(dataset, request.user)
+    band_k_labels = None
     multiple_subsets = int(form.cleaned_data['number_of_subsets']) > 1
     for i_subset in range(1, int(form.cleaned_data['number_of_subsets']) + 1):
         # Create data subset
@@ -700,99 +900,36 @@ def submit_data(request):
                 multiple_subsets)
             for symbol, key in (('a', 'a'), ('b', 'b'), ('c', 'c'),
                                 ('α', 'alpha'), ('β', 'beta'), ('γ', 'gamma')):
-                datapoint = models.Datapoint.objects.create(
-                    created_by=request.user, subset=subset)
-                datapoint.symbols.create(created_by=request.user, value=symbol)
-                name = f'lattice_constant_{key}_{i_subset}'
-                value, value_type, error, upper_bound = clean_value(
-                    form.cleaned_data[name])
-                models.NumericalValue.objects.create(created_by=request.user,
-                                                     datapoint=datapoint,
-                                                     value_type=value_type,
-                                                     value=value)
-                if error:
-                    models.Error.objects.create(
-                        created_by=request.user,
-                        numerical_value=models.NumericalValue.objects.last(),
-                        value=float(error))
-                if upper_bound:
-                    models.UpperBound.objects.create(
-                        created_by=request.user,
-                        numerical_value=models.NumericalValue.objects.last(),
-                        value=float(upper_bound))
-            lattice_vectors = []
-            lattice_errors = []  # dummy
-            lattice_upper_bounds = []  # dummy
-            for line in form.cleaned_data[
-                    f'atomic_coordinates_{i_subset}'].split('\n'):
-                if form.cleaned_data[f'geometry_format_{i_subset}'] != 'aims':
-                    break
+                i_datapoint = writer.add_datapoint(subset)
+                writer.add_symbol(i_datapoint, symbol)
+                writer.add_value(i_datapoint, *ingest.clean_value(
+                    form.cleaned_data[f'lattice_constant_{key}_{i_subset}']))
+            if form.cleaned_data[f'geometry_format_{i_subset}'] == 'aims':
                 try:
-                    m = re.match(r'\s*lattice_vector' +
-                                 3*r'\s+(-?\d+(?:\.\d+)?)' + r'\b', line)
-                    if m:
-                        coords = m.groups()
-                        models.Datapoint.objects.create(
-                            created_by=request.user, subset=subset)
-                        for i_coord, coord in enumerate(coords):
-                            add_numerical_value(lattice_vectors,
-                                                lattice_errors,
-                                                lattice_upper_bounds,
-                                                coord,
-                                                counter=i_coord)
-                    else:
-                        m = re.match(
-                            r'\s*(atom|atom_frac)\s+' +
-                            3*r'(-?\d+(?:\.\d+)?(?:\(\d+\))?)\s+' +
-                            r'(\w+)\b', line)
-                        coord_type, *coords, element = m.groups()
-                        datapoints.append(models.Datapoint(
-                            created_by=request.user, subset=subset))
-                        symbols.append(models.Symbol(created_by=request.user,
-                                                     value=coord_type))
-                        symbols.append(models.Symbol(created_by=request.user,
-                                                     value=element, counter=1))
-                        for i_coord, coord in enumerate(coords):
-                            add_numerical_value(numerical_values,
-                                                errors,
-                                                upper_bounds,
-                                                coord,
-                                                counter=i_coord)
-                except AttributeError:
-                    # Skip comments and empty lines
-                    if not re.match(r'(?:\r?$|#|//)', line):
-                        return error_and_return(
-                            form, dataset, f'Could not process line: {line}')
-            add_datapoint_ids(lattice_vectors, 9, 3)
-            models.NumericalValue.objects.bulk_create(lattice_vectors)
+                    writer.add_geometry(subset, ingest.parse_geometry(
+                        form.cleaned_data[f'atomic_coordinates_{i_subset}']))
+                except ValueError as error:
+                    return error_and_return(form, dataset, str(error))
         elif dataset.primary_property.name == 'band structure':
             # Get kpoints
             k_labels = []
             for line in form.cleaned_data[
                     f'subset_datapoints_{i_subset}'].splitlines():
-                if skip_this_line(line):
+                if ingest.skip_this_line(line):
                     continue
                 k_labels.append(line.split())
-            # Get files
-            files = []
             for f in dataset.files.all():
-                if re.match(r'band10\d+\.out',
-                            os.path.basename(f.dataset_file.name)):
-                    files.append(f.dataset_file)
                 if os.path.basename(f.dataset_file.name) in [
                         'band_structure_full.png', 'band_structure_small.png']:
                     return error_and_return(
                         form, dataset,
                         f'Rename {os.path.basename(f.dataset_file.name)} '
                         '(this name is reserved)')
-            # The band files need to be alphabeticaly sorted
-            for i in range(len(files)):
-                for j in range(i+1, len(files)):
-                    if files[i].name > files[j].name:
-                        files[i], files[j] = files[j], files[i]
-            utils.plot_band_structure(k_labels, files, dataset)
+            # The plot is created in the background. Each subset
+            # would overwrite the plot of the previous one anyway.
+            band_k_labels = k_labels
         elif dataset.primary_property.name.startswith('phase transition '):
-            value, value_type, error, upper_bound = clean_value(
+            value, value_type, error, upper_bound = ingest.clean_value(
                 form.cleaned_data[f'phase_transition_value_{i_subset}'])
             crystal_f = f'phase_transition_crystal_system_final_{i_subset}'
             space_group_i = f'phase_transition_space_group_initial_{i_subset}'
@@ -818,23 +955,11 @@ def submit_data(request):
                 i_subset,
                 multiple_subsets)
             try:
-                for line in form.cleaned_data[
-                        f'subset_datapoints_{i_subset}'].splitlines():
-                    if skip_this_line(line):
-                        continue
-                    x_value, y_value = line.split()[:2]
-                    datapoints.append(models.Datapoint(
-                        created_by=request.user, subset=subset))
-                    add_numerical_value(numerical_values,
-                                        errors,
-                                        upper_bounds,
-                                        x_value,
-                                        is_secondary=True)
-                    add_numerical_value(
-                        numerical_values, errors, upper_bounds, y_value)
-            except ValueError:
-                return error_and_return(
-                    form, dataset, f'Could not process line: {line}')
+                writer.add_values(subset, ingest.parse_values(
+                    form.cleaned_data[f'subset_datapoints_{i_subset}'],
+                    columns=2))
+            except ValueError as error:
+                return error_and_return(form, dataset, str(error))
         else:
             create_input_file(
                 dataset,
@@ -843,24 +968,16 @@ def submit_data(request):
                 i_subset,
                 multiple_subsets)
             try:
-                for line in form.cleaned_data[
-                        f'subset_datapoints_{i_subset}'].splitlines():
-                    if skip_this_line(line):
-                        continue
-                    for value in line.split():
-                        datapoints.append(models.Datapoint(
-                            created_by=request.user, subset=subset))
-                        add_numerical_value(
-                            numerical_values, errors, upper_bounds, value)
-            except ValueError:
-                return error_and_return(
-                    form, dataset, f'Could not process line: {line}')
+                writer.add_values(subset, ingest.parse_values(
+                    form.cleaned_data[f'subset_datapoints_{i_subset}']))
+            except ValueError as error:
+                return error_and_return(form, dataset, str(error))
         # Fixed properties
         counter = 0
         for key in form.cleaned_data:
             if key.startswith(f'fixed_property_{i_subset}_'):
                 suffix = key.split('fixed_property_')[1]
-                value, value_type, error, upper_bound = clean_value(
+                value, value_type, error, upper_bound = ingest.clean_value(
                     form.cleaned_data['fixed_value_' + suffix])
                 subset.fixed_values.create(
                     created_by=request.user,
@@ -874,41 +991,29 @@ def submit_data(request):
                     upper_bound=upper_bound)
                 counter += 1
     # Insert the main data into the database
-    models.Datapoint.objects.bulk_create(datapoints)
-    add_datapoint_ids(numerical_values, len(numerical_values), len(datapoints))
-    models.NumericalValue.objects.bulk_create(numerical_values)
-    models.Error.objects.bulk_create(
-        generate_numerical_value_ids(errors, models.Error))
-    models.UpperBound.objects.bulk_create(
-        generate_numerical_value_ids(upper_bounds, models.UpperBound))
-    add_datapoint_ids(symbols, len(symbols), len(datapoints))
-    models.Symbol.objects.bulk_create(symbols)
+    writer.flush()
     # Linked data sets
-    for pk in form.cleaned_data['related_data_sets'].split():
-        try:
-            dataset.linked_to.add(models.Dataset.objects.get(pk=pk))
-        except models.Dataset.DoesNotExist:
-            return error_and_return(
-                form, dataset, f'Related data set {pk} does not exist')
-    # Create static files for Qresp
-    qresp.create_static_files(request, dataset)
+    related = set(map(int, form.cleaned_data['related_data_sets'].split()))
+    missing = related - set(models.Dataset.objects.filter(
+        pk__in=related).values_list('pk', flat=True))
+    if missing:
+        return error_and_return(
+            form, dataset, f'Related data set {min(missing)} does not exist')
+    if related:
+        dataset.link(*related)
+    # Band structures are plotted in the background
+    if band_k_labels is not None:
+        jobs.enqueue('create_static_files', dataset, k_labels=band_k_labels)
     # Import data from Qresp
     if form.cleaned_data['qresp_fetch_url']:
-        paper_detail = requests.get(
-            form.cleaned_data['qresp_fetch_url'], verify=False).json()
-        download_url = paper_detail['fileServerPath']
-        chart_detail = paper_detail['charts'][
-            form.cleaned_data['qresp_chart_nr']]
-        chart = requests.get(f'{download_url}/{chart_detail["imageFile"]}',
-                             verify=False)
-        file_name = chart_detail["imageFile"].replace('/', '_')
-        f = SimpleUploadedFile(file_name, chart.content)
-        dataset.files.create(created_by=dataset.created_by, dataset_file=f)
+        jobs.enqueue('fetch_qresp_chart', dataset,
+                     url=form.cleaned_data['qresp_fetch_url'],
+                     chart_nr=form.cleaned_data['qresp_chart_nr'])
     # If all went well, let the user know how much data was
     # successfully added
     n_data_points = 0
     for subset in dataset.subsets.all():
-        n_data_points += subset.datapoints.count()
+        n_data_points += subset.num_datapoints()
     if n_data_points > 0:
         message = (f'{n_data_points} new '
                    f'data point{"s" if n_data_points != 1 else ""} '
@@ -1006,67 +1111,148 @@ def autofill_input_data(request):
     return HttpResponse('\n'.join(lines))
 
 
+def chart_data_versions(request, pks):
+    """Return utils.chart_data_versions(pks) for this request.
+
+    The result is kept on the request so that the ETag and the
+    Last-Modified header are computed with a single query.
+
+    """
+    if not hasattr(request, 'chart_data_versions'):
+        request.chart_data_versions = utils.chart_data_versions(pks)
+    return request.chart_data_versions
+
+
+def chart_data_cache_key(pk, version):
+    return f'data-for-chart-{pk}-{version.timestamp()}'
+
+
+def data_for_chart_last_modified(request, pk):
+    return chart_data_versions(request, [pk]).get(pk)
+
+
+def data_for_chart_etag(request, pk):
+    last_modified = data_for_chart_last_modified(request, pk)
+    if last_modified:
+        return chart_data_cache_key(pk, last_modified)
+    return None
+
+
+@cache_control(no_cache=True)
+@condition(etag_func=data_for_chart_etag,
+           last_modified_func=data_for_chart_last_modified)
 def data_for_chart(request, pk):
-    dataset = models.Dataset.objects.get(pk=pk)
-    if dataset.primary_unit:
-        primary_unit_label = dataset.primary_unit.label
-    else:
-        primary_unit_label = ''
-    if dataset.secondary_unit:
-        secondary_unit_label = dataset.secondary_unit.label
-    else:
-        secondary_unit_label = ''
-    response = {'primary-property': dataset.primary_property.name,
-                'primary-unit': primary_unit_label,
-                'secondary-property': dataset.secondary_property.name,
-                'secondary-unit': secondary_unit_label,
-                'data': []}
-    if dataset.primary_property_label:
-        response['primary-property'] = dataset.primary_property_label
-    if dataset.secondary_property_label:
-        response['secondary-property'] = (
-            f'{dataset.secondary_property.name} '
-            f'({dataset.secondary_property_label})')
-    for subset in dataset.subsets.all():
-        response['data'].append({})
-        this_subset = response['data'][-1]
-        this_subset['subset-label'] = subset.label
-        fixed_values = []
-        for value in models.NumericalValueFixed.objects.filter(subset=subset):
-            fixed_values.append(f' {value.physical_property} = '
-                                f'{value.formatted()} {value.unit}')
-        if this_subset['subset-label']:
-            this_subset['subset-label'] = (
-                f"{this_subset['subset-label']}:{','.join(fixed_values)}")
-        else:
-            this_subset['subset-label'] = (','.join(fixed_values)).lstrip()
-        this_subset['subset-label'] += (
-            f' ({models.Subset.CRYSTAL_SYSTEMS[subset.crystal_system][1]})')
-        values = models.NumericalValue.objects.filter(
-            datapoint__subset=subset).order_by(
-                'datapoint_id', 'qualifier').values_list('value', flat=True)
-        this_subset['values'] = []
-        for i in range(0, len(values), 2):
-            this_subset['values'].append({'y': values[i], 'x': values[i+1]})
-    return JsonResponse(response)
+    """Return the data for plotting data set pk.
+
+    The response is cached under the ETag, which changes whenever the
+    data set is updated. Repeated requests from the browser are
+    answered with 304 Not Modified.
+
+    """
+    key = data_for_chart_etag(request, pk)
+    if not key:
+        raise Http404
+    payload = cache.get(key)
+    if payload is None:
+        payload = utils.chart_data(models.Dataset.objects.filter(pk=pk))[pk]
+        cache.set(key, payload)
+    return JsonResponse(payload)
+
+
+def get_chart_pks(request):
+    """Return the data set pks from the "pks" query parameter."""
+    return sorted({int(pk) for pk in request.GET.get('pks', '').split(',')
+                   if pk.isdigit()})
+
+
+def data_for_charts_last_modified(request):
+    return max(chart_data_versions(request, get_chart_pks(request)).values(),
+               default=None)
+
+
+def data_for_charts_etag(request):
+    versions = chart_data_versions(request, get_chart_pks(request))
+    return hashlib.md5(' '.join(
+        chart_data_cache_key(pk, version)
+        for pk, version in sorted(versions.items())).encode()).hexdigest()
+
+
+@cache_control(no_cache=True)
+@condition(etag_func=data_for_charts_etag,
+           last_modified_func=data_for_charts_last_modified)
+def data_for_charts(request):
+    """Return the plotting data of several data sets at once.
+
+    The data sets are given as a comma-separated list of pks in the
+    "pks" query parameter, e.g., ?pks=1,2,3. The response maps each
+    pk to the same payload as data_for_chart. The payloads are looked
+    up in the cache with a single call and those that are missing
+    are built together with a fixed number of queries.
+
+    """
+    versions = chart_data_versions(request, get_chart_pks(request))
+    keys = {pk: chart_data_cache_key(pk, version)
+            for pk, version in versions.items()}
+    payloads = cache.get_many(keys.values())
+    missing = [pk for pk, key in keys.items() if key not in payloads]
+    if missing:
+        new_payloads = {
+            keys[pk]: payload for pk, payload in utils.chart_data(
+                models.Dataset.objects.filter(pk__in=missing)).items()}
+        cache.set_many(new_payloads)
+        payloads.update(new_payloads)
+    return JsonResponse({pk: payloads[key] for pk, key in keys.items()})
+
+
+def get_band_structure(request, pk):
+    """Return the bands within an energy window for plotting.
+
+    The window is given by the parameters emin and emax in eV relative
+    to the Fermi level. Optionally, the k-points can be restricted to
+    the range kmin...kmax and the number of k-points is limited to
+    points.
+
+    """
+    try:
+        energy_min = float(request.GET.get('emin', -8))
+        energy_max = float(request.GET.get('emax', 8))
+        k_min = int(request.GET.get('kmin', 0))
+        k_max = int(request.GET['kmax']) if 'kmax' in request.GET else None
+        max_points = min(int(request.GET.get('points', 1000)), 10000)
+    except ValueError:
+        return HttpResponseBadRequest('Invalid energy or k-point range')
+    if max_points < 1:
+        return HttpResponseBadRequest('points must be positive')
+    try:
+        data = utils.band_structure_window(pk, energy_min, energy_max,
+                                           k_min, k_max, max_points)
+    except FileNotFoundError:
+        raise Http404('Band energies are not available for this data set')
+    return JsonResponse(data)
+
+
+def qresp_figure(request, pk):
+    """Return the figure that represents the data set at Qresp.
+
+    The figure is created on the first request and cached until the
+    data set changes.
+
+    """
+    dataset = get_object_or_404(models.Dataset.objects.select_related(
+        'primary_property', 'primary_unit', 'secondary_property',
+        'secondary_unit'), pk=pk)
+    try:
+        return FileResponse(open(qresp.get_figure(dataset), 'rb'),
+                            content_type='image/png')
+    except FileNotFoundError:
+        raise Http404('The figure of this data set is not available yet')
 
 
 def get_subset_values(request, pk):
     """Return the numerical values of a subset as a formatted list."""
-    values = models.NumericalValue.objects.filter(
-        datapoint__subset__pk=pk).select_related(
-            'error').select_related('upperbound').order_by(
-                'qualifier', 'datapoint__pk')
-    total_len = len(values)
-    y_len = total_len
-    # With both x- and y-values, the y-values make up half the list.
-    if values.last().qualifier == models.NumericalValue.SECONDARY:
-        y_len = int(y_len/2)
-    response = []
-    for i in range(y_len):
-        response.append({'y': values[i].formatted()})
-    for i in range(y_len, total_len):
-        response[i-y_len]['x'] = values[i].formatted()
+    subset = models.Subset.objects.get(pk=pk)
+    response = [dict(zip(('y', 'x'), row))
+                for row in models.format_values(subset.get_values())]
     return JsonResponse(response, safe=False)
 
 
@@ -1108,12 +1294,11 @@ def report_issue(request):
         email_addresses = list(User.objects.filter(
             is_superuser=True).values_list('email', flat=True))
         email_addresses.append(request.user.email)
-        send_mail(
-            f'Issue report about dataset {pk}', '', 'matd3info',
-            email_addresses,
-            fail_silently=False,
-            html_message=body,
-        )
+        jobs.enqueue(
+            'send_mail',
+            subject=f'Issue report about dataset {pk}', message='',
+            from_email='matd3info', recipient_list=email_addresses,
+            fail_silently=False, html_message=body)
         messages.success(request, 'Your report has been registered.')
     else:
         messages.error(request,